@@ -1,11 +1,27 @@
+import json
 from glob import glob
 from pathlib import Path
 
 import click
 from loguru import logger
 
-from cioos_metadata_conversion import erddap
-from cioos_metadata_conversion.record import OUTPUT_FORMATS, Record, InputSchemas
+from cioos_metadata_conversion import (
+    datacite_sync,
+    dependencies,
+    erddap,
+    jobs,
+    mirror,
+    sharding,
+    validation,
+)
+from cioos_metadata_conversion.contacts import contact_registry, intern_contacts
+from cioos_metadata_conversion.mirror import FirebaseMirror
+from cioos_metadata_conversion.record import (
+    LANGUAGE_OUTPUT_FORMATS,
+    OUTPUT_FORMATS,
+    InputSchemas,
+    Record,
+)
 
 
 def load(file: str, schema: str = "CIOOS"):
@@ -31,10 +47,22 @@ def cli():
 
 
 cli.add_command(erddap.update, name="erddap-update")
+cli.add_command(erddap.fragments, name="erddap-fragments")
+cli.add_command(mirror.mirror, name="firebase-mirror")
+cli.add_command(datacite_sync.sync, name="datacite-sync")
+cli.add_command(sharding.merge, name="merge-manifests")
+cli.add_command(jobs.enqueue, name="enqueue")
+cli.add_command(jobs.worker, name="worker")
 
 
 @cli.command(name="convert")
-@click.option("--input", "-i", required=True, help="Input file.")
+@click.option("--input", "-i", help="Input file.")
+@click.option("--mirror", "-m", help="SQLite Firebase mirror to use as input.")
+@click.option(
+    "--where",
+    "-w",
+    help="SQL condition used to select the mirror records, ex: \"region = 'pacific'\".",
+)
 @click.option(
     "--recursive", "-r", is_flag=True, help="Process files recursively.", default=False
 )
@@ -79,70 +107,275 @@ cli.add_command(erddap.update, name="erddap-update")
     help="Encoding of the output file.",
     show_default=True,
 )
+@click.option(
+    "--validate",
+    is_flag=True,
+    help="Validate the outputs against the schema of the output format. "
+    "DATACITE_XSD and ISO19115_3_XSD define the location of the XML schemas.",
+)
+@click.option(
+    "--validation-report",
+    type=click.Path(dir_okay=False),
+    help="JSON file to write the invalid records and validation failures to.",
+)
+@click.option(
+    "--language",
+    "-l",
+    help="Comma separated languages of the erddap and cff outputs, ex: en,fr. "
+    "One output is written per language, named <file>.<language>.<format>.",
+)
+@click.option(
+    "--skip-record-validation",
+    is_flag=True,
+    help="Convert the CIOOS records without checking first the fields "
+    "required by the output format.",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Only convert the records whose fields read by the output format "
+    "changed since the last incremental conversion to the same directory.",
+)
+@sharding.shard_option
+@sharding.manifest_option
 @logger.catch(reraise=True)
 def cli_convert(**kwargs):
     """Convert metadata records to different metadata formats or standards."""
     convert(**kwargs)
 
 
+def _get_sources(input, recursive, input_schema, mirror, where):
+    """Generate the (name, record) pairs to convert."""
+    if mirror:
+        with FirebaseMirror(mirror) as firebase_mirror:
+            for row in firebase_mirror.iter_records(where):
+                if not row["cioos"]:
+                    logger.error("No CIOOS record found for {}.", row["record_id"])
+                    continue
+                yield (
+                    f"{row['record_id']}.json",
+                    Record(source=row["cioos"], schema=InputSchemas.CIOOS),
+                )
+        return
+
+    logger.info("Loading input {}", input)
+    if input.startswith("http"):
+        files = [input]
+    else:
+        files = glob(input, recursive=recursive)
+
+    logger.debug("Processing {} files", len(files))
+    for file in files:
+        yield file, Record(source=file, schema=InputSchemas[input_schema])
+
+
+def _get_output_file(file, record, suffix, output_dir, output_file, language, mirror):
+    """Get the path of an output, None if it is returned instead."""
+    if output_file:
+        output_file = Path(output_file)
+        if language:
+            output_file = output_file.with_suffix(f".{language}{output_file.suffix}")
+        return output_file
+    if output_dir and (record.source_is_path() or mirror):
+        if language:
+            suffix = f".{language}{suffix}"
+        return Path(output_dir) / Path(file).with_suffix(suffix).name
+    return None
+
+
 @logger.catch(reraise=True)
+@contact_registry()
 def convert(
-    input,
-    output_format: str,
+    input=None,
+    output_format: str | None = None,
     recursive: bool = False,
     input_schema: str = "CIOOS",
     encoding: str = "utf-8",
     output_dir: str = ".",
-    output_file: str = None,
+    output_file: str | None = None,
     output_encoding: str = "utf-8",
+    mirror: str | None = None,
+    where: str | None = None,
+    validate: bool = False,
+    validation_report: str | None = None,
+    skip_record_validation: bool = False,
+    language: str | None = None,
+    incremental: bool = False,
+    shard: tuple | None = None,
+    manifest: str | None = None,
 ):
     """Convert metadata records to different metadata formats or standards."""
 
-    logger.info("Loading input {}", input)
-    if input.startswith("http"):
-        files = [input]
-    else:
-        files = glob(input, recursive=recursive)
+    if not input and not mirror:
+        raise ValueError("An input or a mirror is required.")
+
+    languages = None
+    if language:
+        languages = [item.strip() for item in language.split(",") if item.strip()]
+        if output_format not in LANGUAGE_OUTPUT_FORMATS:
+            raise ValueError(
+                f"{output_format} outputs include all the languages, "
+                f"--language only applies to {list(LANGUAGE_OUTPUT_FORMATS)}."
+            )
 
-    if len(files) > 1 and output_file:
+    sources = list(_get_sources(input, recursive, input_schema, mirror, where))
+    if isinstance(shard, str):
+        shard = sharding.parse_shard(shard)
+    if shard:
+        keys = [str(file) for file, _ in sources]
+        sources = [
+            (file, record)
+            for file, record in sources
+            if sharding.in_shard(str(file), shard)
+        ]
+    if len(sources) > 1 and output_file:
         raise ValueError(
             "Cannot specify output file when processing multiple files. Define an output directory instead."
         )
 
-    logger.debug("Processing {} files", len(files))
+    state_file = None
+    state = {}
+    n_unchanged = 0
+    if incremental:
+        state_dir = Path(output_file).parent if output_file else Path(output_dir)
+        state_file = state_dir / dependencies.STATE_FILE
+        state = dependencies.load_state(state_file)
+
     returned_output = ""
-    for file in files:
+    written = []
+    invalid_records = []
+    n_validated = 0
+    validation_failures = []
+    schema_missing = False
+    for file, record in sources:
         logger.debug("Processing file {}", file)
-        record = (
-            Record(
-                source=file,
-                schema=InputSchemas[input_schema],
-            )
-            .load(encoding=encoding)
-            .convert_to_cioos_schema()
-        )
+        record = record.load(encoding=encoding).convert_to_cioos_schema()
 
         if not record.metadata:
             logger.error("No metadata record found in file {}.", file)
             continue
 
+        if not skip_record_validation:
+            errors = validation.validate_record(
+                record.metadata, output_format, languages
+            )
+            if errors:
+                logger.error(
+                    "Skip invalid CIOOS record {}: {}",
+                    file,
+                    validation.format_errors(errors),
+                )
+                invalid_records.append({"file": str(file), "errors": errors})
+                continue
+
+        suffix = f".{output_format}"
+        output_files = {
+            output_language: _get_output_file(
+                file, record, suffix, output_dir, output_file, output_language, mirror
+            )
+            for output_language in languages or [None]
+        }
+        if incremental:
+            state_key = Path(file).with_suffix(suffix).name
+            digest = dependencies.dependency_digest(
+                record.metadata, output_format, languages=languages
+            )
+            if state.get(state_key) == digest and all(
+                output and output.exists() for output in output_files.values()
+            ):
+                logger.debug("Skip {}, unchanged since the last conversion", file)
+                n_unchanged += 1
+                continue
+
         logger.debug(f"Converting to {output_format}")
-        converted_record = record.convert_to(output_format)
+        intern_contacts(record.metadata)
+        converted_record = record.convert_to(output_format, languages=languages)
+        outputs = converted_record if languages else {None: converted_record}
+
+        n_failures = len(validation_failures)
+        for output_language, converted_record in outputs.items():
+            output_suffix = suffix
+            if output_language:
+                output_suffix = f".{output_language}{suffix}"
+            if validate:
+                errors = validation.validate(output_format, converted_record)
+                if errors is None and not schema_missing:
+                    logger.warning(
+                        "No {} schema available, skip validation.", output_format
+                    )
+                    schema_missing = True
+                elif errors is not None:
+                    n_validated += 1
+                if errors:
+                    logger.error(
+                        "{} is not valid {}: {} errors, {}",
+                        Path(file).with_suffix(output_suffix).name,
+                        output_format,
+                        len(errors),
+                        errors[0]["message"],
+                    )
+                    validation_failures.append(
+                        {
+                            "file": str(file),
+                            "format": output_format,
+                            "language": output_language,
+                            "errors": errors,
+                        }
+                    )
 
-        # Generate output file path
-        if output_dir and not output_file and record.source_is_path():
-            output_file = (
-                Path(output_dir) / Path(file).with_suffix(f".{output_format}").name
+            # Write to file or return output
+            file_output = output_files[output_language]
+            if file_output:
+                logger.info("Writing to file {}", file_output)
+                file_output.write_text(converted_record, encoding=output_encoding)
+                written.append(str(file_output))
+            else:
+                returned_output += "\n" + converted_record
+
+        # Invalid outputs are converted again by the next run
+        if incremental and len(validation_failures) == n_failures:
+            state[state_key] = digest
+
+    if incremental:
+        logger.info("{} unchanged records skipped", n_unchanged)
+        dependencies.write_state(state_file, state)
+    if shard:
+        sharding.write_manifest(
+            manifest or sharding.manifest_path(output_dir, shard),
+            "convert",
+            shard,
+            keys,
+            [str(file) for file, _ in sources],
+            written,
+            failed=sorted(
+                {item["file"] for item in invalid_records + validation_failures}
+            ),
+        )
+    if validate:
+        logger.info(
+            "{} of {} outputs valid",
+            n_validated - len(validation_failures),
+            n_validated,
+        )
+    if validation_report:
+        Path(validation_report).write_text(
+            json.dumps(
+                {
+                    "invalid_records": invalid_records,
+                    "validated": n_validated,
+                    "failures": validation_failures,
+                },
+                indent=2,
             )
-        elif output_file:
-            output_file = Path(output_file)
-
-        # Write to file or return output
-        if output_file:
-            logger.info("Writing to file {}", output_dir)
-            output_file.write_text(converted_record, encoding=output_encoding)
-        else:
-            returned_output += "\n" + converted_record
+        )
+    if invalid_records:
+        raise ValueError(
+            f"{len(invalid_records)} invalid CIOOS records skipped, see the errors above."
+        )
+    if validation_failures:
+        raise ValueError(
+            f"{len(validation_failures)} outputs failed {output_format} validation."
+        )
 
     return returned_output
 
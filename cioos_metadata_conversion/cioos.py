@@ -1,11 +1,21 @@
-from cioos_metadata_conversion.firebase_to_cioos import (
-    record_json_to_yaml,
-)
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import cache
+
+import requests
 from google.auth.transport.requests import AuthorizedSession
 from google.oauth2 import service_account
 from loguru import logger
 
-from loguru import logger
+from cioos_metadata_conversion.firebase_to_cioos import (
+    record_json_to_yaml,
+)
+
+# Define the required scopes
+FIREBASE_SCOPES = (
+    "https://www.googleapis.com/auth/userinfo.email",
+    "https://www.googleapis.com/auth/firebase.database",
+)
+DEFAULT_MAX_WORKERS = 8
 
 
 @logger.catch(default={}, reraise=True)
@@ -19,12 +29,108 @@ def cioos_firebase_to_cioos_schema(record) -> dict:
     Returns:
         str: The converted record in CIOOS Schema format.
     """
-    return record_json_to_yaml.record_json_to_yaml(record)
+    return record_json_to_yaml(record)
+
+
+@cache
+def get_authorized_session(
+    firebase_auth_key, pool_size=DEFAULT_MAX_WORKERS
+) -> AuthorizedSession:
+    """
+    Get a pooled authorized session for a service account key.
+
+    The session is created once per key file and reused afterward. The
+    credentials attached to it keep their OAuth token until it expires and
+    only refresh it then.
+
+    Args:
+        firebase_auth_key (str): The Firebase authentication key.
+        pool_size (int): Number of connections kept alive by the session.
+
+    Returns:
+        AuthorizedSession: The shared authorized session.
+    """
+    credentials = service_account.Credentials.from_service_account_file(
+        firebase_auth_key, scopes=list(FIREBASE_SCOPES)
+    )
+    authed_session = AuthorizedSession(credentials)
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    authed_session.mount("https://", adapter)
+    return authed_session
+
+
+def _get_user_records(authed_session, url, record_status) -> list:
+    response = authed_session.get(url)
+    response.raise_for_status()
+    return [
+        record
+        for record in (response.json() or {}).values()
+        if record_status is None or record.get("status") in record_status
+    ]
+
+
+def iter_records_from_firebase(
+    region,
+    firebase_auth_key,
+    record_status,
+    database_url,
+    max_workers=DEFAULT_MAX_WORKERS,
+):
+    """
+    Fetch the records of a region user by user.
+
+    The user keys are first listed with a shallow query, then each user's
+    records are retrieved concurrently. Records are yielded as soon as their
+    user's response is received and filtered by status.
+
+    Args:
+        region (str): The region for which to fetch records.
+        firebase_auth_key (str): The Firebase authentication key.
+        record_status (list): The accepted record statuses, None for all.
+        database_url (str): The Firebase database URL.
+        max_workers (int): Maximum number of concurrent requests.
+
+    Yields:
+        dict: Records in Firebase format.
+    """
+    authed_session = get_authorized_session(firebase_auth_key, max_workers)
+
+    logger.info(f"Listing users for {region}")
+    response = authed_session.get(
+        f"{database_url}{region}/users.json", params={"shallow": "true"}
+    )
+    response.raise_for_status()
+    users = list(response.json() or {})
+    logger.info("Fetching records for {} users", len(users))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                _get_user_records,
+                authed_session,
+                f"{database_url}{region}/users/{user}/records.json",
+                record_status,
+            ): user
+            for user in users
+        }
+        try:
+            for future in as_completed(futures):
+                yield from future.result()
+        finally:
+            for future in futures:
+                future.cancel()
 
 
 @logger.catch(default=[], reraise=True)
 def get_records_from_firebase(
-    region, firebase_auth_key, record_url, record_status, database_url
+    region,
+    firebase_auth_key,
+    record_url,
+    record_status,
+    database_url,
+    max_workers=None,
 ) -> list:
     """
     Fetch records from Firebase and convert them to CIOOS schema.
@@ -33,24 +139,22 @@ def get_records_from_firebase(
         region (str): The region for which to fetch records.
         firebase_auth_key (str): The Firebase authentication key.
         record_url (str): The URL for the record.
-        record_status (str): The status of the record.
+        record_status (str): The status of the record, None for all.
         database_url (str): The Firebase database URL.
+        max_workers (int, optional): Fetch each user's records concurrently
+            with this many workers instead of downloading the whole region.
 
     Returns:
         list: A list of records in CIOOS Schema format.
     """
+    if not record_url and max_workers:
+        return list(
+            iter_records_from_firebase(
+                region, firebase_auth_key, record_status, database_url, max_workers
+            )
+        )
 
-    # Define the required scopes
-    scopes = [
-        "https://www.googleapis.com/auth/userinfo.email",
-        "https://www.googleapis.com/auth/firebase.database",
-    ]
-
-    # Authenticate a credential with the service account
-    credentials = service_account.Credentials.from_service_account_file(
-        firebase_auth_key, scopes=scopes
-    )
-    authed_session = AuthorizedSession(credentials)
+    authed_session = get_authorized_session(firebase_auth_key)
 
     # Generate the URL to query
     if record_url:
@@ -72,5 +176,5 @@ def get_records_from_firebase(
         record
         for user in response.json().values()
         for record in user.get("records", {}).values()
-        if record.get("status") in record_status
+        if record_status is None or record.get("status") in record_status
     ]
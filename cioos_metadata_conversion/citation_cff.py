@@ -3,11 +3,28 @@ Module dedicated to the citation file format:
 <https://citation-file-format.github.io>
 """
 
-import pycountry
 import yaml
 from loguru import logger
 
-from cioos_metadata_conversion.utils import drop_empty_values
+from cioos_metadata_conversion.contacts import contact_view, dict_key
+from cioos_metadata_conversion.countries import get_country_code
+from cioos_metadata_conversion.utils import NoAliasDumper, drop_empty_values
+
+# CIOOS record fields read by citation_cff
+DEPENDENCIES = (
+    "contact",
+    "distribution",
+    "identification.abstract",
+    "identification.edition",
+    "identification.identifier",
+    "identification.keywords",
+    "identification.title",
+    "metadata.dates.revision",
+    "metadata.identifier",
+    "metadata.maintenance_note",
+    "metadata.naming_authority",
+    "metadata.use_constraints.licence",
+)
 
 
 def _get_placeholder(language):
@@ -19,16 +36,6 @@ def _get_placeholder(language):
         return "Not available"
 
 
-def _get_country_code(country_name):
-    if not country_name:
-        return None
-    try:
-        return pycountry.countries.lookup(country_name).alpha_2
-    except LookupError:
-        logger.warning(f"Country {country_name} not found in pycountry")
-        return None
-
-
 def _fix_url(url):
     if not url:
         return None
@@ -50,7 +57,7 @@ def get_cff_person(author):
             "affiliation": author.get("organization", {}).get("name"),
             "address": author.get("organization", {}).get("address"),
             "city": author.get("organization", {}).get("city"),
-            "country": _get_country_code(author.get("organization", {}).get("country")),
+            "country": get_country_code(author.get("organization", {}).get("country")),
             "website": _fix_url(author.get("organization", {}).get("url")),
             # "ror": author["organization"].get("ror"), # not in CFF schema
         }
@@ -63,7 +70,7 @@ def get_cff_entity(entity):
             "name": entity["organization"]["name"],
             "address": entity["organization"].get("address"),
             "city": entity["organization"].get("city"),
-            "country": _get_country_code(entity["organization"].get("country")),
+            "country": get_country_code(entity["organization"].get("country")),
             "email": entity["organization"].get("email"),
             "website": _fix_url(entity["organization"].get("url")),
             "orcid": entity["organization"].get("orcid"),
@@ -72,6 +79,7 @@ def get_cff_entity(entity):
     )
 
 
+@contact_view
 def get_cff_contact(contact):
     return (
         get_cff_person(contact)
@@ -96,54 +104,66 @@ def _get_doi(record):
     ]
 
 
-def _get_ressources(record, language):
-    ressources = []
+def _get_distributions(record):
+    distributions = []
     for distribution in record["distribution"]:
         if not distribution.get("url", "").startswith("http"):
             logger.warning(f"Invalid ressource URL: {distribution.get('url')}")
             continue
-        ressources.append(
-            {
-                "description": ": ".join(
-                    [
-                        item
-                        for item in [
-                            distribution.get("name", {}).get(language, ""),
-                            distribution.get("description", {}).get(
-                                language, _get_placeholder(language)
-                            ),
-                        ]
-                        if item
+        distributions.append(distribution)
+    return distributions
+
+
+def _get_ressources(distributions, language):
+    return [
+        {
+            "description": ": ".join(
+                [
+                    item
+                    for item in [
+                        distribution.get("name", {}).get(language, ""),
+                        distribution.get("description", {}).get(
+                            language, _get_placeholder(language)
+                        ),
                     ]
-                ),
-                "type": "url",
-                "value": distribution.get("url", ""),
-            }
-        )
-    return ressources
+                    if item
+                ]
+            ),
+            "type": "url",
+            "value": distribution.get("url", ""),
+        }
+        for distribution in distributions
+    ]
 
 
 def _get_unique_authors(record):
-    authors = []
+    authors = {}
     for author in record["contact"]:
         contact = get_cff_contact(author)
-        if contact not in authors:
-            authors.append(contact)
-    return authors
+        authors.setdefault(dict_key(contact), contact)
+    return list(authors.values())
 
 
-def citation_cff(
+def citation_cff_by_language(
     record,
+    languages,
     output_format="yaml",
-    language: str = "en",
     message="If you use this software, please cite it as below",
     ressource_base_url="https://catalogue.cioos.org/dataset/",
     record_type="dataset",
-) -> str:
-    """Generate a convention.cff file from a CKAN record.
+) -> dict:
+    """Generate the citation.cff files of a record in several languages.
 
-    This is based on the documentation at:
-    <https://github.com/citation-file-format/citation-file-format/blob/main/schema-guide.md#identifiers>
+    The authors, contacts, identifiers and licence don't depend on the
+    language and are generated once for all the languages.
+
+    Args:
+        record (dict): A metadata record.
+        languages (list): The languages to generate the files in.
+        output_format (str, optional): "yaml", or None for the CFF dicts.
+
+    Returns:
+        dict: The citation.cff file in each language.
     """
     resource_url = (
         ressource_base_url
@@ -151,49 +171,23 @@ def citation_cff(
         + "_"
         + record["metadata"]["identifier"]
     )
+    distributions = _get_distributions(record)
 
-    record = {
+    # The language fields are set in place to keep the fields order
+    common_fields = {
         "cff-version": "1.2.0",
         "message": message,
         "authors": _get_unique_authors(record),
-        "title": record["identification"]["title"].get(language),
-        "abstract": record["identification"]["abstract"].get(language),
+        "title": None,
+        "abstract": None,
         "date-released": record["metadata"]["dates"]["revision"].split("T")[0],
         "contact": [
             get_cff_contact(contact)
             for contact in record["contact"]
             if "pointOfContact" in contact["roles"]
         ],
-        "identifiers": [
-            {
-                "description": f"{record['metadata']['naming_authority']} Unique Identifier",
-                "type": "other",
-                "value": record["metadata"]["identifier"],
-            },
-            {
-                "description": "Metadata record URL",
-                "type": "url",
-                "value": resource_url,
-            },
-            *_get_doi(record),
-            {
-                "description": "Metadata Form used to generate this record",
-                "type": "url",
-                "value": record["metadata"]["maintenance_note"].replace(
-                    "Generated from ", ""
-                ),
-            },
-            *_get_ressources(record, language=language),
-        ],
-        "keywords": sorted(
-            set(
-                [
-                    keyword
-                    for _, group in record["identification"]["keywords"].items()
-                    for keyword in group.get(language, [])
-                ]
-            )
-        ),
+        "identifiers": None,
+        "keywords": None,
         "license": record["metadata"]
         .get("use_constraints", {})
         .get("licence", {})
@@ -206,8 +200,68 @@ def citation_cff(
         "url": resource_url,
         "version": record["identification"].get("edition"),
     }
-    record = drop_empty_values(record)
+    identifiers = [
+        {
+            "description": f"{record['metadata']['naming_authority']} Unique Identifier",
+            "type": "other",
+            "value": record["metadata"]["identifier"],
+        },
+        {
+            "description": "Metadata record URL",
+            "type": "url",
+            "value": resource_url,
+        },
+        *_get_doi(record),
+        {
+            "description": "Metadata Form used to generate this record",
+            "type": "url",
+            "value": record["metadata"]["maintenance_note"].replace(
+                "Generated from ", ""
+            ),
+        },
+    ]
+
+    outputs = {}
+    for language in languages:
+        cff = drop_empty_values(
+            {
+                **common_fields,
+                "title": record["identification"]["title"].get(language),
+                "abstract": record["identification"]["abstract"].get(language),
+                "identifiers": identifiers + _get_ressources(distributions, language),
+                "keywords": sorted(
+                    {
+                        keyword
+                        for _, group in record["identification"]["keywords"].items()
+                        for keyword in group.get(language, [])
+                    }
+                ),
+            }
+        )
+        if output_format == "yaml":
+            cff = yaml.dump(cff, Dumper=NoAliasDumper, default_flow_style=False)
+        outputs[language] = cff
+    return outputs
 
-    if output_format == "yaml":
-        return yaml.dump(record, default_flow_style=False)
-    return record
+
+def citation_cff(
+    record,
+    output_format="yaml",
+    language: str = "en",
+    message="If you use this software, please cite it as below",
+    ressource_base_url="https://catalogue.cioos.org/dataset/",
+    record_type="dataset",
+) -> str:
+    """Generate a convention.cff file from a CKAN record.
+
+    This is based on the documentation at:
+    <https://github.com/citation-file-format/citation-file-format/blob/main/schema-guide.md#identifiers>
+    """
+    return citation_cff_by_language(
+        record,
+        [language],
+        output_format=output_format,
+        message=message,
+        ressource_base_url=ressource_base_url,
+        record_type=record_type,
+    )[language]
@@ -0,0 +1,132 @@
+"""
+Registry of the contacts shared by the records of a batch.
+
+The same people and organizations are listed by many records of a batch.
+Within a contact_registry scope, the individual and organization of each
+contact are interned, the records then share a single copy of them, and the
+contact views built by the converters are computed once per unique contact.
+Outside of a scope, the views are built on every call.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+_registry = ContextVar("contact_registry", default=None)
+CONTACT_PARTS = ("individual", "organization")
+_MISSING = object()
+
+
+def freeze(value):
+    """Convert a JSON like value to a hashable one."""
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def dict_key(value: dict):
+    """Get a hashable key of a dict, equal for equal dicts."""
+    try:
+        return frozenset(value.items())
+    except TypeError:
+        return freeze(value)
+
+
+class ContactRegistry:
+    """Interned contact parts and the views computed from them."""
+
+    def __init__(self) -> None:
+        self.parts = {}
+        self.views = {}
+        # The interned parts are kept alive by self.parts, their id is unique
+        self._interned = set()
+
+    def intern(self, part: dict) -> dict:
+        """Get the single instance of an individual or organization."""
+        if id(part) in self._interned:
+            return part
+        part = self.parts.setdefault(dict_key(part), part)
+        self._interned.add(id(part))
+        return part
+
+    def _part_key(self, part):
+        if part.__class__ is not dict:
+            return part
+        if id(part) not in self._interned:
+            part = self.intern(part)
+        return id(part)
+
+    def view(self, function, contact: dict, args: tuple):
+        """Compute the view of a contact once."""
+        key = (
+            function,
+            self._part_key(contact.get("individual", _MISSING)),
+            self._part_key(contact.get("organization", _MISSING)),
+            args,
+        )
+        view = self.views.get(key)
+        if view is None:
+            view = self.views[key] = function(contact, *args)
+        return view
+
+
+@contextmanager
+def contact_registry():
+    """
+    Share the contacts of the records converted within the scope.
+
+    A scope opened within another one reuses its registry.
+
+    Yields:
+        ContactRegistry: The registry of the batch.
+    """
+    registry = _registry.get()
+    if registry is not None:
+        yield registry
+        return
+    token = _registry.set(ContactRegistry())
+    try:
+        yield _registry.get()
+    finally:
+        _registry.reset(token)
+
+
+def intern_contacts(record: dict) -> dict:
+    """
+    Replace the contacts individual and organization of a record by their
+    registry instance, nothing is done outside of a registry scope.
+
+    Args:
+        record (dict): CIOOS record, modified in place.
+
+    Returns:
+        dict: The record.
+    """
+    registry = _registry.get()
+    if registry is None:
+        return record
+    for contact in record.get("contact") or []:
+        for name in CONTACT_PARTS:
+            if isinstance(contact.get(name), dict):
+                contact[name] = registry.intern(contact[name])
+    return record
+
+
+def contact_view(function):
+    """
+    Cache the view of a contact built by a converter in the registry scope.
+
+    The view must only depend on the contact individual and organization
+    and the other arguments, and must not be modified by the caller.
+    """
+
+    @wraps(function)
+    def wrapper(contact, *args):
+        registry = _registry.get()
+        if registry is None:
+            return function(contact, *args)
+        return registry.view(function, contact, args)
+
+    return wrapper
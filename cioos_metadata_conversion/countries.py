@@ -0,0 +1,102 @@
+"""
+Resolution of country names and codes to ISO 3166-1 alpha-2 codes.
+
+The index of the normalized English and French names, common aliases and
+codes of every country is built from pycountry on the first lookup. The
+resolved names, unknown ones included, are then memoized for the process.
+"""
+
+import gettext
+import re
+import unicodedata
+from functools import cache
+
+import pycountry
+from loguru import logger
+
+# Common names which aren't pycountry names or codes
+COUNTRY_ALIASES = {
+    "America": "US",
+    "U.S.": "US",
+    "U.S.A.": "US",
+    "United States of America": "US",
+    "Etats-Unis d'Amérique": "US",
+    "UK": "GB",
+    "U.K.": "GB",
+    "Great Britain": "GB",
+    "Grande-Bretagne": "GB",
+    "England": "GB",
+    "Angleterre": "GB",
+    "Scotland": "GB",
+    "Écosse": "GB",
+    "Wales": "GB",
+    "Pays de Galles": "GB",
+    "Northern Ireland": "GB",
+    "Russia": "RU",
+    "Russie": "RU",
+    "South Korea": "KR",
+    "Corée du Sud": "KR",
+    "North Korea": "KP",
+    "Corée du Nord": "KP",
+    "Holland": "NL",
+    "Hollande": "NL",
+    "Czech Republic": "CZ",
+    "République tchèque": "CZ",
+}
+
+
+def normalize_country_name(name: str) -> str:
+    """Normalize a country name case, accents and punctuation."""
+    name = unicodedata.normalize("NFKD", name.casefold())
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    return re.sub(r"[\W_]+", " ", name).strip()
+
+
+@cache
+def get_country_index() -> dict:
+    """
+    Build the index of the country names, aliases and codes.
+
+    Returns:
+        dict: The alpha-2 code of each normalized name.
+    """
+    french = gettext.translation(
+        "iso3166-1", pycountry.LOCALES_DIR, languages=["fr"], fallback=True
+    )
+    index = {}
+    for country in pycountry.countries:
+        names = [
+            getattr(country, field, None)
+            for field in ("name", "official_name", "common_name")
+        ]
+        for name in filter(None, names):
+            index[normalize_country_name(name)] = country.alpha_2
+            index[normalize_country_name(french.gettext(name))] = country.alpha_2
+    for alias, code in COUNTRY_ALIASES.items():
+        index[normalize_country_name(alias)] = code
+    # Codes take precedence over the names
+    for country in pycountry.countries:
+        index[country.alpha_2.lower()] = country.alpha_2
+        index[country.alpha_3.lower()] = country.alpha_2
+        index[country.numeric] = country.alpha_2
+    return index
+
+
+@cache
+def get_country_code(country_name: str) -> str:
+    """
+    Get the ISO 3166-1 alpha-2 code of a country.
+
+    Args:
+        country_name (str): English or French name, alias, alpha-2, alpha-3
+            or numeric code of the country.
+
+    Returns:
+        str: The alpha-2 code, None if the country is unknown.
+    """
+    if not country_name:
+        return None
+    code = get_country_index().get(normalize_country_name(country_name))
+    if not code:
+        logger.warning("Country {} not found in pycountry", country_name)
+    return code
@@ -7,6 +7,26 @@ from datetime import datetime
 
 from datacite import schema45
 from loguru import logger
+from lxml import etree
+
+from cioos_metadata_conversion.contacts import contact_view
+
+# CIOOS record fields read by generate_datacite_record
+DEPENDENCIES = (
+    "contact",
+    "identification.abstract",
+    "identification.dates",
+    "identification.edition",
+    "identification.identifier",
+    "identification.keywords",
+    "identification.temporal_begin",
+    "identification.temporal_end",
+    "identification.title",
+    "metadata.dates",
+    "metadata.language",
+    "metadata.use_constraints",
+    "spatial",
+)
 
 # TODO map cioos roles to datacite contributor roles
 CONTRIBUTOR_TYPE_MAPPING_FROM_CIOOS = {
@@ -67,6 +87,7 @@ def _get_organization_info(contact) -> dict:
     }
 
 
+@contact_view
 def _get_contact_info(contact) -> dict:
     """
     Get the contact information from the Cioos record.
@@ -228,7 +249,7 @@ def _get_dates(record) -> list:
         ]
         + [
             {
-                "date": f"{record['identification'].get('temporal_begin','*')}/{record['identification'].get('temporal_end', '*')}",
+                "date": f"{record['identification'].get('temporal_begin', '*')}/{record['identification'].get('temporal_end', '*')}",
                 "dateType": "Collected",
             }
         ]
@@ -306,7 +327,8 @@ def _get_geo_bounding_box(record) -> dict:
 
 
 def _get_unique_dicts(dict_list: list) -> list:
-    unique_dicts = {frozenset(d.items()) for d in dict_list}
+    # Keep the first occurrence order for the output to be reproducible
+    unique_dicts = dict.fromkeys(frozenset(d.items()) for d in dict_list)
     return [dict(items) for items in unique_dicts]
 
 
@@ -413,6 +435,239 @@ def generate_datacite_record(record) -> dict:
     }
 
 
+# Properties serialized in the order of the DataCite schema45 rules
+XML_PROPERTIES = (
+    "alternateIdentifiers",
+    "creators",
+    "titles",
+    "publisher",
+    "publicationYear",
+    "subjects",
+    "contributors",
+    "dates",
+    "language",
+    "types",
+    "doi",
+    "relatedIdentifiers",
+    "sizes",
+    "formats",
+    "version",
+    "rightsList",
+    "descriptions",
+    "geoLocations",
+    "fundingReferences",
+    "relatedItems",
+)
+# Properties only serialized by schema45
+SCHEMA45_ONLY_PROPERTIES = ("sizes", "formats", "relatedItems")
+XML_LANG = "{xml}lang"
+
+
+def _set(element, attribute, value):
+    if value:
+        element.set(attribute, value)
+
+
+def _text_element(parent, tag, text, **attributes):
+    element = etree.SubElement(parent, tag, **attributes)
+    element.text = text
+    return element
+
+
+def _add_name(parent, value, tag):
+    name = _text_element(parent, tag, value["name"])
+    _set(name, "nameType", value.get("nameType"))
+    _set(name, XML_LANG, value.get("lang"))
+    if value.get("givenName"):
+        _text_element(parent, "givenName", value["givenName"])
+    if value.get("familyName"):
+        _text_element(parent, "familyName", value["familyName"])
+    for identifier in value.get("nameIdentifiers", []):
+        if identifier.get("nameIdentifier"):
+            element = _text_element(
+                parent,
+                "nameIdentifier",
+                identifier["nameIdentifier"],
+                nameIdentifierScheme=identifier["nameIdentifierScheme"],
+            )
+            _set(element, "schemeURI", identifier.get("schemeUri"))
+    for affiliation in value.get("affiliation", []):
+        if affiliation.get("name"):
+            element = _text_element(parent, "affiliation", affiliation["name"])
+            _set(
+                element,
+                "affiliationIdentifier",
+                affiliation.get("affiliationIdentifier"),
+            )
+            _set(
+                element,
+                "affiliationIdentifierScheme",
+                affiliation.get("affiliationIdentifierScheme"),
+            )
+            _set(element, "schemeURI", affiliation.get("schemeUri"))
+
+
+def _add_point(parent, tag, point):
+    element = etree.SubElement(parent, tag)
+    _text_element(element, "pointLongitude", str(point["pointLongitude"]))
+    _text_element(element, "pointLatitude", str(point["pointLatitude"]))
+
+
+def _element(tag, text=None, **attributes):
+    element = etree.Element(tag, **attributes)
+    element.text = text
+    return element
+
+
+def _property_element(name, value):
+    """
+    Build the XML element of a DataCite property.
+    """
+    if name in ("publicationYear", "language", "version"):
+        return _element(name, value)
+    if name == "doi":
+        return _element("identifier", value, identifierType="DOI")
+    if name == "types":
+        return _element(
+            "resourceType",
+            value.get("resourceType"),
+            resourceTypeGeneral=value["resourceTypeGeneral"],
+        )
+    if name == "publisher":
+        element = _element("publisher", value.get("name"))
+        _set(element, "publisherIdentifier", value.get("publisherIdentifier"))
+        _set(
+            element, "publisherIdentifierScheme", value.get("publisherIdentifierScheme")
+        )
+        _set(element, "schemeURI", value.get("schemeUri"))
+        return element
+
+    parent = etree.Element(name)
+    if name == "alternateIdentifiers":
+        for item in value:
+            element = _text_element(
+                parent, "alternateIdentifier", item["alternateIdentifier"]
+            )
+            _set(
+                element, "alternateIdentifierType", item.get("alternateIdentifierType")
+            )
+    elif name in ("creators", "contributors"):
+        for item in value:
+            element = etree.SubElement(parent, name[:-1])
+            _add_name(element, item, f"{name[:-1]}Name")
+            if name == "contributors":
+                _set(element, "contributorType", item.get("contributorType"))
+    elif name == "titles":
+        for item in value:
+            element = etree.SubElement(parent, "title", nsmap=schema45.ns)
+            element.text = item["title"]
+            _set(element, XML_LANG, item.get("lang"))
+            _set(element, "titleType", item.get("type"))
+            _set(element, "titleType", item.get("titleType"))
+    elif name == "subjects":
+        for item in value:
+            element = _text_element(parent, "subject", item["subject"])
+            _set(element, XML_LANG, item.get("lang"))
+            _set(element, "subjectScheme", item.get("subjectScheme"))
+            _set(element, "schemeURI", item.get("schemeUri"))
+            _set(element, "valueURI", item.get("valueUri"))
+    elif name == "dates":
+        for item in value:
+            element = _text_element(
+                parent, "date", item["date"], dateType=item["dateType"]
+            )
+            _set(element, "dateInformation", item.get("dateInformation"))
+    elif name == "relatedIdentifiers":
+        for item in value:
+            element = _text_element(
+                parent,
+                "relatedIdentifier",
+                item["relatedIdentifier"],
+                relationType=item["relationType"],
+            )
+            _set(element, "relatedMetadataScheme", item.get("relatedMetadataScheme"))
+            _set(element, "schemeURI", item.get("schemeUri"))
+            _set(element, "schemeType", item.get("schemeType"))
+            _set(element, "resourceTypeGeneral", item.get("resourceTypeGeneral"))
+            _set(element, "relatedIdentifierType", item.get("relatedIdentifierType"))
+    elif name == "rightsList":
+        for item in value:
+            element = _text_element(parent, "rights", item.get("rights"))
+            _set(element, "rightsURI", item.get("rightsUri"))
+            _set(element, "rightsIdentifierScheme", item.get("rightsIdentifierScheme"))
+            _set(element, "rightsIdentifier", item.get("rightsIdentifier"))
+            _set(element, "schemeURI", item.get("schemeUri"))
+            _set(element, XML_LANG, item.get("lang"))
+    elif name == "descriptions":
+        for item in value:
+            element = _text_element(
+                parent,
+                "description",
+                item["description"],
+                descriptionType=item["descriptionType"],
+            )
+            _set(element, XML_LANG, item.get("lang"))
+    elif name == "geoLocations":
+        for item in value:
+            location = etree.SubElement(parent, "geoLocation")
+            if item.get("geoLocationPlace"):
+                _text_element(location, "geoLocationPlace", item["geoLocationPlace"])
+            if item.get("geoLocationPoint"):
+                _add_point(location, "geoLocationPoint", item["geoLocationPoint"])
+            if box := item.get("geoLocationBox"):
+                element = etree.SubElement(location, "geoLocationBox")
+                for side in (
+                    "westBoundLongitude",
+                    "eastBoundLongitude",
+                    "southBoundLatitude",
+                    "northBoundLatitude",
+                ):
+                    _text_element(element, side, str(box[side]))
+            if polygon := item.get("geoLocationPolygon"):
+                element = etree.SubElement(location, "geoLocationPolygon")
+                for point in polygon:
+                    if point.get("polygonPoint"):
+                        _add_point(element, "polygonPoint", point["polygonPoint"])
+                    if point.get("inPolygonPoint"):
+                        _add_point(element, "inPolygonPoint", point["inPolygonPoint"])
+    elif name == "fundingReferences":
+        for item in value:
+            reference = etree.SubElement(parent, "fundingReference")
+            _text_element(reference, "funderName", item.get("funderName"))
+            if item.get("funderIdentifier"):
+                element = _text_element(
+                    reference, "funderIdentifier", item["funderIdentifier"]
+                )
+                _set(element, "funderIdentifierType", item.get("funderIdentifierType"))
+            if item.get("awardNumber"):
+                element = _text_element(reference, "awardNumber", item["awardNumber"])
+                _set(element, "awardURI", item.get("awardUri"))
+            if item.get("awardTitle"):
+                _text_element(reference, "awardTitle", item["awardTitle"])
+    return parent
+
+
+def dump_etree(datacite_record) -> etree._Element:
+    """
+    Build the DataCite XML resource of a DataCite record with lxml.
+
+    This produces the same XML as datacite.schema45.dump_etree without going
+    through its generic rules, and delegates to it the properties not
+    generated from CIOOS records.
+    """
+    if any(datacite_record.get(name) for name in SCHEMA45_ONLY_PROPERTIES):
+        return schema45.dump_etree(datacite_record)
+
+    root = etree.Element("resource", nsmap=schema45.ns, attrib=schema45.root_attribs)
+    for name in XML_PROPERTIES:
+        # Like schema45, only non empty properties are serialized and each
+        # property is built apart before being appended for the xml:lang
+        # attributes to resolve to the resource namespaces
+        if datacite_record.get(name):
+            root.append(_property_element(name, datacite_record[name]))
+    return root
+
+
 def to_json(record, output=None) -> str:
     """
     Convert the DataCite record to JSON.
@@ -426,12 +681,27 @@ def to_json(record, output=None) -> str:
     return datacite_json_record
 
 
-def to_xml(record, output=None) -> str:
+def to_xml(record, output=None, serializer="lxml") -> str:
     """
     Convert the DataCite record to XML.
+
+    Args:
+        record (dict): The CIOOS record.
+        output (str, optional): Output file.
+        serializer (str, optional): "lxml" builds the XML directly, "schema45"
+            uses the generic datacite package serializer. Both produce the
+            same XML.
     """
     datacite_record = generate_datacite_record(record)
-    xml = schema45.tostring(datacite_record)
+    if serializer == "schema45":
+        xml = schema45.tostring(datacite_record)
+    else:
+        xml = etree.tostring(
+            dump_etree(datacite_record),
+            pretty_print=True,
+            xml_declaration=True,
+            encoding="utf-8",
+        ).decode("utf-8")
 
     if output:
         logger.debug(f"Output file: {output}")
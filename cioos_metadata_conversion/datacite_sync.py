@@ -0,0 +1,450 @@
+"""
+Synchronize DataCite DOIs with metadata records through the DataCite REST API.
+
+The DataCite metadata of each record is generated with
+datacite.generate_datacite_record and uploaded concurrently over a pooled
+session. Requests are rate limited, retries included, the 429 and 5xx
+responses of the idempotent requests retried with an exponential backoff and
+DOIs whose remote metadata already match are skipped.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+from urllib.parse import quote
+
+import click
+import requests
+from loguru import logger
+from urllib3.util.retry import Retry
+
+from cioos_metadata_conversion.contacts import contact_registry, intern_contacts
+from cioos_metadata_conversion.datacite import generate_datacite_record
+from cioos_metadata_conversion.mirror import FirebaseMirror
+from cioos_metadata_conversion.record import InputSchemas, Record
+from cioos_metadata_conversion.validation import InvalidRecordError, check_record
+
+DEFAULT_API_URL = "https://api.datacite.org"
+TEST_API_URL = "https://api.test.datacite.org"
+# DataCite allows 3000 requests per 5 minutes
+DEFAULT_RATE_LIMIT = 10
+DEFAULT_MAX_WORKERS = 8
+RETRY_STATUS = (429, 500, 502, 503, 504)
+JSON_API_HEADERS = {
+    "Accept": "application/vnd.api+json",
+    "Content-Type": "application/vnd.api+json",
+}
+
+
+class RateLimiter:
+    """Space out calls shared by several threads to a maximum rate."""
+
+    def __init__(self, rate: float | None = None) -> None:
+        self.interval = 1 / rate if rate else 0
+        self.next_call = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Wait until the next call is allowed."""
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class RateLimitedRetry(Retry):
+    """Retry which waits for the rate limiter after its backoff, the retries
+    then count against the same rate as the requests.
+
+    The requests of the methods it doesn't retry are still retried on a 429,
+    which the server rejects without processing them.
+    """
+
+    def __init__(self, *args, rate_limiter: RateLimiter = None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.rate_limiter = rate_limiter
+
+    def new(self, **kwargs):
+        retry = super().new(**kwargs)
+        retry.rate_limiter = self.rate_limiter
+        return retry
+
+    def is_retry(self, method, status_code, has_retry_after=False) -> bool:
+        if status_code == 429 and status_code in self.status_forcelist:
+            return True
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def sleep(self, response=None):
+        super().sleep(response)
+        if self.rate_limiter:
+            self.rate_limiter.wait()
+
+
+def get_session(
+    username: str,
+    password: str,
+    pool_size: int = DEFAULT_MAX_WORKERS,
+    retries: int = 5,
+    backoff_factor: float = 1,
+    rate_limiter: RateLimiter = None,
+) -> requests.Session:
+    """
+    Get a pooled DataCite API session which retries the 429 and 5xx responses.
+
+    The GET and PUT requests are retried on any of these responses. A DOI
+    creation is a POST which may have succeeded before a 5xx response, it is
+    only retried on a 429 and otherwise left to the next synchronization,
+    which finds the DOI and updates it instead.
+
+    Args:
+        username (str): DataCite repository ID.
+        password (str): DataCite repository password.
+        pool_size (int): Number of connections kept alive by the session.
+        retries (int): Maximum number of retries of a request.
+        backoff_factor (float): Exponential backoff factor between retries,
+            a Retry-After header takes precedence.
+        rate_limiter (RateLimiter, optional): Limiter the retries wait for.
+
+    Returns:
+        requests.Session: The DataCite API session.
+    """
+    session = requests.Session()
+    session.auth = (username, password)
+    session.headers.update(JSON_API_HEADERS)
+    retry = RateLimitedRetry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS,
+        allowed_methods=("GET", "PUT"),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+        rate_limiter=rate_limiter,
+    )
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def build_payload(record, event: str | None = None, url: str | None = None) -> dict:
+    """
+    Build the DataCite REST API payload of a CIOOS record.
+
+    Args:
+        record (dict): The CIOOS record.
+        event (str, optional): DOI state event, "publish", "register" or "hide".
+        url (str, optional): Landing page URL of the DOI.
+
+    Returns:
+        dict: The JSON:API payload, None if the record has no DOI.
+    """
+    attributes = generate_datacite_record(record)
+    if not attributes.get("doi"):
+        return None
+    if event:
+        attributes["event"] = event
+    if url:
+        attributes["url"] = url
+    return {"data": {"type": "dois", "id": attributes["doi"], "attributes": attributes}}
+
+
+def _project(remote, local):
+    """Keep the parts of the remote metadata matching the local one."""
+    if isinstance(local, dict):
+        if not isinstance(remote, dict):
+            return remote
+        # DataCite drops the keys it doesn't know, ignore them
+        return {
+            key: _project(remote[key], value)
+            for key, value in local.items()
+            if key in remote
+        }
+    if isinstance(local, list):
+        if not isinstance(remote, list) or len(remote) != len(local):
+            return remote
+        return [_project(item, value) for item, value in zip(remote, local)]
+    return remote
+
+
+def _normalize(value):
+    if isinstance(value, dict):
+        return {
+            key: _normalize(item) for key, item in value.items() if item is not None
+        }
+    if isinstance(value, list):
+        return [_normalize(item) for item in value]
+    return str(value)
+
+
+def metadata_hash(attributes: dict) -> str:
+    """
+    Hash DataCite attributes independently of key order and scalar types.
+    """
+    return hashlib.sha256(
+        json.dumps(_normalize(attributes), sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def sync_doi(
+    session, api_url: str, payload: dict, rate_limiter=None, dry_run=False
+) -> str:
+    """
+    Create or update a DOI unless its remote metadata already match.
+
+    Args:
+        session (requests.Session): DataCite API session.
+        api_url (str): DataCite API URL.
+        payload (dict): DOI payload generated by build_payload.
+        rate_limiter (RateLimiter, optional): Limiter shared by the requests.
+        dry_run (bool, optional): Only compare the DOI with the remote one.
+
+    Returns:
+        str: "created", "updated" or "unchanged".
+    """
+    rate_limiter = rate_limiter or RateLimiter()
+    doi = payload["data"]["id"]
+    url = f"{api_url.rstrip('/')}/dois/{quote(doi, safe='/')}"
+    attributes = {
+        key: value
+        for key, value in payload["data"]["attributes"].items()
+        if key != "event"
+    }
+
+    rate_limiter.wait()
+    response = session.get(url, params={"publisher": "true", "affiliation": "true"})
+    if response.status_code == 404:
+        status = "created"
+    else:
+        response.raise_for_status()
+        remote = response.json()["data"]["attributes"]
+        if metadata_hash(_project(remote, attributes)) == metadata_hash(attributes):
+            logger.debug("DOI {} is up to date", doi)
+            return "unchanged"
+        status = "updated"
+
+    if dry_run:
+        return status
+    rate_limiter.wait()
+    if status == "created":
+        response = session.post(f"{api_url.rstrip('/')}/dois", json=payload)
+    else:
+        response = session.put(url, json=payload)
+    response.raise_for_status()
+    logger.info("DOI {} {}", doi, status)
+    return status
+
+
+@contact_registry()
+def sync_records(
+    records,
+    username: str,
+    password: str,
+    api_url: str = DEFAULT_API_URL,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    rate_limit: float = DEFAULT_RATE_LIMIT,
+    event: str | None = None,
+    url_template: str | None = None,
+    dry_run: bool = False,
+    retries: int = 5,
+    backoff_factor: float = 1,
+) -> dict:
+    """
+    Synchronize the DOIs of CIOOS records with DataCite.
+
+    Args:
+        records (iterable): CIOOS records.
+        username (str): DataCite repository ID.
+        password (str): DataCite repository password.
+        api_url (str, optional): DataCite API URL.
+        max_workers (int, optional): Number of concurrent uploads.
+        rate_limit (float, optional): Maximum number of requests per second,
+            0 for no limit.
+        event (str, optional): DOI state event, "publish", "register" or "hide".
+        url_template (str, optional): Landing page URL template formatted with
+            the {doi} and the record {identifier}.
+        dry_run (bool, optional): Only compare the DOIs with the remote ones.
+        retries (int, optional): Maximum number of retries of a request.
+        backoff_factor (float, optional): Exponential backoff factor between retries.
+
+    Returns:
+        dict: The DOIs by status, "created", "updated", "unchanged", "failed",
+            the records "skipped" without DOI and the "invalid" records.
+    """
+    report = {
+        "created": [],
+        "updated": [],
+        "unchanged": [],
+        "failed": [],
+        "skipped": [],
+        "invalid": [],
+    }
+    payloads = []
+    for record in records:
+        identifier = (record.get("metadata") or {}).get("identifier")
+        try:
+            check_record(record, "datacite_json", source=identifier)
+        except InvalidRecordError as error:
+            logger.error("Skip {}", error)
+            report["invalid"].append(identifier)
+            continue
+        url = None
+        if url_template:
+            doi = record["identification"].get("identifier", "")
+            url = url_template.format(
+                doi=doi.replace("https://doi.org/", ""),
+                identifier=identifier,
+            )
+        payload = build_payload(intern_contacts(record), event=event, url=url)
+        if not payload:
+            report["skipped"].append(identifier)
+            continue
+        payloads.append(payload)
+
+    rate_limiter = RateLimiter(rate_limit)
+    session = get_session(
+        username, password, max_workers, retries, backoff_factor, rate_limiter
+    )
+
+    def _sync(payload):
+        try:
+            return sync_doi(session, api_url, payload, rate_limiter, dry_run)
+        except requests.RequestException as error:
+            logger.error("Failed to sync DOI {}: {}", payload["data"]["id"], error)
+            return "failed"
+
+    logger.info("Synchronizing {} DOIs with {}", len(payloads), api_url)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for payload, status in zip(payloads, executor.map(_sync, payloads)):
+            report[status].append(payload["data"]["id"])
+
+    logger.info(
+        "DOIs: {}",
+        ", ".join(f"{len(dois)} {status}" for status, dois in report.items()),
+    )
+    return report
+
+
+def _load_records(input, input_schema, mirror, where):
+    if mirror:
+        with FirebaseMirror(mirror) as firebase_mirror:
+            return firebase_mirror.get_cioos_records(where)
+    return [
+        Record(source=file, schema=InputSchemas[input_schema])
+        .load()
+        .convert_to_cioos_schema()
+        .metadata
+        for file in glob(input, recursive=True)
+    ]
+
+
+@click.command()
+@click.option("--input", "-i", help="Input files glob pattern.")
+@click.option(
+    "--input-schema",
+    default="CIOOS",
+    type=click.Choice(InputSchemas.__members__.keys()),
+    show_default=True,
+    help="Input records schema.",
+)
+@click.option("--mirror", "-m", help="SQLite Firebase mirror to use as input.")
+@click.option(
+    "--where",
+    "-w",
+    help="SQL condition used to select the mirror records, ex: \"status = 'published'\".",
+)
+@click.option(
+    "--api-url",
+    default=DEFAULT_API_URL,
+    show_default=True,
+    help=f"DataCite API URL, {TEST_API_URL} for the test instance.",
+)
+@click.option(
+    "--username",
+    envvar="DATACITE_USERNAME",
+    required=True,
+    help="DataCite repository ID.",
+)
+@click.option(
+    "--password",
+    envvar="DATACITE_PASSWORD",
+    required=True,
+    help="DataCite repository password.",
+)
+@click.option(
+    "--workers",
+    type=int,
+    default=DEFAULT_MAX_WORKERS,
+    show_default=True,
+    help="Number of concurrent uploads.",
+)
+@click.option(
+    "--rate-limit",
+    type=float,
+    default=DEFAULT_RATE_LIMIT,
+    show_default=True,
+    help="Maximum number of requests per second, 0 for no limit.",
+)
+@click.option(
+    "--retries",
+    type=int,
+    default=5,
+    show_default=True,
+    help="Maximum number of retries of the 429 and 5xx responses.",
+)
+@click.option(
+    "--event",
+    type=click.Choice(["publish", "register", "hide"]),
+    help="DOI state event, the DOIs state is left as is by default.",
+)
+@click.option(
+    "--url-template",
+    help="DOI landing page URL, {doi} and {identifier} are replaced by the "
+    "record DOI and identifier.",
+)
+@click.option(
+    "--dry-run", is_flag=True, help="Only report the DOIs which would be changed."
+)
+def sync(
+    input,
+    input_schema,
+    mirror,
+    where,
+    api_url,
+    username,
+    password,
+    workers,
+    rate_limit,
+    retries,
+    event,
+    url_template,
+    dry_run,
+):
+    """Create or update the DataCite DOIs of metadata records."""
+    if not input and not mirror:
+        raise click.UsageError("Missing --input or --mirror.")
+
+    report = sync_records(
+        _load_records(input, input_schema, mirror, where),
+        username,
+        password,
+        api_url=api_url,
+        max_workers=workers,
+        rate_limit=rate_limit,
+        event=event,
+        url_template=url_template,
+        dry_run=dry_run,
+        retries=retries,
+    )
+    for status, dois in report.items():
+        click.echo(f"{status}: {len(dois)}")
+    if report["failed"]:
+        raise click.ClickException(f"Failed to sync DOIs: {report['failed']}")
@@ -0,0 +1,304 @@
+"""
+Dependencies of the output formats on the fields of the CIOOS records.
+
+Each output format declares the record paths its converter reads, as dotted
+paths like "identification.keywords", "" standing for the whole record. The
+paths a converter actually reads can be traced to check its declaration.
+Changes between two versions of a record are compared with the declarations
+to only rebuild the formats depending on the changed fields. The digests of
+the fields also cover the code of the converters, every output is rebuilt
+once the package or the libraries generating the formats change.
+"""
+
+import hashlib
+import json
+from functools import cache
+from importlib import metadata
+from pathlib import Path
+
+from cioos_metadata_conversion.record import FORMAT_DEPENDENCIES
+
+# Last item of the path of a dict keys or list length
+STRUCTURE = "*"
+# Digests of the last converted records, kept in the output directory
+STATE_FILE = ".conversion_state.json"
+# Distributions whose version changes the converted records
+CONVERTER_DISTRIBUTIONS = ("metadata-xml", "datacite", "cffconvert", "pyyaml", "lxml")
+
+
+def parse_path(path: str) -> tuple:
+    """Split a dotted path into its keys, list indexes as integers."""
+    if not path:
+        return ()
+    return tuple(int(key) if key.isdigit() else key for key in path.split("."))
+
+
+def format_path(path: tuple) -> str:
+    """Join the keys of a path into a dotted path."""
+    return ".".join(str(key) for key in path)
+
+
+class _TracedDict(dict):
+    """Dict recording the paths read from it."""
+
+    def __init__(self, data, path, reads) -> None:
+        super().__init__(data)
+        self._path = path
+        self._reads = reads
+
+    def _read(self, key):
+        self._reads.add(self._path + (key,))
+        return _trace(super().__getitem__(key), self._path + (key,), self._reads)
+
+    def __getitem__(self, key):
+        return self._read(key)
+
+    def get(self, key, default=None):
+        self._reads.add(self._path + (key,))
+        return self._read(key) if super().__contains__(key) else default
+
+    def __contains__(self, key):
+        self._reads.add(self._path + (key,))
+        return super().__contains__(key)
+
+    def __iter__(self):
+        self._reads.add(self._path + (STRUCTURE,))
+        return super().__iter__()
+
+    def __len__(self):
+        self._reads.add(self._path + (STRUCTURE,))
+        return super().__len__()
+
+    def keys(self):
+        self._reads.add(self._path + (STRUCTURE,))
+        return super().keys()
+
+    def items(self):
+        self._reads.add(self._path + (STRUCTURE,))
+        return [(key, self._read(key)) for key in super().__iter__()]
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+
+class _TracedList(list):
+    """List recording the paths read from it."""
+
+    def __init__(self, data, path, reads) -> None:
+        super().__init__(data)
+        self._path = path
+        self._reads = reads
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            self._reads.add(self._path)
+            return super().__getitem__(index)
+        index = index if index >= 0 else super().__len__() + index
+        self._reads.add(self._path + (index,))
+        return _trace(super().__getitem__(index), self._path + (index,), self._reads)
+
+    def __iter__(self):
+        self._reads.add(self._path + (STRUCTURE,))
+        for index in range(super().__len__()):
+            yield self[index]
+
+    def __len__(self):
+        self._reads.add(self._path + (STRUCTURE,))
+        return super().__len__()
+
+    def __contains__(self, value):
+        self._reads.add(self._path)
+        return super().__contains__(value)
+
+
+def _trace(value, path, reads):
+    if isinstance(value, dict):
+        return _TracedDict(value, path, reads)
+    if isinstance(value, list):
+        return _TracedList(value, path, reads)
+    return value
+
+
+def trace_dependencies(converter, record: dict) -> set:
+    """
+    Trace the paths of a record read by a converter.
+
+    The values passed as is to a serializer, like a dict dumped to JSON, may
+    be read without being traced. Their format should declare the whole record.
+
+    Args:
+        converter (callable): Converter called with the record.
+        record (dict): CIOOS record.
+
+    Returns:
+        set: The paths read, as tuples of keys. A path ending with STRUCTURE
+            stands for the keys or length of a dict or list.
+    """
+    reads = set()
+    converter(_trace(record, (), reads))
+    return reads
+
+
+def undeclared_dependencies(output_format: str, reads: set) -> set:
+    """
+    Get the traced paths not covered by the declaration of an output format.
+
+    A path is covered by a declared path containing it, the paths of the dicts
+    traversed to reach a declared path are covered too.
+    """
+    declared = [
+        parse_path(dependency) for dependency in FORMAT_DEPENDENCIES[output_format]
+    ]
+    return {
+        path
+        for path in reads
+        if not any(
+            path[: len(dependency)] == dependency
+            or (STRUCTURE not in path and dependency[: len(path)] == path)
+            for dependency in declared
+        )
+    }
+
+
+def diff_paths(old, new, path: tuple = ()) -> set:
+    """
+    Compare two versions of a record independently of their keys order.
+
+    Args:
+        old: Previous version of the record or of one of its values.
+        new: New version.
+        path (tuple, optional): Path of the compared values.
+
+    Returns:
+        set: The paths of the changed values, as tuples of keys. A path ending
+            with STRUCTURE is added when the keys of a dict or length of a
+            list changed.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        changes = set()
+        if old.keys() != new.keys():
+            changes.add(path + (STRUCTURE,))
+        for key in old.keys() | new.keys():
+            if key not in old or key not in new:
+                changes.add(path + (key,))
+            else:
+                changes |= diff_paths(old[key], new[key], path + (key,))
+        return changes
+    if isinstance(old, list) and isinstance(new, list):
+        changes = set()
+        if len(old) != len(new):
+            changes.add(path + (STRUCTURE,))
+        for index in range(max(len(old), len(new))):
+            if index >= len(old) or index >= len(new):
+                changes.add(path + (index,))
+            else:
+                changes |= diff_paths(old[index], new[index], path + (index,))
+        return changes
+    if type(old) is not type(new) or old != new:
+        return {path}
+    return set()
+
+
+def _overlaps(path: tuple, other: tuple) -> bool:
+    """Check if one of two paths contains the other."""
+    length = min(len(path), len(other))
+    return path[:length] == other[:length]
+
+
+def depends_on(output_format: str, changes: set) -> bool:
+    """Check if an output format depends on any of the changed paths."""
+    return any(
+        _overlaps(parse_path(dependency), change)
+        for dependency in FORMAT_DEPENDENCIES[output_format]
+        for change in changes
+    )
+
+
+def affected_formats(old: dict, new: dict, output_formats=None) -> list:
+    """
+    Get the output formats to rebuild after a record changed.
+
+    Args:
+        old (dict): Previous version of the CIOOS record.
+        new (dict): New version of the CIOOS record.
+        output_formats (list, optional): Output formats to check, all by default.
+
+    Returns:
+        list: The output formats depending on the changed fields.
+    """
+    changes = diff_paths(old, new)
+    return [
+        output_format
+        for output_format in output_formats or FORMAT_DEPENDENCIES
+        if changes and depends_on(output_format, changes)
+    ]
+
+
+def _get_path(record, path: tuple):
+    for key in path:
+        try:
+            record = record[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return record
+
+
+def _distribution_version(name: str) -> str:
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+@cache
+def converter_digest() -> str:
+    """
+    Hash the code of the converters, the package modules and resources and
+    the versions of the libraries generating the output formats.
+    """
+    digest = hashlib.sha256()
+    package = Path(__file__).parent
+    for file in sorted([*package.glob("*.py"), *package.glob("resources/*")]):
+        digest.update(file.relative_to(package).as_posix().encode("utf-8"))
+        digest.update(file.read_bytes())
+    for name in CONVERTER_DISTRIBUTIONS:
+        digest.update(f"{name}=={_distribution_version(name)}".encode())
+    return digest.hexdigest()
+
+
+def dependency_digest(record: dict, output_format: str, **options) -> str:
+    """
+    Hash the fields of a record an output format depends on and the code of
+    its converter.
+
+    Args:
+        record (dict): CIOOS record.
+        output_format (str): Output format.
+        **options: Conversion options included in the hash.
+
+    Returns:
+        str: The digest, unchanged as long as the fields and converter are.
+    """
+    values = {
+        dependency: _get_path(record, parse_path(dependency))
+        for dependency in FORMAT_DEPENDENCIES[output_format]
+    }
+    data = json.dumps(
+        [output_format, values, options, converter_digest()],
+        sort_keys=True,
+        default=str,
+    ).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def load_state(path) -> dict:
+    """Load the digests of the last incremental conversion, if any."""
+    path = Path(path)
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def write_state(path, state: dict):
+    """Write the digests of the converted records."""
+    Path(path).write_text(json.dumps(state, indent=2, sort_keys=True))
@@ -1,17 +1,65 @@
+import hashlib
+import os
+import re
+import stat
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from glob import glob
+from itertools import repeat
 from pathlib import Path
-from typing import Union
+from textwrap import shorten
+from urllib.parse import quote, urlsplit
+from xml.parsers import expat
+from xml.sax.saxutils import escape, quoteattr
 
 import click
+import requests
 import yaml
 from loguru import logger
 from lxml import etree
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
 from cioos_metadata_conversion.cioos import (
     get_records_from_firebase,
     cioos_firebase_to_cioos_schema,
+    iter_records_from_firebase,
+)
+from cioos_metadata_conversion.contacts import (
+    contact_registry,
+    contact_view,
+    intern_contacts,
+)
+from cioos_metadata_conversion import sharding
+from cioos_metadata_conversion.mirror import FirebaseMirror
+from cioos_metadata_conversion.utils import drop_empty_values, iso_dates
+from cioos_metadata_conversion.validation import InvalidRecordError, check_record
+
+# Use the libyaml parser when available
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# CIOOS record fields read by global_attributes
+DEPENDENCIES = (
+    "contact",
+    "identification.abstract",
+    "identification.edition",
+    "identification.identifier",
+    "identification.keywords",
+    "identification.progress_code",
+    "identification.project",
+    "identification.title",
+    "metadata.dates",
+    "metadata.history",
+    "metadata.identifier",
+    "metadata.maintenance_note",
+    "metadata.naming_authority",
+    "metadata.use_constraints",
+    "platform",
 )
-from cioos_metadata_conversion.utils import drop_empty_values
 
 KEYWORDS_PREFIX_MAPPING = {
     "default": {
@@ -32,11 +80,25 @@ KEYWORDS_PREFIX_MAPPING = {
 def generate_dataset_xml(global_attributes: dict):
     output = ["<addAttributes>"]
     for key, value in global_attributes.items():
-        output += [f"    <att name='{key}'>{value}</att>"]
+        output.append(
+            f"    <att name='{escape(str(key), {chr(39): '&apos;'})}'>"
+            f"{escape(str(value))}</att>"
+        )
     output += ["</addAttributes>"]
     return "\n".join(output)
 
 
+def _write_add_attributes(xf, global_attributes: dict, indent: str = ""):
+    """Write an addAttributes element to an lxml incremental XML writer."""
+    with xf.element("addAttributes"):
+        for name, value in global_attributes.items():
+            xf.write(f"\n{indent}    ")
+            with xf.element("att", name=str(name)):
+                xf.write(str(value))
+        xf.write(f"\n{indent}")
+
+
+@contact_view
 def _get_contact(contact: dict, role: str) -> dict:
     """Generate a CFF contact from a metadata contact."""
     if "individual" in contact:
@@ -111,29 +173,7 @@ def generate_history(record, language="en"):
         logger.warning("Invalid history format.")
 
 
-def global_attributes(
-    record, output="xml", language="en", metadata_link=None, **kwargs
-) -> str:
-    """Generate an ERDDAP dataset.xml global attributes from a metadata record
-    which follows the ACDD 1.3 conventions.
-
-    Args:
-        record (dict): A metadata record.
-        output (str, optional): The output format. Defaults to "xml".
-        language (str, optional): The language to use. Defaults to "en".
-        **kwargs: Additional attributes to add to the global attributes.
-    """
-    creator = [contact for contact in record["contact"] if "owner" in contact["roles"]]
-    publisher = [
-        contact for contact in record["contact"] if "publisher" in contact["roles"]
-    ]
-
-    if len(creator) > 1:
-        logger.warning("Multiple creators found, using the first one.")
-
-    if len(publisher) > 1:
-        logger.warning("Multiple publishers found, using the first one.")
-
+def _get_comment(record, language) -> str:
     comment = []
     if (
         record["metadata"]
@@ -155,30 +195,20 @@ def global_attributes(
     if not translation_comment:
         pass
     elif isinstance(translation_comment, str):
-        comment += [
-            "##Translation:\n"
-            + record["metadata"]
-            .get("use_constraints", {})
-            .get("limitations", {})
-            .get("translations", {})
-            .get(language)
-        ]
+        comment += ["##Translation:\n" + translation_comment]
     elif isinstance(translation_comment, dict) and "message" in translation_comment:
         comment += ["##Translation:\n" + translation_comment["message"]]
     else:
         logger.warning("Invalid translation comment format: {}", translation_comment)
+    return "\n\n".join(comment)
 
-    global_attributes = {
-        "institution": (
-            creator[0].get("organization", {}).get("name") if creator else ""
-        ),
+
+def _get_language_attributes(record, language, history) -> dict:
+    """Generate the global attributes which depend on the language."""
+    return {
         "title": record["identification"]["title"][language],
         "summary": record["identification"]["abstract"][language],
-        "project": ",".join(record["identification"].get("project", [])),
-        "comment": "\n\n".join(comment),
-        "progress": record["identification"][
-            "progress_code"
-        ],  # not a standard ACDD attribute
+        "comment": _get_comment(record, language),
         "keywords": ",".join(
             [
                 KEYWORDS_PREFIX_MAPPING.get(group, {}).get("prefix", "") + keyword
@@ -198,12 +228,60 @@ def global_attributes(
                 and KEYWORDS_PREFIX_MAPPING[group]["label"]
             ]
         ),
+        "history": history,
+    }
+
+
+def global_attributes_by_language(
+    record, languages, output="xml", metadata_link=None, **kwargs
+) -> dict:
+    """Generate the ERDDAP dataset.xml global attributes of a metadata record
+    in several languages.
+
+    The attributes which don't depend on the language, the contacts, licence
+    and identifiers, are generated once for all the languages.
+
+    Args:
+        record (dict): A metadata record.
+        languages (list): The languages to generate the attributes in.
+        output (str, optional): The output format. Defaults to "xml".
+        metadata_link (str, optional): Metadata link used if the record has no DOI.
+        **kwargs: Additional attributes to add to the global attributes.
+
+    Returns:
+        dict: The global attributes in each language.
+    """
+    creator = [contact for contact in record["contact"] if "owner" in contact["roles"]]
+    publisher = [
+        contact for contact in record["contact"] if "publisher" in contact["roles"]
+    ]
+
+    if len(creator) > 1:
+        logger.warning("Multiple creators found, using the first one.")
+
+    if len(publisher) > 1:
+        logger.warning("Multiple publishers found, using the first one.")
+
+    # The language attributes are set in place to keep the attributes order
+    common_attributes = {
+        "institution": (
+            creator[0].get("organization", {}).get("name") if creator else ""
+        ),
+        "title": None,
+        "summary": None,
+        "project": ",".join(record["identification"].get("project", [])),
+        "comment": None,
+        "progress": record["identification"][
+            "progress_code"
+        ],  # not a standard ACDD attribute
+        "keywords": None,
+        "keywords_vocabulary": None,
         "id": record["metadata"]["identifier"],
         "naming_authority": record["metadata"]["naming_authority"],
         "date_modified": record["metadata"]["dates"].get("revision"),
         "date_created": record["metadata"]["dates"].get("publication"),
         "product_version": record["identification"].get("edition"),
-        "history": generate_history(record, language),
+        "history": None,
         "license": record["metadata"]
         .get("use_constraints", {})
         .get("licence", {})
@@ -217,15 +295,48 @@ def global_attributes(
         .get("maintenance_note", "")
         .replace("Generated from ", ""),
         **_get_platform(record),
-        **kwargs,
     }
-    # Remove empty values
-    global_attributes = drop_empty_values(global_attributes)
 
-    if not output:
-        return global_attributes
-    if output == "xml":
-        return generate_dataset_xml(global_attributes)
+    # A history list is the same in every language
+    if isinstance(record["metadata"].get("history"), dict):
+        histories = {
+            language: generate_history(record, language) for language in languages
+        }
+    else:
+        histories = dict.fromkeys(languages, generate_history(record))
+
+    outputs = {}
+    for language in languages:
+        global_attributes = {
+            **common_attributes,
+            **_get_language_attributes(record, language, histories[language]),
+            **kwargs,
+        }
+        # Remove empty values
+        global_attributes = drop_empty_values(global_attributes)
+
+        if not output:
+            outputs[language] = global_attributes
+        elif output == "xml":
+            outputs[language] = generate_dataset_xml(global_attributes)
+    return outputs
+
+
+def global_attributes(
+    record, output="xml", language="en", metadata_link=None, **kwargs
+) -> str:
+    """Generate an ERDDAP dataset.xml global attributes from a metadata record
+    which follows the ACDD 1.3 conventions.
+
+    Args:
+        record (dict): A metadata record.
+        output (str, optional): The output format. Defaults to "xml".
+        language (str, optional): The language to use. Defaults to "en".
+        **kwargs: Additional attributes to add to the global attributes.
+    """
+    return global_attributes_by_language(
+        record, [language], output=output, metadata_link=metadata_link, **kwargs
+    ).get(language)
 
 
 @logger.catch(reraise=True)
@@ -267,118 +378,1308 @@ def _update_xml(xml_file, dataset_id, updates, encoding="utf-8") -> str:
     return etree.tostring(tree, pretty_print=True).decode(encoding)
 
 
-def _get_dataset_id_from_record(record, erddap_url):
-    return [
-        (
-            ressource["url"].split("/")[-1].replace(".html", ""),
-            global_attributes(record, output=None),
-        )
-        for ressource in record["distribution"]
-        if erddap_url in ressource["url"]
-    ]
+def _split_url(url) -> tuple:
+    parts = urlsplit(url)
+    return parts.netloc.lower(), parts.path
+
+
+def build_url_index(erddap_urls) -> dict:
+    """Index ERDDAP base URLs by host, with the longest paths first.
+
+    Args:
+        erddap_urls (list): ERDDAP base URLs.
+
+    Returns:
+        dict: The (path prefix, base URL) pairs of each host.
+    """
+    index = {}
+    for erddap_url in erddap_urls:
+        netloc, path = _split_url(erddap_url)
+        index.setdefault(netloc, []).append((path.rstrip("/") + "/", erddap_url))
+    for prefixes in index.values():
+        prefixes.sort(key=lambda item: len(item[0]), reverse=True)
+    return index
+
+
+def route_url(url: str, index: dict) -> str:
+    """Get the base URL of the ERDDAP server a URL belongs to.
+
+    Args:
+        url (str): A distribution URL.
+        index (dict): Index generated by build_url_index.
+
+    Returns:
+        str: The matching ERDDAP base URL, None if there is none.
+    """
+    netloc, path = _split_url(url)
+    for prefix, erddap_url in index.get(netloc, ()):
+        if path.startswith(prefix):
+            return erddap_url
+    return None
+
+
+def _load_record_file(record_file) -> dict:
+    return iso_dates(yaml.load(Path(record_file).read_text(), Loader=YAML_LOADER))
+
+
+@contact_registry()
+def _record_files(records: str | list) -> list:
+    if isinstance(records, str):
+        return glob(records, recursive=True)
+    return list(records)
+
+
+def iter_records(records: str | list, workers: int = 1):
+    """Load the metadata record files matching a glob pattern one at a time.
+
+    Only the records being parsed are held in memory, at most a few per
+    worker process.
+
+    Args:
+        records (str, list): Glob pattern or list of the record files.
+        workers (int, optional): Number of processes used to parse the files.
+
+    Yields:
+        dict: The records, in the order of the matched files.
+    """
+    record_files = _record_files(records)
+    logger.info("Loading {} record files", len(record_files))
+    if workers <= 1 or len(record_files) <= 1:
+        for record_file in record_files:
+            yield _load_record_file(record_file)
+        return
+
+    window = workers * 4
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(record_files), window):
+            yield from executor.map(
+                _load_record_file, record_files[start : start + window]
+            )
+
+
+def load_records(records: str | list, workers: int = 1) -> list:
+    """Load the metadata record files matching a glob pattern.
+
+    Args:
+        records (str, list): Glob pattern or list of the record files.
+        workers (int, optional): Number of processes used to parse the files.
+
+    Returns:
+        list: The records, in the order of the matched files, sharing their
+            contacts.
+    """
+    record_files = _record_files(records)
+    logger.info("Loading {} record files", len(record_files))
+    if workers <= 1 or len(record_files) <= 1:
+        return [
+            intern_contacts(_load_record_file(record_file))
+            for record_file in record_files
+        ]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return [
+            intern_contacts(record)
+            for record in executor.map(
+                _load_record_file,
+                record_files,
+                chunksize=max(1, len(record_files) // (workers * 4)),
+            )
+        ]
+
+
+def iter_datasets_attributes(records, erddap_urls: list):
+    """Route every record distribution to its ERDDAP server.
+
+    The distributions are matched through a URL prefix index. The attributes
+    of a record are computed once, whatever the number of its distributions,
+    and only if one of them is on a server. Invalid records are skipped.
+
+    Args:
+        records (iterable): Metadata records.
+        erddap_urls (list): ERDDAP base URLs.
+
+    Yields:
+        tuple: The ERDDAP base URL, datasetID and global attributes of each
+            matching distribution.
+    """
+    index = build_url_index(erddap_urls)
+    for record in records:
+        attributes = None
+        for ressource in record.get("distribution") or []:
+            erddap_url = route_url(ressource["url"], index)
+            dataset_id = ressource["url"].split("/")[-1].replace(".html", "")
+            if not erddap_url or not dataset_id:
+                continue
+            if attributes is None:
+                try:
+                    check_record(
+                        record,
+                        "erddap",
+                        source=(record.get("metadata") or {}).get("identifier"),
+                    )
+                except InvalidRecordError as error:
+                    logger.error("Skip {}", error)
+                    break
+                attributes = global_attributes(intern_contacts(record), output=None)
+            yield erddap_url, dataset_id, attributes
+
+
+@contact_registry()
+def route_datasets_attributes(records: list, erddap_urls: list) -> dict:
+    """Build the global attributes of the datasets of each ERDDAP server.
+
+    The records are scanned once and those sharing a datasetID are merged
+    in order.
+
+    Args:
+        records (list): Metadata records.
+        erddap_urls (list): ERDDAP base URLs.
+
+    Returns:
+        dict: The global attributes by datasetID of each ERDDAP base URL.
+    """
+    servers = {erddap_url: {} for erddap_url in erddap_urls}
+    for erddap_url, dataset_id, attributes in iter_datasets_attributes(
+        records, erddap_urls
+    ):
+        datasets = servers[erddap_url]
+        datasets[dataset_id] = {**datasets.get(dataset_id, {}), **attributes}
+    return servers
+
+
+def get_datasets_attributes(records: list, erddap_url: str) -> dict:
+    """Build the global attributes of each dataset of an ERDDAP server.
+
+    Args:
+        records (list): Metadata records.
+        erddap_url (str): ERDDAP base URL used to match the records distributions.
+
+    Returns:
+        dict: The global attributes by datasetID.
+    """
+    return route_datasets_attributes(records, [erddap_url])[erddap_url]
+
+
+def _get_add_attributes(dataset) -> tuple:
+    """Get the global addAttributes element of a dataset and its attributes by name."""
+    add_attributes = dataset.find("addAttributes")
+    if add_attributes is None:
+        add_attributes = etree.SubElement(dataset, "addAttributes")
+    attributes = {}
+    for attribute in add_attributes.iterfind("att"):
+        attributes.setdefault(attribute.get("name"), attribute)
+    return add_attributes, attributes
+
+
+def plan_attributes(current: dict, global_attributes: dict) -> dict:
+    """Compare the global attributes to set with the current ones of a dataset.
+
+    Args:
+        current (dict): The current attribute values by name.
+        global_attributes (dict): The attributes to set.
+
+    Returns:
+        dict: The change set, with the new values of the "added" attributes,
+            the (old, new) values of the "modified" ones and the "unchanged"
+            attribute names.
+    """
+    changes = {"added": {}, "modified": {}, "unchanged": []}
+    for name, value in global_attributes.items():
+        value = str(value)
+        if name not in current:
+            changes["added"][name] = value
+        elif current[name] != value:
+            changes["modified"][name] = (current[name], value)
+        else:
+            changes["unchanged"].append(name)
+    return changes
+
+
+def has_changes(changes: dict) -> bool:
+    """Check if a dataset change set adds or modifies any attribute."""
+    return bool(changes["added"] or changes["modified"])
+
+
+def format_changes(file_changes: dict) -> str:
+    """Generate a summary of the change sets of each file and dataset."""
+    output = []
+    for file, datasets in file_changes.items():
+        output += [str(file)]
+        for dataset_id, changes in datasets.items():
+            output.append(
+                f"  {dataset_id}: {len(changes['added'])} added, "
+                f"{len(changes['modified'])} modified, "
+                f"{len(changes['unchanged'])} unchanged"
+            )
+            output += [
+                f"    + {name}: {shorten(value, 80)!r}"
+                for name, value in changes["added"].items()
+            ]
+            output += [
+                f"    ~ {name}: {shorten(old, 80)!r} -> {shorten(new, 80)!r}"
+                for name, (old, new) in changes["modified"].items()
+            ]
+    return "\n".join(output)
+
+
+def _current_attributes(dataset) -> dict:
+    """Get the current global attribute values of a dataset."""
+    add_attributes = dataset.find("addAttributes")
+    if add_attributes is None:
+        return {}
+    attributes = {}
+    for attribute in add_attributes.iterfind("att"):
+        attributes.setdefault(attribute.get("name"), attribute.text or "")
+    return attributes
+
+
+def _set_attributes(
+    add_attributes, attributes: dict, global_attributes: dict, dry_run=False
+) -> dict:
+    """Set the global attributes of a dataset addAttributes element.
+
+    Only the added and modified attributes are written.
+
+    Returns:
+        dict: The change set of the dataset.
+    """
+    changes = plan_attributes(
+        {name: attribute.text or "" for name, attribute in attributes.items()},
+        global_attributes,
+    )
+    if dry_run:
+        return changes
+
+    for name, (_, value) in changes["modified"].items():
+        logger.debug(f"Updating attribute {name} with value {value}")
+        attributes[name].text = value
+
+    for name, value in changes["added"].items():
+        # Create a new attribute
+        logger.debug(f"Adding new attribute {name} with value {value}")
+        new_attribute = etree.Element("att")
+        new_attribute.text = value
+        new_attribute.attrib["name"] = name
+        if len(add_attributes):
+            # Reuse the indentation of the previous attributes
+            last = add_attributes[-1]
+            previous = last.getprevious()
+            new_attribute.tail = last.tail
+            last.tail = add_attributes.text if previous is None else previous.tail
+        add_attributes.append(new_attribute)
+        attributes[name] = new_attribute
+    return changes
+
+
+# Number of times an update is re-applied to a file modified concurrently
+UPDATE_ATTEMPTS = 5
+
+
+class ConcurrentUpdateError(RuntimeError):
+    """The file was modified by another process during the update."""
+
+
+def file_fingerprint(path) -> tuple:
+    """Get a fingerprint of a file which changes whenever it is replaced or modified.
+
+    Returns:
+        tuple: The file inode, size and modification time, None if it doesn't exist.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive advisory lock on the hidden ".<name>.lock" sidecar file."""
+    if fcntl is None:
+        yield
+        return
+    path = Path(path)
+    with open(path.parent / f".{path.name}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _same_file(path, other) -> bool:
+    """Check if two paths point to the same file, without touching the files.
+
+    Comparing the files with samefile races with the concurrent replaces the
+    in place updates guard against.
+    """
+    return Path(path).resolve() == Path(other).resolve()
+
+
+def _copy_permissions(temp_file, output_file):
+    """Give the temporary file the mode and owner of the file it replaces.
+
+    Temporary files are created readable by their owner only, a new output
+    file gets the default mode of the process umask instead.
+    """
+    try:
+        original = os.stat(output_file)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp_file, 0o666 & ~umask)
+        return
+    os.chmod(temp_file, stat.S_IMODE(original.st_mode))
+    if hasattr(os, "chown"):
+        try:
+            os.chown(temp_file, original.st_uid, original.st_gid)
+        except PermissionError:
+            logger.debug("Can't keep the owner of {}", output_file)
+
+
+def _replace_file(temp_file, output_file, fingerprint=None):
+    """Atomically replace the output file with a temporary file.
+
+    The temporary file first gets the permissions of the output file. If a
+    fingerprint of the original file is given, the replace happens under the
+    file lock and only if the file still matches it.
+
+    Raises:
+        ConcurrentUpdateError: The output file was modified in the meantime.
+    """
+    _copy_permissions(temp_file, output_file)
+    if fingerprint is None:
+        os.replace(temp_file, output_file)
+        return
+    with file_lock(output_file):
+        if file_fingerprint(output_file) != fingerprint:
+            os.unlink(temp_file)
+            raise ConcurrentUpdateError(f"{output_file} was modified during the update")
+        os.replace(temp_file, output_file)
 
 
 class ERDDAP:
     def __init__(self, path) -> None:
         self.path = path
+        self.fingerprint = None
         self.tree = None
+        self.datasets = {}
+        self.duplicate_dataset_ids = set()
+        self._attributes = {}
 
         self.read()
 
     def read(self):
+        self.fingerprint = file_fingerprint(self.path)
         self.tree = etree.parse(self.path)
+        self._index()
+
+    def _index(self):
+        """Index the datasets by datasetID."""
+        self.datasets = {}
+        self.duplicate_dataset_ids = set()
+        self._attributes = {}
+        for dataset in self.tree.iter("dataset"):
+            dataset_id = dataset.get("datasetID")
+            if dataset_id is None:
+                continue
+            if dataset_id in self.datasets:
+                self.duplicate_dataset_ids.add(dataset_id)
+            else:
+                self.datasets[dataset_id] = dataset
+
+        if self.duplicate_dataset_ids:
+            logger.warning(
+                "Duplicate dataset IDs {} found in {}",
+                sorted(self.duplicate_dataset_ids),
+                self.path,
+            )
+
+    def _get_attributes(self, dataset_id) -> tuple:
+        """Get the global addAttributes element of a dataset and its attributes by name."""
+        if dataset_id not in self._attributes:
+            self._attributes[dataset_id] = _get_add_attributes(
+                self.datasets[dataset_id]
+            )
+        return self._attributes[dataset_id]
 
     def tostring(self, encoding="utf-8") -> str:
         return etree.tostring(self.tree, pretty_print=True).decode(encoding)
 
     def save(self, output_file=None, encoding="utf-8"):
-        with open(output_file or self.path, "w") as f:
+        """Save the datasets.xml, atomically replacing the output file.
+
+        Raises:
+            ConcurrentUpdateError: The file was modified since it was read.
+        """
+        output_file = Path(output_file or self.path)
+        with tempfile.NamedTemporaryFile(
+            "w",
+            encoding=encoding,
+            dir=output_file.parent,
+            prefix=f".{output_file.name}.",
+            delete=False,
+        ) as f:
             f.write(self.tostring(encoding))
+        in_place = _same_file(output_file, self.path)
+        _replace_file(f.name, output_file, self.fingerprint if in_place else None)
 
     def has_dataset_id(self, dataset_id) -> bool:
-        return bool(self.tree.xpath(f"//dataset[@datasetID='{dataset_id}']"))
+        return dataset_id in self.datasets
+
+    def update(self, dataset_id: str, global_attributes: dict, dry_run=False) -> dict:
+        """Update the global attributes of a dataset.
+
+        Args:
+            dataset_id (str): The datasetID to update.
+            global_attributes (dict): The attributes to set.
+            dry_run (bool, optional): Only compute the change set.
 
-    def update(self, dataset_id: str, global_attributes: dict):
+        Returns:
+            dict: The change set of the dataset, None if it isn't found.
+        """
         # Retrive dataset
-        matching_dataset = self.tree.xpath(f"//dataset[@datasetID='{dataset_id}']")
-        if not matching_dataset:
-            return
+        if dataset_id not in self.datasets:
+            return None
 
         # No duplicate dataset IDs allowed
-        if len(matching_dataset) > 1:
+        if dataset_id in self.duplicate_dataset_ids:
             raise ValueError(f"Duplicate dataset ID {dataset_id} found in XML.")
-        dataset = matching_dataset[0]
+        add_attributes, attributes = self._get_attributes(dataset_id)
+        return _set_attributes(add_attributes, attributes, global_attributes, dry_run)
 
-        for name, value in global_attributes.items():
-            # Check if the attribute already exists
-            matching_attribute = dataset.xpath(f".//addAttributes/att[@name='{name}']")
-            if matching_attribute:
-                logger.debug(f"Updating attribute {name} with value {value}")
-                matching_attribute[0].text = value
+
+XML_DECLARATION = re.compile(rb"<\?xml[^>]*\?>\s*")
+XML_ENCODING = re.compile(rb"encoding=[\"']([A-Za-z0-9._-]+)[\"']")
+START_TAG = re.compile(
+    rb"<[^\s/>]+(?:\s+[^\s=/>]+\s*=\s*(?:\"[^\"]*\"|'[^']*'))*\s*/?>"
+)
+
+
+def _read_declaration(xml_file) -> tuple:
+    """Get the XML declaration of a file and its encoding."""
+    with open(xml_file, "rb") as f:
+        head = f.read(1024)
+    declaration = XML_DECLARATION.match(head)
+    if not declaration:
+        return b"", "utf-8"
+    encoding = XML_ENCODING.search(declaration.group())
+    return declaration.group(), encoding.group(1).decode() if encoding else "utf-8"
+
+
+def _open_tag(element, encoding) -> bytes:
+    tag = etree.tostring(
+        etree.Element(element.tag, element.attrib, nsmap=element.nsmap),
+        encoding=encoding,
+        xml_declaration=False,
+    )
+    return tag[:-2] + b">"
+
+
+def _close_tag(element, encoding) -> bytes:
+    name = etree.QName(element).localname
+    if element.prefix:
+        name = f"{element.prefix}:{name}"
+    return f"</{name}>".encode(encoding)
+
+
+def _escape(text, encoding) -> bytes:
+    return escape(text or "").encode(encoding, "xmlcharrefreplace")
+
+
+def stream_plan(xml_file, datasets: dict) -> dict:
+    """Compute the change sets of a datasets.xml one dataset at a time.
+
+    Args:
+        xml_file (str): The datasets.xml file to compare.
+        datasets (dict): Global attributes to set for each datasetID.
+
+    Returns:
+        dict: The change set of each matching datasetID.
+    """
+    changes = {}
+    seen = set()
+    for _, dataset in etree.iterparse(str(xml_file), events=("end",), tag="dataset"):
+        dataset_id = dataset.get("datasetID")
+        if dataset_id in seen:
+            raise ValueError(f"Duplicate dataset ID {dataset_id} found in XML.")
+        if dataset_id is not None:
+            seen.add(dataset_id)
+        if dataset_id in datasets:
+            changes[dataset_id] = plan_attributes(
+                _current_attributes(dataset), datasets[dataset_id]
+            )
+
+        # Drop the datasets already compared
+        dataset.clear(keep_tail=True)
+        parent = dataset.getparent()
+        if parent is not None and parent.tag != "dataset":
+            while dataset.getprevious() is not None:
+                del parent[0]
+    return changes
+
+
+def stream_update(xml_file, datasets: dict, output_file=None, dry_run=False) -> dict:
+    """Update an ERDDAP datasets.xml one top level element at a time.
+
+    The change sets are first computed with a read only pass. If anything
+    changes, the file is parsed again incrementally and each element is
+    written to the output as soon as it is complete, then dropped from
+    memory. Only the datasets listed in ``datasets`` are modified.
+
+    Args:
+        xml_file (str): The datasets.xml file to update.
+        datasets (dict): Global attributes to set for each datasetID.
+        output_file (str, optional): Output file, the input file is
+            replaced by default.
+        dry_run (bool, optional): Only compute the change sets.
+
+    Returns:
+        dict: The change set of each matching datasetID.
+
+    Raises:
+        ConcurrentUpdateError: The file was modified during an in place update.
+    """
+    output_file = Path(output_file or xml_file)
+    fingerprint = file_fingerprint(xml_file)
+    changes = stream_plan(xml_file, datasets)
+    if dry_run or (
+        not any(has_changes(item) for item in changes.values())
+        and _same_file(output_file, xml_file)
+    ):
+        return changes
+
+    declaration, encoding = _read_declaration(xml_file)
+
+    def _update(element):
+        for dataset in element.iter("dataset"):
+            dataset_id = dataset.get("datasetID")
+            if dataset_id in changes and has_changes(changes[dataset_id]):
+                _set_attributes(*_get_add_attributes(dataset), datasets[dataset_id])
+
+    def _flush(output, node):
+        output.write(
+            etree.tostring(
+                node, encoding=encoding, with_tail=True, xml_declaration=False
+            )
+        )
+        node.getparent().remove(node)
+
+    with tempfile.NamedTemporaryFile(
+        "wb", dir=output_file.parent, prefix=f".{output_file.name}.", delete=False
+    ) as output:
+        try:
+            output.write(declaration)
+            depth = 0
+            root = None
+            opened = False
+            # Completed child of the root, written once its tail is parsed
+            pending = None
+
+            def _next_child():
+                nonlocal opened, pending
+                if not opened:
+                    output.write(_open_tag(root, encoding))
+                    output.write(_escape(root.text, encoding))
+                    opened = True
+                if pending is not None:
+                    _flush(output, pending)
+                    pending = None
+
+            for event, node in etree.iterparse(
+                str(xml_file), events=("start", "end", "comment", "pi")
+            ):
+                # A datasets.d fragment root is a single dataset kept whole
+                streamed = root is not None and root.tag != "dataset"
+                if event == "start":
+                    if depth == 0:
+                        root = node
+                    elif depth == 1 and streamed:
+                        _next_child()
+                    depth += 1
+                elif event == "end":
+                    depth -= 1
+                    if depth == 1 and streamed:
+                        _update(node)
+                        pending = node
+                    elif depth == 0 and streamed:
+                        _next_child()
+                        output.write(_close_tag(root, encoding) + b"\n")
+                    elif depth == 0:
+                        _update(root)
+                        output.write(
+                            etree.tostring(
+                                root, encoding=encoding, xml_declaration=False
+                            )
+                            + b"\n"
+                        )
+                elif depth == 0:
+                    # Comments and processing instructions outside of the root
+                    output.write(
+                        etree.tostring(node, encoding=encoding, xml_declaration=False)
+                        + b"\n"
+                    )
+                elif depth == 1 and streamed:
+                    _next_child()
+                    pending = node
+        except BaseException:
+            output.close()
+            os.unlink(output.name)
+            raise
+    in_place = _same_file(output_file, xml_file)
+    _replace_file(output.name, output_file, fingerprint if in_place else None)
+    return changes
+
+
+def _locate_attributes(data: bytes, dataset_ids) -> dict:
+    """Locate the global attributes of datasets in the raw bytes of a datasets.xml.
+
+    Returns for each datasetID found the byte offsets of the dataset, of its
+    global addAttributes element and of each attribute, along with the
+    attributes current value. Offsets are given as the element "start",
+    the end of its start tag "tag_end", the start of its closing tag
+    "close" (None if self closing) and the element "end".
+    """
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    located = {}
+    seen = set()
+    stack = []
+    text = []
+
+    def start_element(name, attrs):
+        index = parser.CurrentByteIndex
+        parent = stack[-1] if stack else None
+        target = None
+        if name == "dataset":
+            dataset_id = attrs.get("datasetID")
+            if dataset_id in seen:
+                raise ValueError(f"Duplicate dataset ID {dataset_id} found in XML.")
+            if dataset_id is not None:
+                seen.add(dataset_id)
+            if dataset_id in dataset_ids:
+                target = located[dataset_id] = {
+                    "add_attributes": None,
+                    "attributes": {},
+                }
+        elif parent and parent["target"] is not None:
+            if (
+                name == "addAttributes"
+                and parent["name"] == "dataset"
+                and parent["target"]["add_attributes"] is None
+            ):
+                target = parent["target"]
+                target["add_attributes"] = {}
+            elif name == "att" and parent["name"] == "addAttributes":
+                target = parent["target"]
+                text.clear()
+        stack.append(
+            {
+                "name": name,
+                "target": target,
+                "attribute": attrs.get("name"),
+                "start": index,
+                "tag_end": START_TAG.match(data, index).end() if target else None,
+            }
+        )
+
+    def end_element(name):
+        element = stack.pop()
+        target = element["target"]
+        if target is None:
+            return
+        index = parser.CurrentByteIndex
+        tag_end = element["tag_end"]
+        self_closing = data[tag_end - 2 : tag_end] == b"/>"
+        offsets = {
+            "start": element["start"],
+            "tag_end": tag_end,
+            "close": None if self_closing else index,
+            "end": tag_end if self_closing else data.index(b">", index) + 1,
+        }
+        if name == "dataset":
+            target.update(offsets)
+        elif name == "addAttributes":
+            target["add_attributes"].update(offsets)
+        elif name == "att":
+            target["attributes"].setdefault(
+                element["attribute"], {**offsets, "value": "".join(text)}
+            )
+
+    def character_data(data):
+        if stack and stack[-1]["name"] == "att" and stack[-1]["target"] is not None:
+            text.append(data)
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+    parser.Parse(data, True)
+    return located
+
+
+def _line_indent(data: bytes, index: int) -> bytes:
+    """Get the whitespace preceding an offset on its line, if there's nothing else."""
+    line_start = data.rfind(b"\n", 0, index) + 1
+    indent = data[line_start:index]
+    return indent if not indent.strip() else b""
+
+
+def _attribute_bytes(name, value, encoding) -> bytes:
+    return (
+        f"<att name={quoteattr(name)}>".encode(encoding)
+        + _escape(value, encoding)
+        + b"</att>"
+    )
+
+
+def _insert_attributes(data: bytes, dataset: dict, new_attributes: list) -> tuple:
+    """Generate the edit adding new attributes to a dataset."""
+    add_attributes = dataset["add_attributes"]
+    if add_attributes and dataset["attributes"]:
+        # Add after the last attribute, with the same indentation
+        last = max(dataset["attributes"].values(), key=lambda item: item["end"])
+        indent = _line_indent(data, last["start"])
+        separator = b"\n" + indent if indent else b""
+        return (
+            last["end"],
+            last["end"],
+            b"".join(separator + attribute for attribute in new_attributes),
+        )
+
+    if add_attributes and add_attributes["close"] is not None:
+        # Add before the closing tag of an empty addAttributes
+        indent = _line_indent(data, add_attributes["close"])
+        return (
+            add_attributes["close"],
+            add_attributes["close"],
+            b"".join(
+                b"  " + attribute + b"\n" + indent for attribute in new_attributes
+            ),
+        )
+
+    block = b"<addAttributes>" + b"".join(new_attributes) + b"</addAttributes>"
+    if add_attributes:
+        # Replace a self closing addAttributes
+        return add_attributes["start"], add_attributes["end"], block
+    if dataset["close"] is None:
+        raise ValueError("Cannot add attributes to a self closing dataset.")
+    return dataset["close"], dataset["close"], block
+
+
+def splice_update(xml_file, datasets: dict, output_file=None, dry_run=False) -> dict:
+    """Update an ERDDAP datasets.xml by splicing the changed attributes in its bytes.
+
+    The byte offsets of the matching datasets global attributes are located
+    with expat and only the values that differ are replaced, new attributes
+    being appended after the existing ones. Every other byte of the file is
+    left as is and the file isn't written if nothing changed.
+
+    Args:
+        xml_file (str): The datasets.xml file to update.
+        datasets (dict): Global attributes to set for each datasetID.
+        output_file (str, optional): Output file, the input file is
+            replaced by default.
+        dry_run (bool, optional): Only compute the change sets.
+
+    Returns:
+        dict: The change set of each matching datasetID.
+
+    Raises:
+        ConcurrentUpdateError: The file was modified during an in place update.
+    """
+    output_file = Path(output_file or xml_file)
+    fingerprint = file_fingerprint(xml_file)
+    data = Path(xml_file).read_bytes()
+    _, encoding = _read_declaration(xml_file)
+    located = _locate_attributes(data, datasets)
+
+    changes = {
+        dataset_id: plan_attributes(
+            {name: item["value"] for name, item in dataset["attributes"].items()},
+            datasets[dataset_id],
+        )
+        for dataset_id, dataset in located.items()
+    }
+    if dry_run:
+        return changes
+
+    # Edits as (start, end, replacement)
+    edits = []
+    for dataset_id, dataset in located.items():
+        for name, (_, value) in changes[dataset_id]["modified"].items():
+            logger.debug(f"Updating attribute {name} with value {value}")
+            attribute = dataset["attributes"][name]
+            if attribute["close"] is None:
+                edits.append(
+                    (
+                        attribute["start"],
+                        attribute["end"],
+                        _attribute_bytes(name, value, encoding),
+                    )
+                )
             else:
-                # Create a new attribute
-                logger.debug(f"Adding new attribute {name} with value {value}")
-                new_attribute = etree.Element("att")
-                new_attribute.text = value
-                new_attribute.attrib["name"] = name
-                dataset.find(".//addAttributes").append(new_attribute)
+                edits.append(
+                    (attribute["tag_end"], attribute["close"], _escape(value, encoding))
+                )
 
-        return
+        if new_attributes := [
+            _attribute_bytes(name, value, encoding)
+            for name, value in changes[dataset_id]["added"].items()
+        ]:
+            logger.debug(f"Adding new attributes {list(changes[dataset_id]['added'])}")
+            edits.append(_insert_attributes(data, dataset, new_attributes))
 
+    in_place = _same_file(output_file, xml_file)
+    if not edits and in_place:
+        return changes
 
-def update_dataset_xml(
-    datasets_xml: str,
-    records: Union[str, list],
-    erddap_url: str,
-    output_dir: str = None,
-):
-    """Update an ERDDAP dataset.xml with new global attributes."""
+    chunks = []
+    position = 0
+    for start, end, replacement in sorted(edits, key=lambda edit: edit[:2]):
+        chunks += [data[position:start], replacement]
+        position = end
+    chunks.append(data[position:])
 
-    # Find dataset xml
-    if isinstance(records, str):
-        record_files = glob(records, recursive=True)
-        records = [
-            yaml.safe_load(Path(record_file).read_text())
-            for record_file in record_files
-        ]
+    with tempfile.NamedTemporaryFile(
+        "wb", dir=output_file.parent, prefix=f".{output_file.name}.", delete=False
+    ) as output:
+        output.writelines(chunks)
+    _replace_file(output.name, output_file, fingerprint if in_place else None)
+    return changes
+
+
+def flag_key(dataset_id: str, flag_key_key: str) -> str:
+    """Compute the flagKey of a dataset as ERDDAP does.
+
+    ERDDAP only accepts the flag requests of a dataset with its own key, the
+    last 12 hexadecimal digits of the MD5 digest of the server <flagKeyKey>
+    followed by the datasetID.
+    """
+    digest = hashlib.md5((flag_key_key + dataset_id).encode("utf-8")).hexdigest()
+    return digest[-12:]
+
+
+def _check_flag_url(flag_url: str, flag_key_key: str):
+    if flag_url and "{flag_key}" in flag_url and not flag_key_key:
+        raise ValueError("A flagKeyKey is required to fill {flag_key} in the flag URL.")
+
+
+def flag_datasets(
+    dataset_ids,
+    flag_dir: str | None = None,
+    flag_url: str | None = None,
+    erddap_url: str | None = None,
+    flag_key_key: str | None = None,
+) -> list:
+    """Flag datasets so that ERDDAP reloads them.
+
+    Args:
+        dataset_ids (list): The datasetIDs to reload.
+        flag_dir (str, optional): ERDDAP flag directory, an empty file named
+            after each datasetID is written to it.
+        flag_url (str, optional): URL template formatted with the {dataset_id},
+            the {erddap_url} base URL and the dataset {flag_key} and requested
+            for each dataset.
+        erddap_url (str, optional): ERDDAP base URL of the datasets.
+        flag_key_key (str, optional): The <flagKeyKey> of the ERDDAP setup.xml
+            used to compute the {flag_key} of each dataset.
+
+    Returns:
+        list: The datasetIDs that couldn't be flagged.
+    """
+    _check_flag_url(flag_url, flag_key_key)
+    failed = []
+    for dataset_id in dataset_ids:
+        if flag_dir:
+            logger.debug("Write flag file for {}", dataset_id)
+            try:
+                (Path(flag_dir) / dataset_id).touch()
+            except OSError as error:
+                logger.error("Failed to flag dataset {}: {}", dataset_id, error)
+                failed.append(dataset_id)
+                continue
+        if flag_url:
+            url = flag_url.format(
+                dataset_id=quote(dataset_id),
+                erddap_url=(erddap_url or "").rstrip("/"),
+                flag_key=flag_key(dataset_id, flag_key_key) if flag_key_key else "",
+            )
+            logger.debug("Request flag url {}", url)
+            try:
+                response = requests.get(url, timeout=30)
+                response.raise_for_status()
+            except requests.RequestException as error:
+                logger.error("Failed to flag dataset {}: {}", dataset_id, error)
+                failed.append(dataset_id)
+    return failed
+
+
+def _update_file(file, datasets, mode="tree", output_dir=None, dry_run=False) -> dict:
+    """Update a single datasets.xml file and return its change sets.
+
+    The file is only replaced if no other process modified it in the
+    meantime, otherwise it is read again and the changes re-applied.
+    """
+    for attempt in range(1, UPDATE_ATTEMPTS + 1):
+        try:
+            return _apply_file(file, datasets, mode, output_dir, dry_run)
+        except ConcurrentUpdateError as error:
+            if attempt == UPDATE_ATTEMPTS:
+                raise
+            logger.warning("{}, re-applying the changes", error)
+
+
+def _apply_file(file, datasets, mode="tree", output_dir=None, dry_run=False) -> dict:
+    file_output = Path(output_dir) / Path(file).name if output_dir else file
+    if mode == "stream":
+        logger.debug("Streaming updated XML to {}", file_output)
+        return stream_update(file, datasets, file_output, dry_run)
+    if mode == "splice":
+        logger.debug("Splicing updated attributes in {}", file_output)
+        return splice_update(file, datasets, file_output, dry_run)
+
+    erddap = ERDDAP(file)
+    file_changes = {
+        dataset_id: erddap.update(dataset_id, datasets[dataset_id], dry_run)
+        for dataset_id in erddap.datasets
+        if dataset_id in datasets
+    }
+    if not dry_run and (
+        output_dir or any(has_changes(item) for item in file_changes.values())
+    ):
+        logger.debug("Writing updated XML to {}", file_output)
+        erddap.save(file_output)
+    return file_changes
+
+
+# Global attributes shared with the worker processes
+_worker_datasets = {}
+
+
+def _init_worker(datasets):
+    global _worker_datasets
+    _worker_datasets = datasets
+
+
+def _update_file_worker(file, mode, output_dir, dry_run) -> tuple:
+    return file, _update_file(file, _worker_datasets, mode, output_dir, dry_run)
+
+
+def _update_files(files, datasets, mode, output_dir, dry_run, workers=1):
+    """Update each file, spread over a pool of processes if workers > 1.
+
+    Yields:
+        tuple: Each file with its change sets.
+    """
+    if workers <= 1 or len(files) <= 1:
+        for file in files:
+            yield file, _update_file(file, datasets, mode, output_dir, dry_run)
+        return
 
-    # Find dataset xml
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(datasets,)
+    ) as executor:
+        yield from executor.map(
+            _update_file_worker,
+            files,
+            repeat(mode),
+            repeat(output_dir),
+            repeat(dry_run),
+            chunksize=max(1, len(files) // (workers * 4)),
+        )
+
+
+def _update_server(
+    datasets_xml: str,
+    datasets: dict,
+    erddap_url: str | None = None,
+    output_dir: str | None = None,
+    mode: str = "tree",
+    flag_dir: str | None = None,
+    flag_url: str | None = None,
+    dry_run: bool = False,
+    workers: int = 1,
+    flag_key_key: str | None = None,
+) -> dict:
+    """Update the datasets.xml files of a server with the datasets global attributes."""
     erddap_files = glob(datasets_xml, recursive=True)
     if not erddap_files:
         assert ValueError(f"No files found in {datasets_xml}")
 
-    datasets = [
-        dataset
-        for record in records
-        for dataset in _get_dataset_id_from_record(record, erddap_url)
-        if dataset
-    ]
-    dataset_ids = [dataset_id for dataset_id, _ in datasets]
-    updated = []
-    for file in erddap_files:
-        erddap = ERDDAP(file)
-        for dataset_id, attrs in datasets:
-            if not dataset_id:
-                continue
-            if erddap.has_dataset_id(dataset_id):
-                # Update the XML
-                erddap.update(dataset_id, attrs)
-                updated += [dataset_id]
-        file_output = Path(output_dir) / Path(file).name if output_dir else file
-        logger.debug("Writing updated XML to {}", file_output)
-        erddap.save(file_output or file)
+    report = {
+        "changes": {},
+        "updated": [],
+        "changed": [],
+        "missing": [],
+        "flag_failed": [],
+    }
+    for file, file_changes in _update_files(
+        erddap_files, datasets, mode, output_dir, dry_run, workers
+    ):
+        report["changes"][file] = file_changes
+        report["updated"] += list(file_changes)
+        report["changed"] += [
+            dataset_id
+            for dataset_id, changes in file_changes.items()
+            if has_changes(changes)
+        ]
 
+    found = set(report["updated"])
     if missing_datasets := [
-        dataset_id for dataset_id in dataset_ids if dataset_id not in updated
+        dataset_id for dataset_id in datasets if dataset_id not in found
     ]:
         logger.warning(f"Dataset ID {missing_datasets} not found in {datasets_xml}.")
-    return updated
+    report["missing"] = missing_datasets
+
+    logger.info("{} datasets changed", len(report["changed"]))
+    if report["changed"] and not dry_run and (flag_dir or flag_url):
+        report["flag_failed"] = flag_datasets(
+            report["changed"],
+            flag_dir=flag_dir,
+            flag_url=flag_url,
+            erddap_url=erddap_url,
+            flag_key_key=flag_key_key,
+        )
+        if report["flag_failed"]:
+            logger.error(
+                "{} of {} changed datasets couldn't be flagged for reload: {}",
+                len(report["flag_failed"]),
+                len(report["changed"]),
+                report["flag_failed"],
+            )
+    return report
+
+
+def update_dataset_xml(
+    datasets_xml: str,
+    records: str | list,
+    erddap_url: str,
+    output_dir: str | None = None,
+    mode: str = "tree",
+    flag_dir: str | None = None,
+    flag_url: str | None = None,
+    dry_run: bool = False,
+    workers: int = 1,
+    flag_key_key: str | None = None,
+) -> dict:
+    """Update an ERDDAP dataset.xml with new global attributes.
+
+    The datasets whose attributes changed can be reloaded by ERDDAP through
+    its flag directory or flag URL.
+
+    Args:
+        datasets_xml (str): ERDDAP datasets.xml file or glob pattern.
+        records (str, list): Metadata records or glob pattern of record files.
+        erddap_url (str): ERDDAP base URL used to match the records distributions.
+        output_dir (str, optional): Output directory, files are updated in place by default.
+        mode (str, optional): "tree" parses each file in memory, "stream" updates
+            each file one dataset at a time with a bounded memory use and
+            "splice" only replaces the bytes of the changed attributes.
+        flag_dir (str, optional): ERDDAP flag directory to write the changed
+            datasets flag files to.
+        flag_url (str, optional): URL template called for each changed dataset, ex:
+            "{erddap_url}/setDatasetFlag.txt?datasetID={dataset_id}&flagKey={flag_key}".
+        dry_run (bool, optional): Only compute the change sets, no file is written.
+        workers (int, optional): Number of processes used to load the record
+            files and update the datasets.xml files, useful with a datasets.d
+            directory of many fragments.
+        flag_key_key (str, optional): The <flagKeyKey> of the ERDDAP setup.xml,
+            the {flag_key} of each dataset is computed from it.
+
+    Returns:
+        dict: The update report with the "changes" of each file and dataset,
+            the "updated" datasetIDs found, those "changed", those "missing"
+            and those "flag_failed" to be flagged for reload.
+    """
+    return update_erddap_servers(
+        {erddap_url: datasets_xml},
+        records,
+        output_dir,
+        mode=mode,
+        flag_dir=flag_dir,
+        flag_url=flag_url,
+        dry_run=dry_run,
+        workers=workers,
+        flag_key_key=flag_key_key,
+    )[erddap_url]
+
+
+def _server_dirname(erddap_url: str) -> str:
+    netloc, path = _split_url(erddap_url)
+    return re.sub(r"[^\w.-]+", "_", f"{netloc}{path}".rstrip("/"))
+
+
+@contact_registry()
+def update_erddap_servers(
+    servers: dict,
+    records: str | list,
+    output_dir: str | None = None,
+    mode: str = "tree",
+    flag_dir: str | None = None,
+    flag_url: str | None = None,
+    dry_run: bool = False,
+    workers: int = 1,
+    flag_key_key: str | None = None,
+) -> dict:
+    """Update the datasets.xml of several ERDDAP servers from one set of records.
+
+    The records are loaded and their global attributes computed once, then
+    each server is updated with the datasets its distributions point to.
+
+    Args:
+        servers (dict): ERDDAP datasets.xml file or glob pattern by base URL.
+        records (str, list): Metadata records or glob pattern of record files.
+        output_dir (str, optional): Output directory, files are updated in place
+            by default. Each server is written to its own subdirectory when
+            there are several servers.
+        mode (str, optional): Update mode, see update_dataset_xml.
+        flag_dir (str, optional): ERDDAP flag directory shared by the servers.
+        flag_url (str, optional): URL template called for each changed dataset,
+            formatted with its {erddap_url}, {dataset_id} and {flag_key}.
+        dry_run (bool, optional): Only compute the change sets, no file is written.
+        workers (int, optional): Number of processes used to load the record
+            files and update the datasets.xml files.
+        flag_key_key (str, optional): The <flagKeyKey> of the ERDDAP servers
+            setup.xml, used to compute the {flag_key} of each dataset.
+
+    Returns:
+        dict: The update report of each ERDDAP base URL.
+    """
+    _check_flag_url(flag_url, flag_key_key)
+
+    # Load records
+    if isinstance(records, str):
+        records = load_records(records, workers)
+
+    servers_datasets = route_datasets_attributes(records, list(servers))
+
+    reports = {}
+    for erddap_url, datasets_xml in servers.items():
+        server_output_dir = output_dir
+        if output_dir and len(servers) > 1:
+            server_output_dir = Path(output_dir) / _server_dirname(erddap_url)
+            server_output_dir.mkdir(parents=True, exist_ok=True)
+        logger.info("Updating {} datasets.xml {}", erddap_url, datasets_xml)
+        reports[erddap_url] = _update_server(
+            datasets_xml,
+            servers_datasets[erddap_url],
+            erddap_url,
+            server_output_dir,
+            mode=mode,
+            flag_dir=flag_dir,
+            flag_url=flag_url,
+            dry_run=dry_run,
+            workers=workers,
+            flag_key_key=flag_key_key,
+        )
+    return reports
+
+
+@contact_registry()
+def write_attributes_fragments(
+    records, erddap_url: str, output: str, combined: bool = False
+) -> list:
+    """Write the addAttributes fragment of every dataset of an ERDDAP server.
+
+    Each fragment is written as soon as its record is processed, either to
+    "<output>/<datasetID>.xml" or, if combined, as a dataset element of a
+    single "<datasets>" document. Only the first record of a datasetID is kept.
+
+    Args:
+        records (iterable): Metadata records.
+        erddap_url (str): ERDDAP base URL used to match the records distributions.
+        output (str): Output directory, or output file if combined.
+        combined (bool, optional): Write all the fragments to a single file.
+
+    Returns:
+        list: The datasetIDs written.
+    """
+    dataset_ids = []
+    seen = set()
+
+    def _iter_datasets():
+        for _, dataset_id, attributes in iter_datasets_attributes(
+            records, [erddap_url]
+        ):
+            if dataset_id in seen:
+                logger.warning("Skip duplicate dataset ID {}", dataset_id)
+                continue
+            seen.add(dataset_id)
+            dataset_ids.append(dataset_id)
+            yield dataset_id, attributes
+
+    if combined:
+        with etree.xmlfile(str(output), encoding="utf-8") as xf:
+            xf.write_declaration()
+            with xf.element("datasets"):
+                for dataset_id, attributes in _iter_datasets():
+                    xf.write("\n    ")
+                    with xf.element("dataset", datasetID=dataset_id):
+                        xf.write("\n        ")
+                        _write_add_attributes(xf, attributes, "        ")
+                        xf.write("\n    ")
+                    xf.flush()
+                xf.write("\n")
+        return dataset_ids
+
+    Path(output).mkdir(parents=True, exist_ok=True)
+    for dataset_id, attributes in _iter_datasets():
+        fragment = Path(output) / f"{dataset_id}.xml"
+        with etree.xmlfile(str(fragment), encoding="utf-8") as xf:
+            _write_add_attributes(xf, attributes)
+    return dataset_ids
+
+
+def shard_records(records: str | list, shard: tuple, workers: int = 1) -> tuple:
+    """Select the records of a shard, by file path or metadata.identifier.
+
+    Only the record files of the shard are loaded.
+
+    Args:
+        records (str, list): Metadata records or glob pattern of record files.
+        shard (tuple): Shard index and number of shards.
+        workers (int, optional): Number of processes used to load the files.
+
+    Returns:
+        tuple: The keys of all the records, the keys of the shard records
+            and the shard records.
+    """
+    if isinstance(records, str):
+        keys = glob(records, recursive=True)
+        inputs = [key for key in keys if sharding.in_shard(key, shard)]
+        return keys, inputs, load_records(inputs, workers)
+
+    keys = [sharding.record_key(record) for record in records]
+    selected = [
+        (key, record)
+        for key, record in zip(keys, records)
+        if sharding.in_shard(key, shard)
+    ]
+    return keys, [key for key, _ in selected], [record for _, record in selected]
+
+
+def _parse_servers(ctx, param, value) -> list:
+    servers = []
+    for item in value:
+        erddap_url, sep, datasets_xml = item.partition("=")
+        if not sep or not erddap_url or not datasets_xml:
+            raise click.BadParameter(f"{item!r} is not in the URL=DATASETS_XML format.")
+        servers.append((erddap_url, datasets_xml))
+    return servers
 
 
 @click.command()
-@click.option("--datasets-xml", "-d", required=True, help="ERDDAP dataset.xml file.")
+@click.option("--datasets-xml", "-d", help="ERDDAP dataset.xml file.")
 @click.option("--records", "-r", help="Metadata records.")
-@click.option("--erddap-url", "-u", required=True, help="ERDDAP base URL.")
+@click.option("--erddap-url", "-u", help="ERDDAP base URL.")
+@click.option(
+    "--server",
+    multiple=True,
+    callback=_parse_servers,
+    metavar="URL=DATASETS_XML",
+    help="ERDDAP base URL and its datasets.xml file or glob pattern, "
+    "can be repeated to update several servers at once.",
+)
 @click.option("--output-dir", "-o", help="Output directory.")
 @click.option(
     "--record-status", "-s", default="published", help="Record submission status."
@@ -386,19 +1687,93 @@ def update_dataset_xml(
 @click.option("--firebase-auth-key", "-k", help="Firebase auth key.")
 @click.option("--region", "-r", help="Region to fetch records for.")
 @click.option("--database-url", "-b", help="Firebase database URL.")
+@click.option(
+    "--fetch-workers",
+    type=int,
+    default=0,
+    help="Fetch Firebase records user by user with this many concurrent requests.",
+)
+@click.option("--mirror", "-m", help="SQLite Firebase mirror to use as input.")
+@click.option(
+    "--where",
+    "-w",
+    help="SQL condition used to select the mirror records, ex: \"status = 'published'\".",
+)
+@click.option(
+    "--mode",
+    type=click.Choice(["tree", "stream", "splice"]),
+    default="tree",
+    show_default=True,
+    help="Update mode, stream keeps the memory use bounded on large files "
+    "and splice leaves every unchanged byte as is.",
+)
+@click.option(
+    "--flag-dir", help="ERDDAP flag directory used to reload the changed datasets."
+)
+@click.option(
+    "--flag-url",
+    help="URL requested to reload each changed dataset, {dataset_id} is replaced "
+    "by the datasetID, {erddap_url} by the ERDDAP base URL and {flag_key} by the "
+    "flagKey of the dataset, ex: "
+    "{erddap_url}/setDatasetFlag.txt?datasetID={dataset_id}&flagKey={flag_key}",
+)
+@click.option(
+    "--flag-key-key",
+    envvar="ERDDAP_FLAG_KEY_KEY",
+    help="<flagKeyKey> of the ERDDAP setup.xml used to compute the flagKey of "
+    "each dataset, read from ERDDAP_FLAG_KEY_KEY by default.",
+)
+@click.option(
+    "--dry-run", is_flag=True, help="Print the changes without writing any file."
+)
+@click.option(
+    "--workers",
+    type=int,
+    default=1,
+    show_default=True,
+    help="Number of processes used to load the records and update the datasets.xml files.",
+)
+@sharding.shard_option
+@sharding.manifest_option
 def update(
     datasets_xml,
     records,
     erddap_url,
+    server,
     output_dir,
     record_status,
     firebase_auth_key,
     region,
     database_url,
+    fetch_workers,
+    mirror,
+    where,
+    mode,
+    flag_dir,
+    flag_url,
+    flag_key_key,
+    dry_run,
+    workers,
+    shard,
+    manifest,
 ):
     """Update ERDDAP dataset xml with metadata records."""
+    servers = dict(server)
+    if datasets_xml and erddap_url:
+        servers[erddap_url] = datasets_xml
+    elif datasets_xml or erddap_url:
+        raise click.UsageError("--datasets-xml and --erddap-url go together.")
+    if not servers:
+        raise click.UsageError("Missing --datasets-xml and --erddap-url or --server.")
 
-    if not records and firebase_auth_key and region and database_url:
+    if not records and mirror:
+        logger.info("Loading records from mirror {}", mirror)
+        with FirebaseMirror(mirror) as firebase_mirror:
+            records = firebase_mirror.get_cioos_records(where)
+        logger.info("Retrieved {} records", len(records))
+        if not records:
+            return
+    elif not records and firebase_auth_key and region and database_url:
         logger.info(
             "Fetching records from Firebase for region: {}, status: {}, database URL: {}",
             region,
@@ -406,22 +1781,121 @@ def update(
             database_url,
         )
 
-        records = get_records_from_firebase(
-            region,
-            firebase_auth_key,
-            None,
-            record_status.split(","),
-            database_url,
-        )
-        # Convert firebase records to CIOOS schema
+        if fetch_workers:
+            # Convert records as soon as each user's records are received
+            records = [
+                cioos_firebase_to_cioos_schema(record)
+                for record in iter_records_from_firebase(
+                    region,
+                    firebase_auth_key,
+                    record_status.split(","),
+                    database_url,
+                    fetch_workers,
+                )
+            ]
+        else:
+            records = get_records_from_firebase(
+                region,
+                firebase_auth_key,
+                None,
+                record_status.split(","),
+                database_url,
+            )
+            # Convert firebase records to CIOOS schema
+            records = [
+                cioos_firebase_to_cioos_schema(record)
+                if isinstance(record, dict)
+                else record
+                for record in records
+            ]
         logger.info("Retrieved {} records", len(records))
         if not records:
             return
-        records = [
-            cioos_firebase_to_cioos_schema(record)
-            if isinstance(record, dict)
-            else record
-            for record in records
-        ]
 
-    update_dataset_xml(datasets_xml, records, erddap_url, output_dir)
+    if shard:
+        keys, inputs, records = shard_records(records, shard, workers)
+
+    reports = update_erddap_servers(
+        servers,
+        records,
+        output_dir,
+        mode=mode,
+        flag_dir=flag_dir,
+        flag_url=flag_url,
+        dry_run=dry_run,
+        workers=workers,
+        flag_key_key=flag_key_key,
+    )
+    if shard:
+        sharding.write_manifest(
+            manifest or sharding.manifest_path(output_dir, shard),
+            "erddap-update",
+            shard,
+            keys,
+            inputs,
+            [
+                f"{erddap_url} {dataset_id}"
+                for erddap_url, report in reports.items()
+                for dataset_id in report["updated"]
+            ],
+        )
+    if dry_run:
+        for report in reports.values():
+            click.echo(format_changes(report["changes"]))
+    if flag_failed := [
+        f"{erddap_url} {dataset_id}"
+        for erddap_url, report in reports.items()
+        for dataset_id in report["flag_failed"]
+    ]:
+        raise click.ClickException(
+            f"{len(flag_failed)} changed datasets couldn't be flagged for reload: "
+            f"{flag_failed}"
+        )
+
+
+@click.command()
+@click.option("--records", "-i", help="Metadata records glob pattern.")
+@click.option("--mirror", "-m", help="SQLite Firebase mirror to use as input.")
+@click.option(
+    "--where",
+    "-w",
+    help="SQL condition used to select the mirror records, ex: \"status = 'published'\".",
+)
+@click.option("--erddap-url", "-u", required=True, help="ERDDAP base URL.")
+@click.option(
+    "--output",
+    "-o",
+    required=True,
+    help="Output directory, or output file with --combined.",
+)
+@click.option(
+    "--combined", is_flag=True, help="Write every fragment to a single XML file."
+)
+@click.option(
+    "--workers",
+    type=int,
+    default=1,
+    show_default=True,
+    help="Number of processes used to load the records.",
+)
+def fragments(records, mirror, where, erddap_url, output, combined, workers):
+    """Generate the ERDDAP addAttributes fragment of every dataset of a catalogue."""
+    if records:
+        dataset_ids = write_attributes_fragments(
+            iter_records(records, workers), erddap_url, output, combined
+        )
+    elif mirror:
+        with FirebaseMirror(mirror) as firebase_mirror:
+            dataset_ids = write_attributes_fragments(
+                (
+                    row["cioos"]
+                    for row in firebase_mirror.iter_records(where)
+                    if row["cioos"]
+                ),
+                erddap_url,
+                output,
+                combined,
+            )
+    else:
+        raise click.UsageError("Missing --records or --mirror.")
+    logger.info("Wrote {} dataset fragments to {}", len(dataset_ids), output)
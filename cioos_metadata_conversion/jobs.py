@@ -0,0 +1,531 @@
+"""
+Local SQLite queue of conversion jobs and the workers processing them.
+
+A job converts one source record to one or several output formats written
+to a destination directory. The jobs enqueued for a source and destination
+while a previous one is still pending are coalesced into it, a burst of edits
+of the same record then leads to a single conversion. Workers are long lived
+processes claiming the jobs one at a time, a failed job is retried with an
+exponential backoff and the jobs of a worker which stopped responding are
+claimed again once their lease expired. A job isn't claimed while another
+job of the same source and destination is running, and a worker whose lease
+expired can't complete or fail the job anymore.
+"""
+
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import click
+from loguru import logger
+
+from cioos_metadata_conversion import validation
+from cioos_metadata_conversion.record import OUTPUT_FORMATS, InputSchemas, Record
+
+JOB_COLUMNS = (
+    "id",
+    "source",
+    "schema",
+    "formats",
+    "destination",
+    "status",
+    "attempts",
+    "available_at",
+    "enqueued_at",
+    "started_at",
+    "finished_at",
+    "worker",
+    "timings",
+    "error",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,
+    schema TEXT NOT NULL,
+    formats TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    enqueued_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    worker TEXT,
+    timings TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_available ON jobs (status, available_at);
+CREATE INDEX IF NOT EXISTS jobs_source ON jobs (source, destination, status);
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_pending
+    ON jobs (source, destination) WHERE status = 'pending';
+"""
+
+# Job statuses, a job coalesced into another one after a failure is "merged"
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+MERGED = "merged"
+
+MAX_BACKOFF = 600
+
+
+def _merge_formats(formats: str, other: str) -> str:
+    merged = formats.split(",")
+    merged += [item for item in other.split(",") if item not in merged]
+    return ",".join(merged)
+
+
+class JobQueue:
+    """SQLite queue of conversion jobs, shared by the worker processes."""
+
+    def __init__(self, path, timeout: float = 30) -> None:
+        self.path = path
+        # Transactions are explicit to lock the queue while claiming a job
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @contextmanager
+    def _transaction(self):
+        """Lock the queue until the transaction is committed or rolled back."""
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def _row(self, row) -> dict:
+        job = dict(zip(JOB_COLUMNS, row))
+        job["formats"] = job["formats"].split(",")
+        job["timings"] = json.loads(job["timings"]) if job["timings"] else None
+        return job
+
+    def _coalesce(self, source, destination, formats, schema, now, job_id=None) -> int:
+        """Add formats to the pending job of a source, None if there is none."""
+        row = self.connection.execute(
+            "SELECT id, formats FROM jobs "
+            "WHERE status = ? AND source = ? AND destination = ? AND id IS NOT ?",
+            (PENDING, source, destination, job_id),
+        ).fetchone()
+        if row is None:
+            return None
+        self.connection.execute(
+            "UPDATE jobs SET formats = ?, schema = ?, "
+            "available_at = MIN(available_at, ?) WHERE id = ?",
+            (_merge_formats(row[1], formats), schema, now, row[0]),
+        )
+        return row[0]
+
+    def enqueue(self, source, formats, destination, schema="CIOOS") -> int:
+        """
+        Add a conversion job, or coalesce it into the pending job of the
+        same source and destination.
+
+        Args:
+            source (str): Record file or URL.
+            formats (list): Output formats.
+            destination (str): Output directory.
+            schema (str, optional): Input schema of the record.
+
+        Returns:
+            int: The ID of the job.
+        """
+        if unknown := [item for item in formats if item not in OUTPUT_FORMATS]:
+            raise ValueError(f"Unsupported output formats: {unknown}")
+        if schema not in InputSchemas.__members__:
+            raise ValueError(f"Unsupported schema: {schema}")
+        if not formats:
+            raise ValueError("A job needs at least one output format.")
+
+        now = time.time()
+        formats = ",".join(dict.fromkeys(formats))
+        source, destination = str(source), str(destination)
+        with self._transaction() as connection:
+            job_id = self._coalesce(source, destination, formats, schema, now)
+            if job_id is None:
+                job_id = connection.execute(
+                    "INSERT INTO jobs (source, schema, formats, destination, "
+                    "status, available_at, enqueued_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (source, schema, formats, destination, PENDING, now, now),
+                ).lastrowid
+            else:
+                logger.debug("Coalesced {} into job {}", source, job_id)
+        return job_id
+
+    def claim(self, worker: str, lease: float = 300, max_attempts: int = 3) -> dict:
+        """
+        Claim the next available job.
+
+        The pending jobs are claimed in order, as well as the running jobs
+        whose worker didn't complete them within their lease, unless they
+        already had max_attempts. The jobs of a source and destination are
+        left pending while another one of them is running.
+
+        Args:
+            worker (str): Name of the worker.
+            lease (float, optional): Seconds after which the job is claimed
+                again if it wasn't completed.
+            max_attempts (int, optional): Attempts before a job whose lease
+                expired is marked as failed.
+
+        Returns:
+            dict: The job, None if no job is available.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            expired = connection.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, "
+                "error = 'Lease expired after ' || attempts || ' attempts' "
+                "WHERE status = ? AND available_at <= ? AND attempts >= ?",
+                (FAILED, now, RUNNING, now, max_attempts),
+            ).rowcount
+            if expired:
+                logger.warning("{} jobs failed after their last lease expired", expired)
+            row = connection.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs "
+                "WHERE status IN (?, ?) AND available_at <= ? AND NOT EXISTS ("
+                "SELECT 1 FROM jobs AS other WHERE other.source = jobs.source "
+                "AND other.destination = jobs.destination AND other.status = ? "
+                "AND other.available_at > ? AND other.id != jobs.id) "
+                "ORDER BY available_at, id LIMIT 1",
+                (PENDING, RUNNING, now, RUNNING, now),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, "
+                "available_at = ?, started_at = ?, worker = ? WHERE id = ?",
+                (RUNNING, now + lease, now, worker, row[0]),
+            )
+        job = self._row(row)
+        job.update(
+            status=RUNNING,
+            attempts=job["attempts"] + 1,
+            available_at=now + lease,
+            started_at=now,
+            worker=worker,
+        )
+        return job
+
+    def _owned(self, job: dict) -> str:
+        # The claim of a job is identified by its worker and start time
+        return "id = ? AND status = ? AND worker = ? AND started_at = ?", (
+            job["id"],
+            RUNNING,
+            job["worker"],
+            job["started_at"],
+        )
+
+    def complete(self, job: dict, timings: dict) -> bool:
+        """
+        Mark a job as done with the time spent on each of its steps.
+
+        Returns:
+            bool: False if the job was claimed again after its lease expired.
+        """
+        condition, parameters = self._owned(job)
+        with self._transaction() as connection:
+            updated = connection.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, timings = ?, "
+                f"error = NULL WHERE {condition}",
+                (DONE, time.time(), json.dumps(timings), *parameters),
+            ).rowcount
+        if not updated:
+            logger.warning("Job {} lease expired before it was completed", job["id"])
+        return bool(updated)
+
+    def fail(self, job: dict, error: str, max_attempts: int = 3, backoff: float = 5):
+        """
+        Retry a failed job after an exponential backoff, or mark it as failed
+        after max_attempts.
+
+        Returns:
+            str: The new status of the job, None if the job was claimed again
+                after its lease expired.
+        """
+        now = time.time()
+        condition, parameters = self._owned(job)
+        with self._transaction() as connection:
+            if not connection.execute(
+                f"SELECT 1 FROM jobs WHERE {condition}", parameters
+            ).fetchone():
+                logger.warning("Job {} lease expired before it failed", job["id"])
+                return None
+            if job["attempts"] >= max_attempts:
+                status, available_at = FAILED, job["available_at"]
+            elif self._coalesce(
+                job["source"],
+                job["destination"],
+                ",".join(job["formats"]),
+                job["schema"],
+                now,
+                job["id"],
+            ):
+                # A newer job of the same source will convert it again
+                status, available_at = MERGED, job["available_at"]
+            else:
+                delay = min(backoff * 2 ** (job["attempts"] - 1), MAX_BACKOFF)
+                status, available_at = PENDING, now + delay
+            connection.execute(
+                "UPDATE jobs SET status = ?, available_at = ?, finished_at = ?, "
+                f"error = ? WHERE {condition}",
+                (
+                    status,
+                    available_at,
+                    None if status == PENDING else now,
+                    error,
+                    *parameters,
+                ),
+            )
+        return status
+
+    def get(self, job_id: int) -> dict:
+        """Get a job by ID."""
+        row = self.connection.execute(
+            f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return self._row(row) if row else None
+
+    def stats(self) -> dict:
+        """Count the jobs by status."""
+        return dict(
+            self.connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+        )
+
+    def has_unfinished(self) -> bool:
+        """Check if some jobs are pending or running."""
+        return bool(
+            self.connection.execute(
+                "SELECT 1 FROM jobs WHERE status IN (?, ?) LIMIT 1", (PENDING, RUNNING)
+            ).fetchone()
+        )
+
+
+def _output_name(source: str, output_format: str) -> str:
+    if source.startswith(("http://", "https://")):
+        source = urlsplit(source).path
+    return Path(source).with_suffix(f".{output_format}").name
+
+
+def run_job(job: dict) -> dict:
+    """
+    Convert the record of a job to each of its formats.
+
+    Raises:
+        InvalidRecordError: The record can't be converted to one of the formats.
+
+    Returns:
+        dict: The seconds spent loading the record and converting it to
+            each format.
+    """
+    timings = {}
+    start = time.perf_counter()
+    record = (
+        Record(source=job["source"], schema=job["schema"])
+        .load()
+        .convert_to_cioos_schema()
+    )
+    if not record.metadata:
+        raise ValueError(f"No metadata record found in {job['source']}")
+    timings["load"] = time.perf_counter() - start
+
+    destination = Path(job["destination"])
+    destination.mkdir(parents=True, exist_ok=True)
+    for output_format in job["formats"]:
+        start = time.perf_counter()
+        validation.check_record(record.metadata, output_format, source=job["source"])
+        output = destination / _output_name(job["source"], output_format)
+        # Readers never see a partially written output
+        temp_file = output.with_name(f".{output.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            temp_file.write_text(record.convert_to(output_format), encoding="utf-8")
+            os.replace(temp_file, output)
+        finally:
+            temp_file.unlink(missing_ok=True)
+        timings[output_format] = time.perf_counter() - start
+    return timings
+
+
+def work(
+    path,
+    name: str | None = None,
+    poll_interval: float = 1,
+    max_attempts: int = 3,
+    backoff: float = 5,
+    lease: float = 300,
+    burst: bool = False,
+) -> int:
+    """
+    Process the jobs of a queue until stopped.
+
+    Args:
+        path (str): SQLite queue file.
+        name (str, optional): Name of the worker, its host and process ID by default.
+        poll_interval (float, optional): Seconds to wait when no job is available.
+        max_attempts (int, optional): Attempts before a job is marked as failed.
+        backoff (float, optional): Seconds before the first retry, doubled
+            after each attempt.
+        lease (float, optional): Seconds after which the job of an
+            unresponsive worker is claimed again.
+        burst (bool, optional): Stop once no job is pending or running.
+
+    Returns:
+        int: The number of jobs processed.
+    """
+    name = name or f"{socket.gethostname()}:{os.getpid()}"
+    n_jobs = 0
+    with JobQueue(path) as queue:
+        while True:
+            job = queue.claim(name, lease, max_attempts)
+            if job is None:
+                if burst and not queue.has_unfinished():
+                    return n_jobs
+                time.sleep(poll_interval)
+                continue
+
+            n_jobs += 1
+            logger.info(
+                "Job {} {} to {}, attempt {}",
+                job["id"],
+                job["source"],
+                ",".join(job["formats"]),
+                job["attempts"],
+            )
+            try:
+                timings = run_job(job)
+            except Exception as error:  # noqa: BLE001, a failed job is retried
+                status = queue.fail(job, repr(error), max_attempts, backoff)
+                logger.error("Job {} failed, {}: {!r}", job["id"], status, error)
+                continue
+            timings["wait"] = job["started_at"] - job["enqueued_at"]
+            queue.complete(job, timings)
+            logger.debug("Job {} done: {}", job["id"], timings)
+
+
+def run_workers(path, processes: int = 1, **kwargs) -> dict:
+    """
+    Process the jobs of a queue with several worker processes.
+
+    Args:
+        path (str): SQLite queue file.
+        processes (int, optional): Number of worker processes.
+        **kwargs: Options of each worker, see work.
+
+    Returns:
+        dict: The number of jobs by status once the workers stopped.
+    """
+    # Create the queue before the workers race to do it
+    JobQueue(path).close()
+    if processes <= 1:
+        work(path, **kwargs)
+    else:
+        workers = [
+            multiprocessing.Process(target=work, args=(path,), kwargs=kwargs)
+            for _ in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        finally:
+            # Their running jobs are claimed again once their lease expired
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+    with JobQueue(path) as queue:
+        return queue.stats()
+
+
+@click.command()
+@click.argument("sources", nargs=-1, required=True)
+@click.option("--queue", "-q", required=True, help="SQLite queue file.")
+@click.option(
+    "--output-format",
+    "-f",
+    multiple=True,
+    required=True,
+    type=click.Choice(OUTPUT_FORMATS.keys()),
+    help="Output format, can be repeated.",
+)
+@click.option(
+    "--output-dir", "-p", default=".", show_default=True, help="Output directory."
+)
+@click.option(
+    "--input-schema",
+    default="CIOOS",
+    type=click.Choice(InputSchemas.__members__.keys()),
+    show_default=True,
+    help="Input schema of the records.",
+)
+def enqueue(sources, queue, output_format, output_dir, input_schema):
+    """Add conversion jobs of record files or URLs to a queue."""
+    with JobQueue(queue) as job_queue:
+        for source in sources:
+            job_queue.enqueue(source, output_format, output_dir, input_schema)
+        logger.info("{} jobs enqueued, queue: {}", len(sources), job_queue.stats())
+
+
+@click.command()
+@click.option("--queue", "-q", required=True, help="SQLite queue file.")
+@click.option(
+    "--processes", "-n", default=1, show_default=True, help="Number of workers."
+)
+@click.option(
+    "--poll-interval",
+    default=1.0,
+    show_default=True,
+    help="Seconds to wait when no job is available.",
+)
+@click.option(
+    "--max-attempts",
+    default=3,
+    show_default=True,
+    help="Attempts before a job is marked as failed.",
+)
+@click.option(
+    "--backoff",
+    default=5.0,
+    show_default=True,
+    help="Seconds before retrying a failed job, doubled after each attempt.",
+)
+@click.option(
+    "--lease",
+    default=300.0,
+    show_default=True,
+    help="Seconds after which the job of an unresponsive worker is claimed again.",
+)
+@click.option("--burst", is_flag=True, help="Stop once every job is done or failed.")
+def worker(queue, processes, poll_interval, max_attempts, backoff, lease, burst):
+    """Process the conversion jobs of a queue with several workers."""
+    stats = run_workers(
+        queue,
+        processes,
+        poll_interval=poll_interval,
+        max_attempts=max_attempts,
+        backoff=backoff,
+        lease=lease,
+        burst=burst,
+    )
+    logger.info("Workers stopped, queue: {}", stats)
@@ -0,0 +1,233 @@
+"""
+Local SQLite mirror of the Firebase metadata records.
+
+The mirror keeps the raw Firebase record and its CIOOS schema conversion
+side by side, indexed by region, user, record ID, status, identifier and
+modification time, so that conversions can be run offline. A full sync of a
+region deletes the records which were deleted from Firebase.
+"""
+
+import json
+import sqlite3
+
+import click
+from loguru import logger
+
+from cioos_metadata_conversion.cioos import (
+    DEFAULT_MAX_WORKERS,
+    get_records_from_firebase,
+    iter_records_from_firebase,
+)
+from cioos_metadata_conversion.firebase_to_cioos import record_json_to_yaml
+
+MIRROR_COLUMNS = (
+    "region",
+    "user_id",
+    "record_id",
+    "status",
+    "identifier",
+    "modified",
+    "raw",
+    "cioos",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    region TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    record_id TEXT NOT NULL,
+    status TEXT,
+    identifier TEXT,
+    modified TEXT,
+    raw TEXT NOT NULL,
+    cioos TEXT,
+    PRIMARY KEY (region, user_id, record_id)
+);
+CREATE INDEX IF NOT EXISTS records_user_id ON records (user_id);
+CREATE INDEX IF NOT EXISTS records_record_id ON records (record_id);
+CREATE INDEX IF NOT EXISTS records_status ON records (region, status);
+CREATE INDEX IF NOT EXISTS records_identifier ON records (identifier);
+CREATE INDEX IF NOT EXISTS records_modified ON records (modified);
+"""
+
+
+def _to_cioos(record):
+    # record_json_to_yaml modifies the record in place
+    try:
+        return record_json_to_yaml(json.loads(json.dumps(record)))
+    except Exception as error:  # noqa: BLE001, any malformed record is skipped
+        logger.warning(
+            "Failed to convert record {} to CIOOS schema: {!r}",
+            record.get("recordID"),
+            error,
+        )
+        return None
+
+
+def _to_row(record, region=None) -> tuple:
+    cioos = _to_cioos(record)
+    return (
+        record.get("region") or region,
+        record.get("userID"),
+        record.get("recordID"),
+        record.get("status"),
+        record.get("identifier"),
+        record.get("created"),
+        json.dumps(record),
+        json.dumps(cioos) if cioos else None,
+    )
+
+
+class FirebaseMirror:
+    """SQLite mirror of Firebase records."""
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def upsert(self, records, region=None) -> int:
+        """Insert or replace Firebase records in the mirror.
+
+        Args:
+            records (iterable): Records in Firebase format.
+            region (str, optional): Region used when a record doesn't define one.
+
+        Returns:
+            int: The number of records stored.
+        """
+        rows = (_to_row(record, region) for record in records)
+        with self.connection:
+            cursor = self.connection.executemany(
+                f"INSERT OR REPLACE INTO records ({', '.join(MIRROR_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(MIRROR_COLUMNS))})",
+                rows,
+            )
+        return cursor.rowcount
+
+    def sync(self, records, region: str, statuses=None) -> tuple:
+        """Mirror all the records of a region fetched from Firebase.
+
+        The records are upserted and the rows of the region which aren't part
+        of them anymore are deleted, in a single transaction: nothing is
+        deleted if the records can't all be fetched.
+
+        Args:
+            records (iterable): Every record of the region in Firebase format.
+            region (str): The region fetched.
+            statuses (list, optional): Statuses the records were filtered on,
+                only the rows with one of them are deleted.
+
+        Returns:
+            tuple: The number of records stored and of rows deleted.
+        """
+        seen = []
+
+        def _rows():
+            for record in records:
+                row = _to_row(record, region)
+                seen.append(row[1:3])
+                yield row
+
+        with self.connection:
+            upserted = self.connection.executemany(
+                f"INSERT OR REPLACE INTO records ({', '.join(MIRROR_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(MIRROR_COLUMNS))})",
+                _rows(),
+            ).rowcount
+            self.connection.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS seen "
+                "(user_id TEXT, record_id TEXT, PRIMARY KEY (user_id, record_id))"
+            )
+            self.connection.execute("DELETE FROM seen")
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO seen VALUES (?, ?)", seen
+            )
+            query = (
+                "DELETE FROM records WHERE region = ? AND NOT EXISTS ("
+                "SELECT 1 FROM seen WHERE seen.user_id = records.user_id "
+                "AND seen.record_id = records.record_id)"
+            )
+            params = [region]
+            if statuses:
+                query += f" AND status IN ({', '.join('?' * len(statuses))})"
+                params += list(statuses)
+            deleted = self.connection.execute(query, params).rowcount
+        return upserted, deleted
+
+    def iter_records(self, where: str | None = None, params=()):
+        """Iterate over the mirrored records.
+
+        Args:
+            where (str, optional): SQL condition on the mirror columns
+                (region, user_id, record_id, status, identifier, modified).
+            params (tuple, optional): Parameters bound to the condition.
+
+        Yields:
+            dict: The mirror row with the raw and cioos records decoded.
+        """
+        query = f"SELECT {', '.join(MIRROR_COLUMNS)} FROM records"
+        if where:
+            query += f" WHERE {where}"
+        query += " ORDER BY region, user_id, record_id"
+        for row in self.connection.execute(query, params):
+            row = dict(zip(MIRROR_COLUMNS, row))
+            row["raw"] = json.loads(row["raw"])
+            row["cioos"] = json.loads(row["cioos"]) if row["cioos"] else None
+            yield row
+
+    def get_cioos_records(self, where: str | None = None, params=()) -> list:
+        """Get the CIOOS schema records matching a condition."""
+        return [
+            row["cioos"] for row in self.iter_records(where, params) if row["cioos"]
+        ]
+
+
+@click.command()
+@click.option("--mirror", "-m", required=True, help="SQLite mirror file.")
+@click.option("--firebase-auth-key", "-k", required=True, help="Firebase auth key.")
+@click.option("--region", "-r", required=True, multiple=True, help="Region to mirror.")
+@click.option("--database-url", "-b", required=True, help="Firebase database URL.")
+@click.option(
+    "--record-status",
+    "-s",
+    help="Comma separated record submission statuses, all statuses by default.",
+)
+@click.option(
+    "--fetch-workers",
+    type=int,
+    default=DEFAULT_MAX_WORKERS,
+    show_default=True,
+    help="Number of concurrent requests, 0 to download each region at once.",
+)
+def mirror(
+    mirror, firebase_auth_key, region, database_url, record_status, fetch_workers
+):
+    """Mirror Firebase records into a local SQLite database."""
+    record_status = record_status.split(",") if record_status else None
+    with FirebaseMirror(mirror) as firebase_mirror:
+        for item in region:
+            if fetch_workers:
+                records = iter_records_from_firebase(
+                    item, firebase_auth_key, record_status, database_url, fetch_workers
+                )
+            else:
+                records = get_records_from_firebase(
+                    item, firebase_auth_key, None, record_status, database_url
+                )
+            n_records, n_deleted = firebase_mirror.sync(records, item, record_status)
+            logger.info(
+                "Mirrored {} records for {}, {} deleted records removed",
+                n_records,
+                item,
+                n_deleted,
+            )
@@ -1,3 +1,4 @@
+import asyncio
 import json
 from enum import Enum
 
@@ -5,13 +6,21 @@ import requests
 import yaml
 from loguru import logger
 
-from cioos_metadata_conversion import cioos, citation_cff, datacite, erddap, xml, firebase_to_cioos
+from cioos_metadata_conversion import (
+    citation_cff,
+    datacite,
+    erddap,
+    firebase_to_cioos,
+    validation,
+    xml,
+)
+from cioos_metadata_conversion.utils import NoAliasDumper, iso_dates
 
 SOURCE_FILE_EXTENSIONS = (".json", ".yaml", ".yml")
 
 OUTPUT_FORMATS = {
     "json": lambda x: json.dumps(x, indent=2),
-    "yaml": lambda x: yaml.dump(x, default_flow_style=False),
+    "yaml": lambda x: yaml.dump(x, Dumper=NoAliasDumper, default_flow_style=False),
     "erddap": erddap.global_attributes,
     "cff": citation_cff.citation_cff,
     "xml": xml.xml,
@@ -21,6 +30,25 @@ OUTPUT_FORMATS = {
     "datacite_xml": datacite.to_xml,
 }
 
+# CIOOS record fields read by each output format, "" for the whole record
+FORMAT_DEPENDENCIES = {
+    "json": ("",),
+    "yaml": ("",),
+    "erddap": erddap.DEPENDENCIES,
+    "cff": citation_cff.DEPENDENCIES,
+    "xml": ("",),
+    "iso19115_xml": ("",),
+    "iso19115-3_xml": ("",),
+    "datacite_json": datacite.DEPENDENCIES,
+    "datacite_xml": datacite.DEPENDENCIES,
+}
+
+# Output formats generated in one language at a time
+LANGUAGE_OUTPUT_FORMATS = {
+    "erddap": erddap.global_attributes_by_language,
+    "cff": citation_cff.citation_cff_by_language,
+}
+
 
 class InputSchemas(Enum):
     """
@@ -78,6 +106,14 @@ class Record:
 
         return self
 
+    async def aload(self, encoding="utf-8"):
+        """
+        Load the source data without blocking the event loop, the file or URL
+        is read and parsed in a thread.
+        """
+        await asyncio.to_thread(self.load, encoding)
+        return self
+
     def load_from_file(self, file_path, encoding="utf-8"):
         """
         Load the source data from a file.
@@ -87,7 +123,7 @@ class Record:
                 self.metadata = json.load(f)
         elif file_path.endswith(".yaml") or file_path.endswith(".yml"):
             with open(file_path, "r", encoding=encoding) as f:
-                self.metadata = yaml.safe_load(f)
+                self.metadata = iso_dates(yaml.safe_load(f))
         else:
             raise ValueError("Unsupported file format. Must be .json or .yaml/.yml.")
 
@@ -106,7 +142,7 @@ class Record:
         if text.startswith("{") or text.startswith("["):
             self.metadata = json.loads(text)
         else:
-            self.metadata = yaml.safe_load(text)
+            self.metadata = iso_dates(yaml.safe_load(text))
 
     def convert_to_cioos_schema(self):
         """
@@ -124,9 +160,25 @@ class Record:
             )
         return self
 
-    def convert_to(self, output_format):
+    def validate(self, output_format=None, languages=None):
+        """
+        Check that the CIOOS metadata can be converted to an output format,
+        in each of the languages given.
+
+        Raises:
+            InvalidRecordError: With the path of every invalid field.
+        """
+        validation.check_record(
+            self.metadata, output_format, source=self.source, languages=languages
+        )
+        return self
+
+    def convert_to(self, output_format, languages=None):
         """
         Convert the source data to the desired format.
+
+        Languages can be given for the formats generated in one language at a
+        time, the output in each language is then returned by language.
         """
         if output_format not in OUTPUT_FORMATS:
             raise ValueError(
@@ -137,5 +189,121 @@ class Record:
                 f"{output_format} format is deprecated, use 'iso19115-3_xml' instead."
             )
 
+        if languages:
+            if output_format not in LANGUAGE_OUTPUT_FORMATS:
+                raise ValueError(
+                    f"Languages are only supported by the formats {list(LANGUAGE_OUTPUT_FORMATS)}."
+                )
+            return LANGUAGE_OUTPUT_FORMATS[output_format](self.metadata, languages)
+
         converter_func = OUTPUT_FORMATS[output_format]
         return converter_func(self.metadata)
+
+    async def aconvert_to(self, output_format, languages=None, executor=None):
+        """
+        Convert the source data to the desired format without blocking the
+        event loop.
+
+        The conversion runs in the executor, the event loop default thread
+        pool by default. A process pool runs the converters in parallel.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor, _convert_metadata, self.metadata, output_format, languages
+        )
+
+
+def _convert_metadata(metadata, output_format, languages=None):
+    # Module level function, to be sent to a process pool
+    return Record(source=metadata, metadata=metadata).convert_to(
+        output_format, languages=languages
+    )
+
+
+async def _iter_sources(sources):
+    if hasattr(sources, "__aiter__"):
+        async for source in sources:
+            yield source
+    else:
+        for source in sources:
+            yield source
+
+
+async def _next_completed(tasks: dict, return_exceptions: bool) -> list:
+    """
+    Wait for the next tasks to complete and get their source and output.
+
+    A cancelled task fails with a CancelledError, as with asyncio.gather.
+    """
+    done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    results = []
+    for task in done:
+        source = tasks.pop(task)
+        error = asyncio.CancelledError() if task.cancelled() else task.exception()
+        if error is not None and not return_exceptions:
+            raise error
+        results.append((source, error or task.result()))
+    return results
+
+
+async def convert_many_async(
+    sources,
+    output_format: str,
+    schema: InputSchemas | str = InputSchemas.CIOOS,
+    languages=None,
+    concurrency: int = 8,
+    executor=None,
+    return_exceptions: bool = False,
+    encoding: str = "utf-8",
+):
+    """
+    Load and convert records concurrently.
+
+    At most concurrency records are loaded or converted at once, the sources
+    are only consumed as the previous records complete. Closing the iterator
+    or cancelling the task iterating over it cancels the pending records.
+
+    Args:
+        sources (iterable, async iterable): Record files, URLs, metadata
+            dicts or Record instances.
+        output_format (str): Output format.
+        schema (InputSchemas, str, optional): Input schema of the sources.
+        languages (list, optional): Languages of the formats generated in one
+            language at a time, see Record.convert_to.
+        concurrency (int, optional): Number of records processed at once.
+        executor (Executor, optional): Executor running the converters, the
+            event loop default thread pool by default.
+        return_exceptions (bool, optional): Yield the exception of a failed
+            record as its output instead of raising it.
+        encoding (str, optional): Encoding of the record files.
+
+    Yields:
+        tuple: Each source and its output, in the order they complete.
+    """
+    if concurrency < 1:
+        raise ValueError("The concurrency must be at least 1.")
+
+    async def _convert(source):
+        record = source
+        if not isinstance(record, Record):
+            record = Record(source=source, schema=schema)
+        await record.aload(encoding)
+        await asyncio.to_thread(record.convert_to_cioos_schema)
+        if not record.metadata:
+            raise ValueError(f"No metadata record found in {record.source}.")
+        return await record.aconvert_to(output_format, languages, executor)
+
+    tasks = {}
+    try:
+        async for source in _iter_sources(sources):
+            tasks[asyncio.ensure_future(_convert(source))] = source
+            while len(tasks) >= concurrency:
+                for result in await _next_completed(tasks, return_exceptions):
+                    yield result
+        while tasks:
+            for result in await _next_completed(tasks, return_exceptions):
+                yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,238 @@
+"""
+Deterministic partition of the inputs of a batch between several nodes.
+
+A shard is written "i/N", i going from 1 to N. Each node lists all the inputs
+but only processes those whose key hashes to its shard, the key being the
+input path or the record metadata.identifier. The hash doesn't depend on the
+node or process, every node then agrees on the partition without any
+coordination. Each node writes the manifest of its shard and the manifests
+of all the shards are merged afterward to check that every input was
+covered exactly once.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+
+import click
+from loguru import logger
+
+MANIFEST_VERSION = 1
+
+
+def parse_shard(value: str) -> tuple:
+    """
+    Parse a shard written "i/N".
+
+    Returns:
+        tuple: The shard index, from 1 to N, and the number of shards N.
+    """
+    index, sep, count = str(value).partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        index = count = 0
+    if not sep or count < 1 or not 1 <= index <= count:
+        raise ValueError(f"Invalid shard {value!r}, expected i/N with 1 <= i <= N.")
+    return index, count
+
+
+def _shard_option(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return parse_shard(value)
+    except ValueError as error:
+        raise click.BadParameter(str(error))
+
+
+shard_option = click.option(
+    "--shard",
+    callback=_shard_option,
+    metavar="I/N",
+    help="Only process the I-th of N shards of the inputs, "
+    "partitioned by a stable hash of their path or identifier.",
+)
+manifest_option = click.option(
+    "--manifest",
+    type=click.Path(dir_okay=False),
+    help="Manifest of the shard inputs and outputs, "
+    "manifest.<I>-of-<N>.json in the output directory by default.",
+)
+
+
+def shard_of(key: str, count: int) -> int:
+    """Get the shard, from 1 to count, of an input key."""
+    digest = hashlib.sha256(str(key).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count + 1
+
+
+def in_shard(key: str, shard: tuple) -> bool:
+    """Check if an input key belongs to a shard."""
+    return shard is None or shard_of(key, shard[1]) == shard[0]
+
+
+def record_key(record: dict) -> str:
+    """Get the shard key of a CIOOS record, its metadata.identifier."""
+    identifier = (record.get("metadata") or {}).get("identifier")
+    if identifier:
+        return str(identifier)
+    # Records without identifier are keyed by their content
+    data = json.dumps(record, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def inputs_digest(keys) -> str:
+    """Hash the keys of all the inputs of a batch, whatever their order."""
+    return hashlib.sha256("\n".join(sorted(keys)).encode("utf-8")).hexdigest()
+
+
+def manifest_path(directory, shard: tuple) -> Path:
+    """Get the default manifest file of a shard."""
+    return Path(directory or ".") / f"manifest.{shard[0]}-of-{shard[1]}.json"
+
+
+def write_manifest(
+    path, command: str, shard: tuple, keys: list, inputs: list, outputs, failed=()
+) -> dict:
+    """
+    Write the manifest of a shard.
+
+    Args:
+        path (str): Manifest file.
+        command (str): Command run on the shard.
+        shard (tuple): Shard index and number of shards.
+        keys (list): Keys of all the inputs of the batch.
+        inputs (list): Keys of the inputs of the shard.
+        outputs (list): Outputs written by the shard.
+        failed (list, optional): Keys of the inputs which failed.
+
+    Returns:
+        dict: The manifest.
+    """
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "command": command,
+        "shard": shard[0],
+        "shards": shard[1],
+        "total": len(keys),
+        "inputs_digest": inputs_digest(keys),
+        "inputs": list(inputs),
+        "outputs": list(outputs),
+        "failed": list(failed),
+    }
+    Path(path).write_text(json.dumps(manifest, indent=2))
+    logger.info(
+        "Shard {}/{}: {} of {} inputs, manifest {}",
+        shard[0],
+        shard[1],
+        len(manifest["inputs"]),
+        len(keys),
+        path,
+    )
+    return manifest
+
+
+def merge_manifests(manifests: list) -> dict:
+    """
+    Merge the manifests of the shards of a batch.
+
+    Args:
+        manifests (list): Manifests of every shard.
+
+    Raises:
+        ValueError: The manifests don't cover every input exactly once, ex:
+            a shard is missing or the shards listed different inputs.
+
+    Returns:
+        dict: The merged manifest, without shard.
+    """
+    if not manifests:
+        raise ValueError("No manifest to merge.")
+
+    errors = []
+    first = manifests[0]
+    for field in ("command", "shards", "total", "inputs_digest"):
+        values = {manifest.get(field) for manifest in manifests}
+        if len(values) > 1:
+            errors.append(
+                f"The shards have different {field}: {sorted(map(str, values))}"
+            )
+
+    count = first["shards"]
+    shards = sorted(manifest["shard"] for manifest in manifests)
+    if missing := sorted(set(range(1, count + 1)) - set(shards)):
+        errors.append(f"Missing shards {missing} of {count}")
+    if duplicates := sorted({shard for shard in shards if shards.count(shard) > 1}):
+        errors.append(f"Shards {duplicates} found more than once")
+
+    owners = {}
+    for name in ("inputs", "outputs"):
+        owners[name] = {}
+        for manifest in manifests:
+            for item in set(manifest[name]):
+                owners[name].setdefault(item, []).append(manifest["shard"])
+        if duplicates := sorted(
+            item for item, owner in owners[name].items() if len(owner) > 1
+        ):
+            errors.append(
+                f"{len(duplicates)} {name} in several shards: {duplicates[:5]}"
+            )
+
+    for manifest in manifests:
+        if misplaced := [
+            key
+            for key in manifest["inputs"]
+            if shard_of(key, count) != manifest["shard"]
+        ]:
+            errors.append(
+                f"{len(misplaced)} inputs don't belong to shard {manifest['shard']}: "
+                f"{misplaced[:5]}"
+            )
+
+    inputs = [key for manifest in manifests for key in manifest["inputs"]]
+    if not errors and len(inputs) != first["total"]:
+        errors.append(f"{len(inputs)} inputs covered out of {first['total']}")
+
+    if errors:
+        raise ValueError("Invalid shard manifests:\n" + "\n".join(errors))
+
+    return {
+        "version": MANIFEST_VERSION,
+        "command": first["command"],
+        "shards": count,
+        "total": first["total"],
+        "inputs_digest": first["inputs_digest"],
+        "inputs": sorted(inputs),
+        "outputs": sorted(
+            output for manifest in manifests for output in manifest["outputs"]
+        ),
+        "failed": sorted(key for manifest in manifests for key in manifest["failed"]),
+    }
+
+
+@click.command()
+@click.argument("manifests", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option(
+    "--output", "-o", type=click.Path(dir_okay=False), help="Merged manifest file."
+)
+def merge(manifests, output):
+    """Merge the manifests of the shards of a batch and check that every
+    input was covered exactly once."""
+    try:
+        merged = merge_manifests(
+            [json.loads(Path(manifest).read_text()) for manifest in manifests]
+        )
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    logger.info(
+        "{} shards cover the {} inputs, {} outputs, {} failed",
+        merged["shards"],
+        merged["total"],
+        len(merged["outputs"]),
+        len(merged["failed"]),
+    )
+    if output:
+        Path(output).write_text(json.dumps(merged, indent=2))
+    if merged["failed"]:
+        raise click.ClickException(f"{len(merged['failed'])} inputs failed.")
@@ -1,2 +1,26 @@
+import datetime
+
+import yaml
+
+
 def drop_empty_values(dictionary):
     return {k: v for k, v in dictionary.items() if v}
+
+
+def iso_dates(value):
+    """Convert the unquoted dates of YAML records, loaded as date or datetime
+    objects, to the ISO format strings of the CIOOS schema."""
+    if isinstance(value, dict):
+        return {key: iso_dates(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [iso_dates(item) for item in value]
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+
+class NoAliasDumper(yaml.Dumper):
+    """YAML dumper writing shared objects in full instead of as aliases."""
+
+    def ignore_aliases(self, data):
+        return True
@@ -0,0 +1,276 @@
+"""
+Validation of CIOOS records and of the records converted from them.
+
+CIOOS records are checked right after they are loaded against the fields
+their output format requires, converted records against the schema of their
+output format. Each schema is loaded and compiled once per process and reused for every
+document validated afterward. The XSD locations can be overridden with the
+DATACITE_XSD and ISO19115_3_XSD environment variables, with a local copy of
+the schemas for example. The ISO 19115-3 schema has no default location.
+"""
+
+import importlib.resources
+import json
+import os
+from functools import cache
+from pathlib import Path
+
+import jsonschema
+import yaml
+from datacite import schema45
+from loguru import logger
+from lxml import etree
+
+from cioos_metadata_conversion.utils import iso_dates
+
+DATACITE_XSD = "http://schema.datacite.org/meta/kernel-4.5/metadata.xsd"
+CFF_SCHEMA = (
+    importlib.resources.files("cffconvert") / "schemas" / "1.2.0" / "schema.json"
+)
+CIOOS_SCHEMA = Path(__file__).parent / "resources" / "cioos_schema.json"
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Environment variable and default location of the XSD of each XML format
+XSD_LOCATIONS = {
+    "datacite_xml": ("DATACITE_XSD", DATACITE_XSD),
+    "xml": ("ISO19115_3_XSD", None),
+    "iso19115_xml": ("ISO19115_3_XSD", None),
+    "iso19115-3_xml": ("ISO19115_3_XSD", None),
+}
+
+_DATACITE_RECORD = {
+    "required": ["spatial"],
+    "properties": {
+        "metadata": {
+            "required": ["language"],
+            "properties": {
+                "use_constraints": {
+                    "required": ["licence"],
+                    "properties": {
+                        "licence": {
+                            "required": ["title", "url", "code"],
+                            "properties": {"title": {"required": ["en"]}},
+                        }
+                    },
+                }
+            },
+        }
+    },
+}
+
+
+def _erddap_requirements(languages=("en",)) -> dict:
+    # The translations of the text fields are required in every language
+    languages = list(languages)
+    return {
+        "properties": {
+            "identification": {
+                "required": ["progress_code"],
+                "properties": {
+                    "title": {"required": languages},
+                    "abstract": {"required": languages},
+                },
+            },
+            # Only a history by language, not a list of events, is translated
+            "metadata": {"properties": {"history": {"required": languages}}},
+        }
+    }
+
+
+# CIOOS record fields required by each output format on top of CIOOS_SCHEMA
+RECORD_REQUIREMENTS = {
+    "erddap": _erddap_requirements(),
+    "cff": {
+        "required": ["distribution"],
+        "properties": {
+            "metadata": {
+                "required": ["maintenance_note"],
+                "properties": {"dates": {"required": ["revision"]}},
+            }
+        },
+    },
+    "datacite_json": _DATACITE_RECORD,
+    "datacite_xml": _DATACITE_RECORD,
+}
+# Formats dumping the record as is, which don't require any field
+RECORD_DUMP_FORMATS = ("json", "yaml")
+# Requirements of the formats generated in several languages at once
+LANGUAGE_REQUIREMENTS = {"erddap": _erddap_requirements}
+
+
+class InvalidRecordError(ValueError):
+    """A CIOOS record is missing fields or has fields of the wrong type."""
+
+    def __init__(self, errors: list, source=None) -> None:
+        self.errors = errors
+        self.source = source
+        prefix = f"Invalid CIOOS record {source}" if source else "Invalid CIOOS record"
+        super().__init__(f"{prefix}: {format_errors(errors)}")
+
+
+def format_errors(errors: list) -> str:
+    """Format validation errors as "path: message" separated by semicolons."""
+    return "; ".join(f"{error['path']}: {error['message']}" for error in errors)
+
+
+@cache
+def get_record_validator(
+    output_format: str | None = None, languages: tuple | None = None
+):
+    """
+    Compile the CIOOS record validator of an output format once.
+
+    Args:
+        output_format (str, optional): Output format the record is converted
+            to, only the fields common to all formats are checked without it.
+        languages (tuple, optional): Languages the output format is generated in.
+
+    Returns:
+        jsonschema.IValidator: The compiled validator.
+    """
+    schema = json.loads(CIOOS_SCHEMA.read_text(encoding="utf-8"))
+    if languages and output_format in LANGUAGE_REQUIREMENTS:
+        schema["allOf"] = [LANGUAGE_REQUIREMENTS[output_format](languages)]
+    elif output_format in RECORD_REQUIREMENTS:
+        schema["allOf"] = [RECORD_REQUIREMENTS[output_format]]
+    validator = jsonschema.validators.validator_for(schema)
+    validator.check_schema(schema)
+    return validator(schema)
+
+
+def validate_record(
+    record: dict, output_format: str | None = None, languages=None
+) -> list:
+    """
+    Validate a CIOOS record before converting it.
+
+    Records dumped as json or yaml aren't validated, any record can be.
+
+    Args:
+        record (dict): The CIOOS record.
+        output_format (str, optional): Output format the record is converted to.
+        languages (list, optional): Languages the output format is generated in.
+
+    Returns:
+        list: The validation errors with their "path" and "message".
+    """
+    if output_format in RECORD_DUMP_FORMATS:
+        return []
+    validator = get_record_validator(
+        output_format, tuple(languages) if languages else None
+    )
+    record = iso_dates(record)
+    if validator.is_valid(record):
+        return []
+    return _json_errors(validator, record)
+
+
+def check_record(
+    record: dict, output_format: str | None = None, source=None, languages=None
+) -> dict:
+    """
+    Check that a CIOOS record can be converted to an output format.
+
+    Args:
+        record (dict): The CIOOS record.
+        output_format (str, optional): Output format the record is converted to.
+        source (str, optional): Source of the record reported in the error.
+        languages (list, optional): Languages the output format is generated in.
+
+    Returns:
+        dict: The record.
+
+    Raises:
+        InvalidRecordError: If the record is invalid.
+    """
+    errors = validate_record(record, output_format, languages)
+    if errors:
+        raise InvalidRecordError(errors, source)
+    return record
+
+
+@cache
+def get_xml_schema(location: str) -> etree.XMLSchema:
+    """
+    Load and compile an XSD once.
+
+    Args:
+        location (str): XSD file path or URL.
+
+    Returns:
+        etree.XMLSchema: The compiled schema, None if it couldn't be loaded.
+    """
+    logger.info("Loading XML schema {}", location)
+    try:
+        # Schemas and their includes may be fetched over the network
+        parser = etree.XMLParser(no_network=False)
+        return etree.XMLSchema(etree.parse(location, parser))
+    except (OSError, etree.XMLSchemaParseError, etree.XMLSyntaxError) as error:
+        logger.warning("Failed to load XML schema {}: {}", location, error)
+        return None
+
+
+@cache
+def get_cff_validator():
+    """Get the Citation File Format 1.2.0 schema validator of cffconvert."""
+    schema = json.loads(CFF_SCHEMA.read_text(encoding="utf-8"))
+    validator = jsonschema.validators.validator_for(schema)
+    return validator(schema, format_checker=jsonschema.FormatChecker())
+
+
+def _xml_errors(schema, document: str) -> list:
+    try:
+        tree = etree.fromstring(document.encode("utf-8"))
+    except etree.XMLSyntaxError as error:
+        return [{"path": None, "line": error.lineno, "message": str(error)}]
+    if schema.validate(tree):
+        return []
+    return [
+        {"path": error.path, "line": error.line, "message": error.message}
+        for error in schema.error_log
+    ]
+
+
+def _json_errors(validator, instance) -> list:
+    return [
+        {
+            "path": "/" + "/".join(str(item) for item in error.absolute_path),
+            "message": error.message,
+        }
+        for error in sorted(validator.iter_errors(instance), key=lambda e: e.path)
+    ]
+
+
+def get_xsd_location(output_format: str) -> str:
+    """Get the XSD location of an XML output format."""
+    variable, default = XSD_LOCATIONS[output_format]
+    return os.environ.get(variable, default)
+
+
+def validate(output_format: str, document: str) -> list:
+    """
+    Validate a converted record against the schema of its output format.
+
+    Args:
+        output_format (str): The output format of the document.
+        document (str): The converted record.
+
+    Returns:
+        list: The validation errors with their "path", "line" for XML
+            documents and "message", None if the format can't be validated.
+    """
+    if output_format == "cff":
+        # Dates are kept as strings as in the CFF file
+        instance = json.loads(
+            json.dumps(yaml.load(document, Loader=YAML_LOADER), default=str)
+        )
+        return _json_errors(get_cff_validator(), instance)
+    if output_format == "datacite_json":
+        return _json_errors(schema45.validator, json.loads(document))
+    if output_format in XSD_LOCATIONS:
+        location = get_xsd_location(output_format)
+        schema = get_xml_schema(location) if location else None
+        if schema is None:
+            return None
+        return _xml_errors(schema, document)
+    return None
@@ -1,5 +1,87 @@
+"""
+ISO 19115-3 XML rendering with the metadata_xml templates.
+
+metadata_to_xml creates its Jinja environment on every call, its templates are
+then loaded and compiled again for each record. Once warmed up, the
+environment is created once per process and reused with the templates
+compiled in it by every following call.
+"""
+
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from loguru import logger
+from metadata_xml import template_functions
 from metadata_xml.template_functions import metadata_to_xml
 
 
+class _EnvironmentFactory:
+    """Create the template environment on the first call and return it afterward."""
+
+    def __init__(self, environment_class) -> None:
+        self.environment_class = environment_class
+        self.environment = None
+        self.lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        with self.lock:
+            if self.environment is None:
+                self.environment = self.environment_class(*args, **kwargs)
+                # The packaged templates don't change, skip their mtime checks
+                self.environment.auto_reload = False
+            return self.environment
+
+
+def warm_up():
+    """Keep the metadata_xml template environment alive across calls."""
+    environment_class = getattr(template_functions, "Environment", None)
+    if environment_class is None:
+        logger.debug("No metadata_xml template environment to keep warm")
+    elif not isinstance(environment_class, _EnvironmentFactory):
+        template_functions.Environment = _EnvironmentFactory(environment_class)
+
+
 def xml(record):
+    warm_up()
     return metadata_to_xml(record)
+
+
+def iter_xml(records, workers: int = 1):
+    """
+    Render records to ISO 19115-3 XML with a warm template environment.
+
+    Args:
+        records (iterable): CIOOS records.
+        workers (int, optional): Number of processes rendering the records,
+            each keeping its own environment.
+
+    Yields:
+        str: The XML document of each record, in order.
+    """
+    if workers <= 1:
+        for record in records:
+            yield xml(record)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm_up) as executor:
+        yield from executor.map(metadata_to_xml, records, chunksize=16)
+
+
+def write_xml(records, file, workers: int = 1) -> int:
+    """
+    Write the XML documents of records to a file handle as they are rendered.
+
+    Args:
+        records (iterable): CIOOS records.
+        file (file object): Text file handle, each document ends with a new line.
+        workers (int, optional): Number of processes rendering the records.
+
+    Returns:
+        int: The number of documents written.
+    """
+    count = 0
+    for document in iter_xml(records, workers):
+        file.write(document)
+        if not document.endswith("\n"):
+            file.write("\n")
+        count += 1
+    return count
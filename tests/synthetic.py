@@ -0,0 +1,149 @@
+"""
+Synthetic ERDDAP datasets.xml files and metadata records of any size, and the
+measurement of their processing.
+
+The datasets are copies of the test dataset and the records copies of the
+test record, each pointing to one of the datasets with its own title.
+"""
+
+import hashlib
+import resource
+import time
+from pathlib import Path
+
+import yaml
+from lxml import etree
+
+from cioos_metadata_conversion import erddap, xml
+
+TEST_DATASETS_XML = Path(__file__).parent / "erddap_xmls" / "test_datasets.xml"
+TEST_RECORD = Path(__file__).parent / "records" / "test_record1.yaml"
+ERDDAP_URL = "https://catalogue.hakai.org/erddap"
+# Keep the synthetic datasets to a few kilobytes each
+VARIABLES_PER_DATASET = 5
+
+
+def dataset_id(index: int) -> str:
+    return f"SyntheticDataset{index:06d}"
+
+
+def write_datasets_xml(path, n_datasets: int) -> int:
+    """Write a datasets.xml with n copies of the test dataset, trimmed to its
+    first variables.
+
+    Returns:
+        int: The size of the file in bytes.
+    """
+    template = etree.parse(str(TEST_DATASETS_XML)).getroot().find("dataset")
+    for variable in template.findall("dataVariable")[VARIABLES_PER_DATASET:]:
+        template.remove(variable)
+    template = etree.tostring(template, encoding="unicode")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0"?>\n<erddapDatasets>\n')
+        f.writelines(
+            template.replace(
+                'datasetID="TestDataset1"', f'datasetID="{dataset_id(index)}"'
+            )
+            for index in range(n_datasets)
+        )
+        f.write("</erddapDatasets>\n")
+    return Path(path).stat().st_size
+
+
+def generate_records(n_records: int):
+    """Generate copies of the test record, each describing a synthetic dataset.
+
+    Yields:
+        dict: Records in CIOOS schema.
+    """
+    record = yaml.safe_load(TEST_RECORD.read_text())
+    for index in range(n_records):
+        title = record["identification"]["title"]
+        yield {
+            **record,
+            "identification": {
+                **record["identification"],
+                "title": {**title, "en": f"{title['en']} {index}"},
+            },
+            "distribution": [
+                {"url": f"{ERDDAP_URL}/tabledap/{dataset_id(index)}.html"}
+            ],
+        }
+
+
+def _reset_peak_rss():
+    # Reset the high water mark of the resident memory on Linux
+    try:
+        Path("/proc/self/clear_refs").write_text("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb() -> float:
+    try:
+        status = Path("/proc/self/status").read_text()
+    except OSError:
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    peak = next(line for line in status.splitlines() if line.startswith("VmHWM:"))
+    return int(peak.split()[1]) / 1024
+
+
+def run_update(directory, n_datasets: int, mode: str = "tree") -> dict:
+    """Update a synthetic datasets.xml end to end and measure it.
+
+    Run it in a fresh process for the peak memory to be the one of this update
+    where the memory high water mark can't be reset.
+
+    Returns:
+        dict: The number of datasets, wall time, peak resident memory and
+            input and output sizes of the update.
+    """
+    datasets_xml = Path(directory) / f"datasets_{mode}_{n_datasets}.xml"
+    input_bytes = write_datasets_xml(datasets_xml, n_datasets)
+    records = list(generate_records(n_datasets))
+
+    _reset_peak_rss()
+    start = time.perf_counter()
+    report = erddap.update_dataset_xml(
+        str(datasets_xml), records, ERDDAP_URL, mode=mode
+    )
+    wall_time = time.perf_counter() - start
+
+    return {
+        "mode": mode,
+        "datasets": n_datasets,
+        "changed": len(report["changed"]),
+        "wall_time_s": round(wall_time, 3),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "input_bytes": input_bytes,
+        "output_bytes": datasets_xml.stat().st_size,
+    }
+
+
+def run_xml_render(n_records: int, warm: bool = True) -> dict:
+    """Render synthetic records to ISO 19115-3 XML and measure it.
+
+    Run it in a fresh process for the cold rendering not to reuse a warmed up
+    template environment.
+
+    Returns:
+        dict: The number of records, wall time, time per record and digest
+            of the rendered documents.
+    """
+    records = list(generate_records(n_records))
+    render = xml.xml if warm else xml.metadata_to_xml
+
+    digest = hashlib.sha256()
+    start = time.perf_counter()
+    for record in records:
+        digest.update(render(record).encode("utf-8"))
+    wall_time = time.perf_counter() - start
+
+    return {
+        "warm": warm,
+        "records": n_records,
+        "wall_time_s": round(wall_time, 3),
+        "ms_per_record": round(wall_time * 1000 / n_records, 3),
+        "digest": digest.hexdigest(),
+    }
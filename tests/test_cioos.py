@@ -0,0 +1,65 @@
+import pytest
+
+from cioos_metadata_conversion import cioos
+
+DATABASE_URL = "https://example.firebaseio.com/"
+USERS = {
+    "user1": {
+        "rec1": {"recordID": "rec1", "status": "published"},
+        "rec2": {"recordID": "rec2", "status": "draft"},
+    },
+    "user2": {"rec3": {"recordID": "rec3", "status": "published"}},
+    "user3": None,
+}
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class FakeSession:
+    def __init__(self):
+        self.calls = []
+
+    def get(self, url, params=None):
+        self.calls.append((url, params))
+        path = url.replace(DATABASE_URL, "")
+        if path == "pacific/users.json":
+            return FakeResponse({user: True for user in USERS})
+        user = path.split("/")[2]
+        return FakeResponse(USERS[user])
+
+
+@pytest.fixture
+def session(monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(cioos, "get_authorized_session", lambda *args: session)
+    return session
+
+
+def test_iter_records_from_firebase(session):
+    records = list(
+        cioos.iter_records_from_firebase(
+            "pacific", "key.json", ["published"], DATABASE_URL, max_workers=2
+        )
+    )
+    assert sorted(record["recordID"] for record in records) == ["rec1", "rec3"]
+    assert session.calls[0] == (
+        f"{DATABASE_URL}pacific/users.json",
+        {"shallow": "true"},
+    )
+    assert len(session.calls) == len(USERS) + 1
+
+
+def test_get_records_from_firebase_concurrent(session):
+    records = cioos.get_records_from_firebase(
+        "pacific", "key.json", None, ["published", "draft"], DATABASE_URL, 4
+    )
+    assert len(records) == 3
@@ -7,6 +7,20 @@ from cioos_metadata_conversion import citation_cff
 from cioos_metadata_conversion.__main__ import load
 
 
+@pytest.mark.parametrize("output_format", [None, "yaml"])
+def test_citation_cff_by_language(record, output_format):
+    result = citation_cff.citation_cff_by_language(
+        record, ["en", "fr"], output_format=output_format
+    )
+    assert result == {
+        language: citation_cff.citation_cff(
+            record, output_format=output_format, language=language
+        )
+        for language in ("en", "fr")
+    }
+    assert result["en"] != result["fr"]
+
+
 def test_citation_cff(record):
     result = citation_cff.citation_cff(record, output_format=None, language="en")
     assert result
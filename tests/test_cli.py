@@ -1,4 +1,6 @@
+import json
 from glob import glob
+from pathlib import Path
 
 import pytest
 from click.testing import CliRunner
@@ -84,3 +86,128 @@ def test_cli_with_http_input(runner, tmpdir):
     assert len(tmpdir.listdir()) == 1
     assert tmpdir.join(ouput_file).check(file=True)
     assert "cff-version: 1.2.0" in tmpdir.join(ouput_file).read_text(encoding="UTF-8")
+
+
+def test_cli_convert_languages(runner, tmp_path):
+    args = [
+        "convert",
+        "--input",
+        "tests/records/*.yaml",
+        "--output-format",
+        "erddap",
+        "--output-dir",
+        str(tmp_path),
+        "--language",
+        "en,fr",
+    ]
+    result = runner.invoke(cli, args)
+    assert result.exit_code == 0, result.output
+    assert sorted(file.name for file in tmp_path.iterdir()) == [
+        "test_record1.en.erddap",
+        "test_record1.fr.erddap",
+    ]
+    assert "Données" in (tmp_path / "test_record1.fr.erddap").read_text()
+
+
+def test_cli_convert_languages_multilingual_format(runner, tmp_path):
+    args = [
+        "convert",
+        "--input",
+        "tests/records/*.yaml",
+        "--output-format",
+        "datacite_json",
+        "--output-dir",
+        str(tmp_path),
+        "--language",
+        "fr",
+    ]
+    result = runner.invoke(cli, args)
+    assert result.exit_code == 1
+    assert not list(tmp_path.iterdir())
+
+
+def test_cli_convert_incremental(runner, tmp_path):
+    input_dir = tmp_path / "records"
+    input_dir.mkdir()
+    record_file = input_dir / "test_record1.yaml"
+    record_file.write_text(Path("tests/records/test_record1.yaml").read_text())
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+    output = output_dir / "test_record1.cff"
+    args = [
+        "convert",
+        "--input",
+        str(record_file),
+        "--output-format",
+        "cff",
+        "--output-dir",
+        str(output_dir),
+        "--incremental",
+    ]
+
+    result = runner.invoke(cli, args)
+    assert result.exit_code == 0, result.output
+    assert (output_dir / ".conversion_state.json").exists()
+    output.write_text("unchanged")
+
+    # Unchanged record and a change of a field not used by the CFF output
+    result = runner.invoke(cli, args)
+    assert result.exit_code == 0, result.output
+    record_file.write_text(record_file.read_text().replace("onGoing", "completed"))
+    result = runner.invoke(cli, args)
+    assert result.exit_code == 0, result.output
+    assert output.read_text() == "unchanged"
+
+    # A change of a field used by the CFF output
+    record_file.write_text(record_file.read_text().replace("- oxygen", "- chlorophyll"))
+    result = runner.invoke(cli, args)
+    assert result.exit_code == 0, result.output
+    assert "chlorophyll" in output.read_text()
+
+    # The output is converted again when missing
+    output.unlink()
+    result = runner.invoke(cli, args)
+    assert result.exit_code == 0, result.output
+    assert "cff-version: 1.2.0" in output.read_text()
+
+
+def test_cli_convert_shards(runner, tmp_path):
+    input_dir = tmp_path / "records"
+    input_dir.mkdir()
+    record = Path("tests/records/test_record1.yaml").read_text()
+    for index in range(10):
+        (input_dir / f"record_{index}.yaml").write_text(record)
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+
+    for index in range(1, 4):
+        args = [
+            "convert",
+            "--input",
+            str(input_dir / "*.yaml"),
+            "--output-format",
+            "cff",
+            "--output-dir",
+            str(output_dir),
+            "--shard",
+            f"{index}/3",
+        ]
+        result = runner.invoke(cli, args)
+        assert result.exit_code == 0, result.output
+
+    assert len(list(output_dir.glob("*.cff"))) == 10
+    manifests = sorted(output_dir.glob("manifest.*-of-3.json"))
+    assert len(manifests) == 3
+    merged = tmp_path / "merged.json"
+    result = runner.invoke(
+        cli, ["merge-manifests", *map(str, manifests), "--output", str(merged)]
+    )
+    assert result.exit_code == 0, result.output
+    assert len(json.loads(merged.read_text())["outputs"]) == 10
+
+    result = runner.invoke(cli, ["merge-manifests", *map(str, manifests[:2])])
+    assert result.exit_code == 1
+    assert "Missing shards" in result.output
+
+    result = runner.invoke(cli, args[:-1] + ["4/3"])
+    assert result.exit_code == 2
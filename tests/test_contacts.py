@@ -0,0 +1,75 @@
+import copy
+
+from cioos_metadata_conversion import citation_cff, contacts, datacite, erddap
+from cioos_metadata_conversion.record import OUTPUT_FORMATS
+
+
+def test_intern_contacts(record):
+    records = [copy.deepcopy(record) for _ in range(3)]
+    with contacts.contact_registry() as registry:
+        for item in records:
+            contacts.intern_contacts(item)
+        # Nested scopes share the registry
+        with contacts.contact_registry() as nested:
+            assert nested is registry
+
+    organizations = [item["contact"][0]["organization"] for item in records]
+    assert organizations[0] is organizations[1] is organizations[2]
+    assert records[0] == record
+    assert records[0]["contact"][0] is not records[1]["contact"][0]
+
+    # Nothing is interned outside of a scope
+    other = copy.deepcopy(record)
+    contacts.intern_contacts(other)
+    assert other["contact"][0]["organization"] is not organizations[0]
+
+
+def test_contact_view():
+    calls = []
+
+    @contacts.contact_view
+    def view(contact, role):
+        calls.append(contact)
+        return {"role": role, "name": contact["organization"]["name"]}
+
+    contact = {"organization": {"name": "Hakai"}, "roles": ["owner"]}
+    same = {"organization": {"name": "Hakai"}, "roles": ["publisher"]}
+    other = {"organization": {"name": "CIOOS"}, "roles": ["owner"]}
+
+    view(contact, "creator")
+    view(contact, "creator")
+    assert len(calls) == 2
+
+    calls.clear()
+    with contacts.contact_registry():
+        assert view(contact, "creator") is view(same, "creator")
+        assert view(contact, "publisher")["role"] == "publisher"
+        assert view(other, "creator")["name"] == "CIOOS"
+    assert len(calls) == 3
+
+
+def test_converters_with_contact_registry(record):
+    outputs = (
+        lambda item: citation_cff.citation_cff(item),
+        lambda item: datacite.to_json(item),
+        lambda item: erddap.global_attributes(item),
+        # Shared objects aren't written as YAML aliases
+        OUTPUT_FORMATS["yaml"],
+    )
+    expected = [output(record) for output in outputs]
+    duplicated = {**record, "contact": record["contact"] * 2}
+    expected.append(OUTPUT_FORMATS["yaml"](duplicated))
+    with contacts.contact_registry():
+        for _ in range(2):
+            item = contacts.intern_contacts(copy.deepcopy(record))
+            assert [output(item) for output in outputs] == expected[:-1]
+        item = contacts.intern_contacts(copy.deepcopy(duplicated))
+        assert OUTPUT_FORMATS["yaml"](item) == expected[-1]
+
+
+def test_cff_unique_authors(record):
+    record = {**record, "contact": record["contact"] + record["contact"][:2]}
+    authors = citation_cff._get_unique_authors(record)
+    assert authors == [
+        citation_cff.get_cff_contact(contact) for contact in record["contact"][:4]
+    ]
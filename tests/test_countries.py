@@ -0,0 +1,44 @@
+import pytest
+from loguru import logger
+
+from cioos_metadata_conversion import countries
+
+
+@pytest.mark.parametrize(
+    "name,code",
+    [
+        ("Canada", "CA"),
+        ("canada", "CA"),
+        ("CA", "CA"),
+        ("can", "CA"),
+        ("États-Unis", "US"),
+        ("Etats Unis", "US"),
+        ("USA", "US"),
+        ("United States of America", "US"),
+        ("UK", "GB"),
+        ("Royaume-Uni", "GB"),
+        ("Allemagne", "DE"),
+        ("Russia", "RU"),
+        ("Viet Nam", "VN"),
+        ("  japan ", "JP"),
+        ("124", "CA"),
+        ("840", "US"),
+        ("036", "AU"),
+    ],
+)
+def test_get_country_code(name, code):
+    assert countries.get_country_code(name) == code
+
+
+def test_get_country_code_missing():
+    assert countries.get_country_code(None) is None
+    assert countries.get_country_code("") is None
+
+    messages = []
+    handler = logger.add(messages.append, level="WARNING")
+    try:
+        for _ in range(3):
+            assert countries.get_country_code("Atlantis") is None
+    finally:
+        logger.remove(handler)
+    assert len(messages) == 1
@@ -2,10 +2,12 @@ from pathlib import Path
 import json
 
 from datacite import schema45
+from lxml import etree
 import pytest
 
 from cioos_metadata_conversion import datacite
 from cioos_metadata_conversion.firebase_to_cioos import record_json_to_yaml
+from cioos_metadata_conversion.record import Record
 
 
 def test_dataset_cite(record):
@@ -119,3 +121,139 @@ def test_firebase_record_to_xml(firebase_record, tmp_path):
     assert xml_output
     assert isinstance(xml_output, str)  # Ensure it's a string
     assert test_file.exists()  # Ensure the path exists
+
+
+def _corpus_records():
+    records = [
+        record_json_to_yaml(json.loads(file.read_text()))
+        for file in sorted(
+            (Path(__file__).parent / "records" / "firebase").glob("*.json")
+        )
+    ]
+    for file in sorted((Path(__file__).parent / "records").glob("**/*.yaml")):
+        record = Record(str(file), "CIOOS")
+        record.load()
+        record.convert_to_cioos_schema()
+        records.append(record.metadata)
+    return records
+
+
+@pytest.mark.parametrize("corpus_record", _corpus_records())
+def test_xml_serializers_equivalence(corpus_record):
+    """
+    Test that the direct lxml serializer matches the schema45 one.
+    """
+    datacite_record = datacite.generate_datacite_record(corpus_record)
+    expected = schema45.tostring(datacite_record)
+    xml_output = etree.tostring(
+        datacite.dump_etree(datacite_record),
+        pretty_print=True,
+        xml_declaration=True,
+        encoding="utf-8",
+    ).decode("utf-8")
+
+    assert xml_output == expected
+    assert etree.tostring(
+        datacite.dump_etree(datacite_record), method="c14n2"
+    ) == etree.tostring(schema45.dump_etree(datacite_record), method="c14n2")
+
+
+def test_xml_serializers_equivalence_all_properties():
+    """
+    Test the serializers on every property and attribute the lxml one handles.
+    """
+    datacite_record = {
+        "alternateIdentifiers": [
+            {"alternateIdentifier": "id", "alternateIdentifierType": "Local"}
+        ],
+        "creators": [
+            {
+                "name": "Doe, Jane",
+                "nameType": "Personal",
+                "givenName": "Jane",
+                "familyName": "Doe",
+                "nameIdentifiers": [
+                    {
+                        "nameIdentifier": "0000-0000-0000-0000",
+                        "nameIdentifierScheme": "ORCID",
+                        "schemeUri": "https://orcid.org",
+                    }
+                ],
+                "affiliation": [
+                    {
+                        "name": "Org & Co",
+                        "affiliationIdentifier": "https://ror.org/0",
+                        "affiliationIdentifierScheme": "ROR",
+                        "schemeUri": "https://ror.org/",
+                    }
+                ],
+            }
+        ],
+        "titles": [{"title": "A <title>", "lang": "en", "titleType": "Other"}],
+        "publisher": {
+            "name": "Publisher",
+            "publisherIdentifier": "https://ror.org/1",
+            "publisherIdentifierScheme": "ROR",
+            "schemeUri": "https://ror.org/",
+        },
+        "publicationYear": "2024",
+        "subjects": [
+            {"subject": "ocean", "lang": "en", "valueUri": "https://example.com"}
+        ],
+        "contributors": [
+            {"name": "Org", "nameType": "Organizational", "contributorType": "Other"}
+        ],
+        "dates": [{"date": "2024-01-01", "dateType": "Other", "dateInformation": "x"}],
+        "language": "en",
+        "types": {"resourceTypeGeneral": "Dataset", "resourceType": "Record"},
+        "doi": "10.0000/test",
+        "relatedIdentifiers": [
+            {
+                "relatedIdentifier": "10.0000/other",
+                "relationType": "IsPartOf",
+                "relatedIdentifierType": "DOI",
+                "resourceTypeGeneral": "Dataset",
+            }
+        ],
+        "version": "1.0",
+        "rightsList": [{"rights": "CC-BY", "rightsUri": "https://cc.org"}, {}],
+        "descriptions": [
+            {"description": "Abstract", "descriptionType": "Abstract", "lang": "fr"}
+        ],
+        "geoLocations": [
+            {
+                "geoLocationPlace": "Pacific",
+                "geoLocationPoint": {"pointLatitude": 1.5, "pointLongitude": 2},
+                "geoLocationBox": {
+                    "westBoundLongitude": -1,
+                    "eastBoundLongitude": 1,
+                    "southBoundLatitude": -2,
+                    "northBoundLatitude": 2.0,
+                },
+                "geoLocationPolygon": [
+                    {"polygonPoint": {"pointLatitude": 1, "pointLongitude": 2}},
+                    {"inPolygonPoint": {"pointLatitude": 3, "pointLongitude": 4}},
+                ],
+            }
+        ],
+        "fundingReferences": [
+            {
+                "funderName": "Funder",
+                "funderIdentifier": "https://ror.org/2",
+                "funderIdentifierType": "ROR",
+                "awardNumber": "1",
+                "awardUri": "https://example.com/award",
+                "awardTitle": "Award",
+            }
+        ],
+    }
+    assert etree.tostring(datacite.dump_etree(datacite_record)) == etree.tostring(
+        schema45.dump_etree(datacite_record)
+    )
+
+
+def test_xml_serializer_option(record):
+    """
+    Test that to_xml gives the same output with both serializers.
+    """
+    assert datacite.to_xml(record) == datacite.to_xml(record, serializer="schema45")
@@ -0,0 +1,219 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from click.testing import CliRunner
+
+from cioos_metadata_conversion import datacite_sync
+
+DOI = "10.21966/kace-2d24"
+
+
+@pytest.fixture
+def datacite_api():
+    """Local mock of the DataCite REST API."""
+    state = {"dois": {}, "requests": [], "failures": [], "post_failures": []}
+
+    class DataCiteHandler(BaseHTTPRequestHandler):
+        def _respond(self, status, data=None, headers=None):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            body = json.dumps(data).encode() if data is not None else b""
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _handle(self):
+            state["requests"].append((self.command, self.path))
+            failures = state["failures"]
+            if self.command == "POST" and state["post_failures"]:
+                failures = state["post_failures"]
+            if failures:
+                status = failures.pop(0)
+                return self._respond(status, headers={"Retry-After": "0"})
+            if not self.headers.get("Authorization", "").startswith("Basic "):
+                return self._respond(401)
+
+            doi = self.path.split("?")[0].removeprefix("/dois").strip("/")
+            if self.command == "GET":
+                if doi not in state["dois"]:
+                    return self._respond(404)
+                return self._respond(200, {"data": state["dois"][doi]})
+
+            payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            attributes = payload["data"]["attributes"]
+            attributes.pop("event", None)
+            # DataCite adds its own attributes and returns integer years
+            attributes["state"] = "findable"
+            attributes["publicationYear"] = int(attributes["publicationYear"])
+            doi = doi or attributes["doi"]
+            state["dois"][doi] = {"id": doi, "type": "dois", "attributes": attributes}
+            self._respond(
+                201 if self.command == "POST" else 200, {"data": state["dois"][doi]}
+            )
+
+        do_GET = do_PUT = do_POST = _handle
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), DataCiteHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", state
+    server.shutdown()
+
+
+def _sync(records, api_url, **kwargs):
+    return datacite_sync.sync_records(
+        records,
+        "repository",
+        "password",
+        api_url=api_url,
+        rate_limit=0,
+        backoff_factor=0,
+        **kwargs,
+    )
+
+
+def test_datacite_sync(record, datacite_api):
+    api_url, state = datacite_api
+    record_without_doi = {
+        **record,
+        "identification": {**record["identification"], "identifier": ""},
+    }
+
+    report = _sync([record, record_without_doi], api_url, event="publish")
+    assert report["created"] == [DOI]
+    assert len(report["skipped"]) == 1
+    assert ("POST", "/dois") in state["requests"]
+
+    # The remote metadata match, nothing is uploaded
+    state["requests"].clear()
+    report = _sync([record], api_url)
+    assert report["unchanged"] == [DOI]
+    assert [method for method, _ in state["requests"]] == ["GET"]
+
+    changed = {
+        **record,
+        "identification": {
+            **record["identification"],
+            "title": {**record["identification"]["title"], "en": "New title"},
+        },
+    }
+    assert _sync([changed], api_url, dry_run=True)["updated"] == [DOI]
+    assert _sync([changed], api_url)["updated"] == [DOI]
+    assert state["dois"][DOI]["attributes"]["titles"][0]["title"] == "New title"
+
+
+def test_datacite_sync_invalid_record(record, datacite_api):
+    api_url, state = datacite_api
+    invalid = {key: value for key, value in record.items() if key != "spatial"}
+
+    report = _sync([invalid], api_url)
+    assert report["invalid"] == [record["metadata"]["identifier"]]
+    assert state["requests"] == []
+
+
+def test_datacite_sync_retries(record, datacite_api):
+    api_url, state = datacite_api
+    state["failures"] = [429, 503, 502]
+
+    report = _sync([record], api_url)
+    assert report["created"] == [DOI]
+
+    state["failures"] = [503] * 10
+    report = _sync([record], api_url, retries=2)
+    assert report["failed"] == [DOI]
+
+
+def test_datacite_sync_creation_not_retried(record, datacite_api):
+    api_url, state = datacite_api
+    state["post_failures"] = [503]
+
+    # The DOI may have been created, the next run checks it before anything
+    assert _sync([record], api_url)["failed"] == [DOI]
+    assert state["requests"].count(("POST", "/dois")) == 1
+    assert _sync([record], api_url)["created"] == [DOI]
+
+
+def test_datacite_sync_creation_retried_on_429(record, datacite_api):
+    api_url, state = datacite_api
+    state["post_failures"] = [429, 429]
+
+    assert _sync([record], api_url)["created"] == [DOI]
+    assert state["requests"].count(("POST", "/dois")) == 3
+    assert DOI in state["dois"]
+
+
+def test_datacite_sync_retries_rate_limited(datacite_api):
+    api_url, state = datacite_api
+    waits = []
+
+    class RateLimiter(datacite_sync.RateLimiter):
+        def wait(self):
+            waits.append(True)
+
+    state["failures"] = [429, 503]
+    session = datacite_sync.get_session(
+        "repository",
+        "password",
+        retries=3,
+        backoff_factor=0,
+        rate_limiter=RateLimiter(),
+    )
+    assert session.get(f"{api_url}/dois/{DOI}").status_code == 404
+    assert len(state["requests"]) == 3
+    assert len(waits) == 2
+
+
+def test_datacite_sync_concurrent(record, datacite_api):
+    api_url, state = datacite_api
+    records = [
+        {
+            **record,
+            "identification": {
+                **record["identification"],
+                "identifier": f"https://doi.org/10.0000/test-{index}",
+            },
+        }
+        for index in range(20)
+    ]
+    report = _sync(records, api_url, max_workers=4)
+    assert sorted(report["created"]) == sorted(f"10.0000/test-{i}" for i in range(20))
+    assert len(state["dois"]) == 20
+
+
+def test_rate_limiter():
+    rate_limiter = datacite_sync.RateLimiter(50)
+    start = datacite_sync.time.monotonic()
+    threads = [threading.Thread(target=rate_limiter.wait) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert datacite_sync.time.monotonic() - start >= 9 / 50
+
+
+def test_datacite_sync_cli(datacite_api):
+    api_url, state = datacite_api
+    result = CliRunner().invoke(
+        datacite_sync.sync,
+        [
+            "--input",
+            "tests/records/*.yaml",
+            "--api-url",
+            api_url,
+            "--username",
+            "repository",
+            "--password",
+            "password",
+            "--rate-limit",
+            "0",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert "created: 1" in result.output
+    assert DOI in state["dois"]
@@ -0,0 +1,155 @@
+import copy
+import json
+from pathlib import Path
+
+import pytest
+
+from cioos_metadata_conversion import dependencies
+from cioos_metadata_conversion.dependencies import STRUCTURE
+from cioos_metadata_conversion.firebase_to_cioos import record_json_to_yaml
+from cioos_metadata_conversion.record import LANGUAGE_OUTPUT_FORMATS, OUTPUT_FORMATS
+
+FIREBASE_RECORDS = sorted(
+    (Path(__file__).parent / "records" / "firebase").glob("*.json")
+)
+TRACED_FORMATS = ("erddap", "cff", "datacite_json", "datacite_xml")
+
+
+@pytest.fixture(params=["test_record1"] + [file.stem for file in FIREBASE_RECORDS])
+def cioos_record(request, record):
+    if request.param == "test_record1":
+        return record
+    with open(FIREBASE_RECORDS[0].with_name(f"{request.param}.json")) as f:
+        return record_json_to_yaml(json.load(f))
+
+
+@pytest.mark.parametrize("output_format", TRACED_FORMATS)
+def test_declared_dependencies(cioos_record, output_format):
+    reads = dependencies.trace_dependencies(OUTPUT_FORMATS[output_format], cioos_record)
+    assert reads
+    assert not dependencies.undeclared_dependencies(output_format, reads)
+
+
+@pytest.mark.parametrize("output_format", LANGUAGE_OUTPUT_FORMATS)
+def test_declared_dependencies_by_language(record, output_format):
+    reads = dependencies.trace_dependencies(
+        lambda record: LANGUAGE_OUTPUT_FORMATS[output_format](record, ["en", "fr"]),
+        record,
+    )
+    assert ("identification", "title", "fr") in reads
+    assert not dependencies.undeclared_dependencies(output_format, reads)
+
+
+def test_undeclared_dependencies():
+    reads = {
+        ("identification",),
+        ("identification", "title", "en"),
+        ("identification", STRUCTURE),
+        ("spatial", "bounding_box"),
+    }
+    assert dependencies.undeclared_dependencies("cff", reads) == {
+        ("identification", STRUCTURE),
+        ("spatial", "bounding_box"),
+    }
+    assert not dependencies.undeclared_dependencies("json", reads)
+
+
+def _reverse_keys(value):
+    if isinstance(value, dict):
+        return {key: _reverse_keys(value[key]) for key in reversed(value)}
+    if isinstance(value, list):
+        return [_reverse_keys(item) for item in value]
+    return value
+
+
+def test_diff_paths_ignores_keys_order(record):
+    reordered = _reverse_keys(record)
+    assert list(reordered) != list(record)
+    assert dependencies.diff_paths(record, reordered) == set()
+
+
+def test_diff_paths(record):
+    new = copy.deepcopy(record)
+    new["identification"]["title"]["fr"] = "Nouveau titre"
+    new["contact"].append({"roles": ["editor"]})
+    del new["metadata"]["maintenance_note"]
+    assert dependencies.diff_paths(record, new) == {
+        ("identification", "title", "fr"),
+        ("contact", STRUCTURE),
+        ("contact", len(record["contact"])),
+        ("metadata", STRUCTURE),
+        ("metadata", "maintenance_note"),
+    }
+
+
+def test_diff_paths_type_change():
+    assert dependencies.diff_paths({"a": 1}, {"a": 1.0}) == {("a",)}
+    assert dependencies.diff_paths({"a": [1]}, {"a": {"0": 1}}) == {("a",)}
+
+
+WHOLE_RECORD_FORMATS = ["json", "yaml", "xml", "iso19115_xml", "iso19115-3_xml"]
+
+
+@pytest.mark.parametrize(
+    "path,value,expected",
+    [
+        (("metadata", "dates", "publication"), "2030-01-01", ["erddap", "datacite"]),
+        (
+            ("metadata", "dates", "revision"),
+            "2030-01-01",
+            ["erddap", "cff", "datacite"],
+        ),
+        (("identification", "progress_code"), "completed", ["erddap"]),
+        (("metadata", "language"), "fr", ["datacite"]),
+        (("identification", "new_field"), "value", []),
+    ],
+)
+def test_affected_formats(record, path, value, expected):
+    new = copy.deepcopy(record)
+    parent = new
+    for key in path[:-1]:
+        parent = parent[key]
+    parent[path[-1]] = value
+
+    formats = {
+        "erddap": ["erddap"],
+        "cff": ["cff"],
+        "datacite": ["datacite_json", "datacite_xml"],
+    }
+    assert dependencies.affected_formats(record, new) == [
+        output_format
+        for output_format in OUTPUT_FORMATS
+        if output_format in WHOLE_RECORD_FORMATS
+        or any(output_format in formats[name] for name in expected)
+    ]
+
+
+def test_affected_formats_unchanged(record):
+    assert dependencies.affected_formats(record, copy.deepcopy(record)) == []
+
+
+def test_dependency_digest(record):
+    digest = dependencies.dependency_digest(record, "cff")
+    new = _reverse_keys(record)
+    new["identification"]["progress_code"] = "completed"
+    assert dependencies.dependency_digest(new, "cff") == digest
+    assert dependencies.dependency_digest(
+        new, "erddap"
+    ) != dependencies.dependency_digest(record, "erddap")
+    assert dependencies.dependency_digest(record, "cff", languages=["fr"]) != digest
+
+
+def test_dependency_digest_converter(record, monkeypatch):
+    assert dependencies.converter_digest() == dependencies.converter_digest()
+    digest = dependencies.dependency_digest(record, "cff")
+
+    # Upgrading the package or a converter library rebuilds every output
+    monkeypatch.setattr(dependencies, "converter_digest", lambda: "new converter")
+    assert dependencies.dependency_digest(record, "cff") != digest
+
+
+def test_state(tmp_path):
+    state_file = tmp_path / dependencies.STATE_FILE
+    assert dependencies.load_state(state_file) == {}
+    dependencies.write_state(state_file, {"record.cff": "digest"})
+    assert dependencies.load_state(state_file) == {"record.cff": "digest"}
@@ -1,9 +1,20 @@
+import json
+import multiprocessing
+import stat
+import threading
 from glob import glob
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
 
 import pytest
+import yaml
+from click.testing import CliRunner
+from lxml import etree
 
 import cioos_metadata_conversion.erddap as erddap
+from cioos_metadata_conversion import sharding
 from cioos_metadata_conversion.__main__ import load
+from tests import synthetic
 
 
 def test_erddap_global_attributes(record):
@@ -36,6 +47,18 @@ def test_erddap_global_attributes(record):
     assert "metadata_link" in result
 
 
+@pytest.mark.parametrize("output", [None, "xml"])
+def test_erddap_global_attributes_by_language(record, output):
+    result = erddap.global_attributes_by_language(record, ["en", "fr"], output=output)
+    assert result == {
+        language: erddap.global_attributes(record, output=output, language=language)
+        for language in ("en", "fr")
+    }
+    if not output:
+        assert result["fr"]["title"] == record["identification"]["title"]["fr"]
+        assert list(result["fr"]) == list(result["en"])
+
+
 def test_erddap_global_attributes_xml(record):
     result = erddap.global_attributes(record, output="xml", language="en")
     assert result
@@ -92,3 +115,833 @@ def test_erddap_dataset_d_xml_update(record, tmp_path):
     )
     files = tmp_path.glob("dataset.d/*.xml")
     assert files
+
+
+def test_erddap_index():
+    erddap_xml = erddap.ERDDAP("tests/erddap_xmls/test_datasets.xml")
+    assert list(erddap_xml.datasets) == ["TestDataset1"]
+    assert erddap_xml.has_dataset_id("TestDataset1")
+    assert not erddap_xml.has_dataset_id("MissingDataset")
+    assert not erddap_xml.duplicate_dataset_ids
+
+    erddap_xml.update("TestDataset1", {"title": "new title", "new_att": "value"})
+    dataset = erddap_xml.datasets["TestDataset1"]
+    assert dataset.xpath("addAttributes/att[@name='title']")[0].text == "new title"
+    assert dataset.xpath("addAttributes/att[@name='new_att']")[0].text == "value"
+    # Variable attributes are left untouched
+    erddap_xml.update("TestDataset1", {"units": "m"})
+    assert dataset.xpath("addAttributes/att[@name='units']")[0].text == "m"
+    assert (
+        dataset.xpath("dataVariable/addAttributes/att[@name='units']")[0].text
+        == "seconds since 1970-01-01T00:00:00Z"
+    )
+
+
+def test_erddap_duplicate_dataset_ids(tmp_path):
+    file = tmp_path / "datasets.xml"
+    file.write_text(
+        "<erddapDatasets>"
+        "<dataset datasetID='a'><addAttributes/></dataset>"
+        "<dataset datasetID='a'><addAttributes/></dataset>"
+        "<dataset datasetID='b'><addAttributes/></dataset>"
+        "</erddapDatasets>"
+    )
+    erddap_xml = erddap.ERDDAP(file)
+    assert erddap_xml.duplicate_dataset_ids == {"a"}
+    with pytest.raises(ValueError):
+        erddap_xml.update("a", {"title": "title"})
+    erddap_xml.update("b", {"title": "title"})
+
+
+@pytest.mark.parametrize(
+    "file",
+    [
+        "tests/erddap_xmls/test_datasets.xml",
+        "tests/erddap_xmls/datasets.d/test_dataset.xml",
+    ],
+)
+def test_erddap_stream_update(file, tmp_path):
+    output = tmp_path / "datasets.xml"
+    updated = erddap.stream_update(
+        file, {"TestDataset1": {"title": "new & title", "new_att": "value"}}, output
+    )
+    assert updated == {
+        "TestDataset1": {
+            "added": {"new_att": "value"},
+            "modified": {"title": ("title", "new & title")},
+            "unchanged": [],
+        }
+    }
+
+    original = Path(file).read_text()
+    result = output.read_text()
+    assert result.count("<!--") == original.count("<!--")
+    assert result.count("<dataVariable>") == original.count("<dataVariable>")
+
+    dataset = erddap.ERDDAP(output).datasets["TestDataset1"]
+    assert dataset.xpath("addAttributes/att[@name='title']")[0].text == "new & title"
+    assert dataset.xpath("addAttributes/att[@name='new_att']")[0].text == "value"
+
+
+def test_erddap_stream_update_latin1(tmp_path):
+    file = tmp_path / "latin1_datasets.xml"
+    file.write_bytes(
+        "<?xml version='1.0' encoding='ISO-8859-1'?>\n"
+        "<erddapDatasets>\n"
+        "<!-- Données -->\n"
+        '<dataset type="EDDTableFromNcFiles" datasetID="Latin1Dataset">\n'
+        "    <addAttributes>\n"
+        '        <att name="title">Température</att>\n'
+        "    </addAttributes>\n"
+        "</dataset>\n"
+        "</erddapDatasets>\n".encode("iso-8859-1")
+    )
+    output = tmp_path / "datasets.xml"
+    erddap.stream_update(file, {"Latin1Dataset": {"summary": "Salinité"}}, output)
+
+    result = output.read_bytes()
+    assert result.count(b"<?xml") == 1
+    assert result.startswith(b"<?xml version='1.0' encoding='ISO-8859-1'?>")
+    dataset = etree.parse(str(output)).find("dataset")
+    assert dataset.xpath("addAttributes/att[@name='title']")[0].text == "Température"
+    assert dataset.xpath("addAttributes/att[@name='summary']")[0].text == "Salinité"
+
+
+@pytest.mark.parametrize("mode", ["stream", "splice"])
+def test_erddap_dataset_xml_update_modes(record, tmp_path, mode):
+    for output_mode in ("tree", mode):
+        (tmp_path / output_mode).mkdir()
+        report = erddap.update_dataset_xml(
+            "tests/erddap_xmls/test_datasets.xml",
+            [record],
+            erddap_url="https://catalogue.hakai.org/erddap",
+            output_dir=tmp_path / output_mode,
+            mode=output_mode,
+        )
+        assert report["updated"] == report["changed"] == ["TestDataset1"]
+        assert not report["missing"]
+
+    parser = etree.XMLParser(remove_blank_text=True)
+    assert etree.tostring(
+        etree.parse(tmp_path / "tree" / "test_datasets.xml", parser), method="c14n"
+    ) == etree.tostring(
+        etree.parse(tmp_path / mode / "test_datasets.xml", parser), method="c14n"
+    )
+
+
+def test_erddap_splice_update(tmp_path):
+    file = tmp_path / "datasets.xml"
+    file.write_bytes(
+        b"<?xml version='1.0' encoding='utf-8'?>\n"
+        b"<erddapDatasets>\n"
+        b"<!-- untouched   comment -->\n"
+        b"<dataset datasetID='a'>\n"
+        b"  <addAttributes>\n"
+        b"    <att name='title'>old</att>\n"
+        b"    <att name='empty'/>\n"
+        b"    <att name='same'>x &amp; y</att>\n"
+        b"  </addAttributes>\n"
+        b"  <dataVariable><addAttributes><att name='title'>var</att></addAttributes></dataVariable>\n"
+        b"</dataset>\n"
+        b"<dataset datasetID='b'>\n"
+        b"  <addAttributes>\n"
+        b"  </addAttributes>\n"
+        b"</dataset>\n"
+        b"<dataset datasetID='c'><addAttributes/></dataset>\n"
+        b"<dataset datasetID='d'>\n"
+        b"</dataset>\n"
+        b"<dataset datasetID='e'><addAttributes><att name='title'>e</att></addAttributes></dataset>\n"
+        b"</erddapDatasets>"
+    )
+    updated = erddap.splice_update(
+        file,
+        {
+            "a": {
+                "title": "new <title>",
+                "empty": "value",
+                "same": "x & y",
+                "added": "é",
+            },
+            "b": {"title": "b"},
+            "c": {"title": "c"},
+            "d": {"title": "d"},
+        },
+    )
+    assert updated == {
+        "a": {
+            "added": {"added": "é"},
+            "modified": {"title": ("old", "new <title>"), "empty": ("", "value")},
+            "unchanged": ["same"],
+        },
+        **{
+            dataset_id: {
+                "added": {"title": dataset_id},
+                "modified": {},
+                "unchanged": [],
+            }
+            for dataset_id in "bcd"
+        },
+    }
+    assert file.read_bytes() == (
+        b"<?xml version='1.0' encoding='utf-8'?>\n"
+        b"<erddapDatasets>\n"
+        b"<!-- untouched   comment -->\n"
+        b"<dataset datasetID='a'>\n"
+        b"  <addAttributes>\n"
+        b"    <att name='title'>new &lt;title&gt;</att>\n"
+        b'    <att name="empty">value</att>\n'
+        b"    <att name='same'>x &amp; y</att>\n"
+        b'    <att name="added">\xc3\xa9</att>\n'
+        b"  </addAttributes>\n"
+        b"  <dataVariable><addAttributes><att name='title'>var</att></addAttributes></dataVariable>\n"
+        b"</dataset>\n"
+        b"<dataset datasetID='b'>\n"
+        b"  <addAttributes>\n"
+        b'    <att name="title">b</att>\n'
+        b"  </addAttributes>\n"
+        b"</dataset>\n"
+        b"<dataset datasetID='c'><addAttributes><att name=\"title\">c</att></addAttributes></dataset>\n"
+        b"<dataset datasetID='d'>\n"
+        b'<addAttributes><att name="title">d</att></addAttributes></dataset>\n'
+        b"<dataset datasetID='e'><addAttributes><att name='title'>e</att></addAttributes></dataset>\n"
+        b"</erddapDatasets>"
+    )
+
+
+def test_erddap_splice_update_unchanged(tmp_path):
+    file = tmp_path / "datasets.xml"
+    file.write_bytes(Path("tests/erddap_xmls/test_datasets.xml").read_bytes())
+    mtime = file.stat().st_mtime_ns
+    assert erddap.splice_update(file, {"TestDataset1": {"title": "title"}}) == {
+        "TestDataset1": {"added": {}, "modified": {}, "unchanged": ["title"]}
+    }
+    assert file.stat().st_mtime_ns == mtime
+
+
+@pytest.fixture
+def flag_server():
+    requested = []
+
+    class FlagHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requested.append(self.path)
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b"ok")
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), FlagHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", requested
+    server.shutdown()
+
+
+@pytest.mark.parametrize("mode", ["tree", "stream", "splice"])
+def test_erddap_flag_changed_datasets(record, tmp_path, flag_server, mode):
+    url, requested = flag_server
+    flag_dir = tmp_path / "flag"
+    flag_dir.mkdir()
+    datasets_xml = tmp_path / "datasets.xml"
+    datasets_xml.write_bytes(Path("tests/erddap_xmls/test_datasets.xml").read_bytes())
+
+    kwargs = {
+        "erddap_url": "https://catalogue.hakai.org/erddap",
+        "mode": mode,
+        "flag_dir": flag_dir,
+        "flag_url": url + "/setDatasetFlag.txt?datasetID={dataset_id}",
+    }
+    erddap.update_dataset_xml(str(datasets_xml), [record], **kwargs)
+    assert [file.name for file in flag_dir.iterdir()] == ["TestDataset1"]
+    assert requested == ["/setDatasetFlag.txt?datasetID=TestDataset1"]
+
+    # Nothing changes on a second run
+    (flag_dir / "TestDataset1").unlink()
+    erddap.update_dataset_xml(str(datasets_xml), [record], **kwargs)
+    assert not list(flag_dir.iterdir())
+    assert len(requested) == 1
+
+
+def test_erddap_flag_key(record, tmp_path, flag_server):
+    url, requested = flag_server
+    assert erddap.flag_key("TestDataset1", "secret") == "8bdf4ab39077"
+    assert erddap.flag_key("TestDataset2", "secret") != "8bdf4ab39077"
+
+    flag_url = url + "/setDatasetFlag.txt?datasetID={dataset_id}&flagKey={flag_key}"
+    with pytest.raises(ValueError, match="flagKeyKey"):
+        erddap.flag_datasets(["TestDataset1"], flag_url=flag_url)
+    assert not requested
+    assert (
+        erddap.flag_datasets(["TestDataset1"], flag_url=flag_url, flag_key_key="secret")
+        == []
+    )
+    assert requested == [
+        "/setDatasetFlag.txt?datasetID=TestDataset1&flagKey=8bdf4ab39077"
+    ]
+
+
+def test_erddap_flag_failed(record, tmp_path):
+    datasets_xml = tmp_path / "datasets.xml"
+    datasets_xml.write_bytes(Path("tests/erddap_xmls/test_datasets.xml").read_bytes())
+    args = [
+        "--datasets-xml",
+        str(datasets_xml),
+        "--records",
+        "tests/records/test_record1.yaml",
+        "--erddap-url",
+        "https://catalogue.hakai.org/erddap",
+        "--flag-url",
+        # Nothing listens on port 1
+        "http://127.0.0.1:1/setDatasetFlag.txt?datasetID={dataset_id}",
+    ]
+    result = CliRunner().invoke(erddap.update, args)
+    assert result.exit_code == 1
+    assert "1 changed datasets couldn't be flagged for reload" in result.output
+    assert "TestDataset1" in result.output
+
+    datasets_xml.write_bytes(Path("tests/erddap_xmls/test_datasets.xml").read_bytes())
+    report = erddap.update_dataset_xml(
+        str(datasets_xml),
+        [record],
+        "https://catalogue.hakai.org/erddap",
+        flag_url="http://127.0.0.1:1/setDatasetFlag.txt?datasetID={dataset_id}",
+    )
+    assert report["changed"] == report["flag_failed"] == ["TestDataset1"]
+
+    # The flag key is required before anything is updated
+    datasets_xml.write_bytes(Path("tests/erddap_xmls/test_datasets.xml").read_bytes())
+    with pytest.raises(ValueError, match="flagKeyKey"):
+        erddap.update_dataset_xml(
+            str(datasets_xml),
+            [record],
+            "https://catalogue.hakai.org/erddap",
+            flag_url="http://127.0.0.1:1/?datasetID={dataset_id}&flagKey={flag_key}",
+        )
+    assert (
+        datasets_xml.read_bytes()
+        == Path("tests/erddap_xmls/test_datasets.xml").read_bytes()
+    )
+
+
+@pytest.mark.parametrize("mode", ["tree", "stream", "splice"])
+def test_erddap_dry_run(record, tmp_path, mode):
+    datasets_xml = tmp_path / "datasets.xml"
+    datasets_xml.write_bytes(Path("tests/erddap_xmls/test_datasets.xml").read_bytes())
+    mtime = datasets_xml.stat().st_mtime_ns
+
+    report = erddap.update_dataset_xml(
+        str(datasets_xml),
+        [record],
+        erddap_url="https://catalogue.hakai.org/erddap",
+        mode=mode,
+        dry_run=True,
+    )
+    changes = report["changes"][str(datasets_xml)]["TestDataset1"]
+    assert changes["modified"]["title"][0] == "title"
+    assert "creator_name" in changes["added"]
+    assert datasets_xml.stat().st_mtime_ns == mtime
+
+    summary = erddap.format_changes(report["changes"])
+    assert "TestDataset1: " in summary
+    assert "~ title: 'title' -> " in summary
+
+
+def test_erddap_update_cli_dry_run(tmp_path):
+    datasets_xml = tmp_path / "datasets.xml"
+    datasets_xml.write_bytes(Path("tests/erddap_xmls/test_datasets.xml").read_bytes())
+    result = CliRunner().invoke(
+        erddap.update,
+        [
+            "--datasets-xml",
+            str(datasets_xml),
+            "--records",
+            "tests/records/*.yaml",
+            "--erddap-url",
+            "https://catalogue.hakai.org/erddap",
+            "--dry-run",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert "TestDataset1: " in result.output
+    assert (
+        datasets_xml.read_bytes()
+        == Path("tests/erddap_xmls/test_datasets.xml").read_bytes()
+    )
+
+
+@pytest.fixture
+def datasets_d(tmp_path, record):
+    """A datasets.d directory of fragments with matching records."""
+    fragment = Path("tests/erddap_xmls/datasets.d/test_dataset.xml").read_text()
+    directory = tmp_path / "datasets.d"
+    directory.mkdir()
+    records = []
+    for index in range(12):
+        dataset_id = f"TestDataset{index}"
+        (directory / f"{dataset_id}.xml").write_text(
+            fragment.replace('datasetID="TestDataset1"', f'datasetID="{dataset_id}"')
+        )
+        records.append(
+            {
+                **record,
+                "distribution": [
+                    {
+                        "url": f"https://catalogue.hakai.org/erddap/tabledap/{dataset_id}.html"
+                    }
+                ],
+            }
+        )
+    records.append(
+        {
+            **record,
+            "distribution": [
+                {"url": "https://catalogue.hakai.org/erddap/tabledap/Missing.html"}
+            ],
+        }
+    )
+    return directory, records
+
+
+@pytest.mark.parametrize("mode", ["tree", "stream", "splice"])
+def test_erddap_parallel_datasets_d(datasets_d, tmp_path, mode):
+    directory, records = datasets_d
+    reports = {}
+    for workers in (1, 3):
+        output_dir = tmp_path / f"output_{workers}"
+        output_dir.mkdir()
+        reports[workers] = erddap.update_dataset_xml(
+            str(directory / "*.xml"),
+            records,
+            erddap_url="https://catalogue.hakai.org/erddap",
+            output_dir=output_dir,
+            mode=mode,
+            workers=workers,
+        )
+
+    assert reports[1] == reports[3]
+    assert sorted(reports[3]["changed"]) == sorted(
+        f"TestDataset{index}" for index in range(12)
+    )
+    assert reports[3]["missing"] == ["Missing"]
+    for file in (tmp_path / "output_1").iterdir():
+        assert file.read_bytes() == (tmp_path / "output_3" / file.name).read_bytes()
+
+
+def test_erddap_datasets_attributes_computed_once(record, monkeypatch):
+    calls = []
+    global_attributes = erddap.global_attributes
+
+    def counted_global_attributes(record, **kwargs):
+        calls.append(record)
+        return global_attributes(record, **kwargs)
+
+    monkeypatch.setattr(erddap, "global_attributes", counted_global_attributes)
+    record = {
+        **record,
+        "distribution": [
+            {"url": f"https://catalogue.hakai.org/erddap/tabledap/Test{index}.html"}
+            for index in range(3)
+        ]
+        + [{"url": "https://example.com/data.html"}],
+    }
+    other = {**record, "distribution": [{"url": "https://example.com/other.html"}]}
+
+    datasets = erddap.get_datasets_attributes(
+        [record, other], "https://catalogue.hakai.org/erddap"
+    )
+
+    assert list(datasets) == ["Test0", "Test1", "Test2"]
+    assert datasets["Test0"] == datasets["Test2"]
+    assert len(calls) == 1
+
+
+def test_erddap_datasets_attributes_skip_invalid(record):
+    url = "https://catalogue.hakai.org/erddap/tabledap/{}.html"
+    valid = {**record, "distribution": [{"url": url.format("Valid")}]}
+    invalid = {
+        **valid,
+        "identification": {
+            key: value
+            for key, value in record["identification"].items()
+            if key != "progress_code"
+        },
+        "distribution": [{"url": url.format("Invalid")}],
+    }
+
+    datasets = erddap.get_datasets_attributes(
+        [invalid, valid], "https://catalogue.hakai.org/erddap"
+    )
+    assert list(datasets) == ["Valid"]
+
+
+def test_erddap_load_records_parallel(tmp_path):
+    text = Path("tests/records/test_record1.yaml").read_text()
+    for index in range(5):
+        (tmp_path / f"record{index}.yaml").write_text(text)
+    pattern = str(tmp_path / "*.yaml")
+
+    records = erddap.load_records(pattern, workers=2)
+    assert len(records) == 5
+    assert records == erddap.load_records(pattern)
+
+
+def test_erddap_route_url():
+    index = erddap.build_url_index(
+        [
+            "https://erddap.org/erddap",
+            "https://erddap.org/erddap/other/",
+            "https://data.example.com/erddap",
+        ]
+    )
+    assert (
+        erddap.route_url("https://erddap.org/erddap/tabledap/A.html", index)
+        == "https://erddap.org/erddap"
+    )
+    assert (
+        erddap.route_url("http://ERDDAP.org/erddap/other/tabledap/A.html", index)
+        == "https://erddap.org/erddap/other/"
+    )
+    assert (
+        erddap.route_url("https://data.example.com/erddap/griddap/B.html", index)
+        == "https://data.example.com/erddap"
+    )
+    assert erddap.route_url("https://erddap.org/erddap2/tabledap/A.html", index) is None
+    assert erddap.route_url("https://other.org/erddap/tabledap/A.html", index) is None
+
+
+def test_erddap_update_several_servers(datasets_d, tmp_path, monkeypatch):
+    directory, records = datasets_d
+    # Move half of the datasets to a second server
+    records = [
+        {
+            **record,
+            "distribution": [
+                {
+                    "url": ressource["url"].replace(
+                        "catalogue.hakai.org", "erddap.example.com"
+                    )
+                }
+                for ressource in record["distribution"]
+            ],
+        }
+        if index % 2
+        else record
+        for index, record in enumerate(records)
+    ]
+    calls = []
+    global_attributes = erddap.global_attributes
+    monkeypatch.setattr(
+        erddap,
+        "global_attributes",
+        lambda record, **kwargs: (
+            calls.append(record) or global_attributes(record, **kwargs)
+        ),
+    )
+
+    output_dir = tmp_path / "output"
+    reports = erddap.update_erddap_servers(
+        {
+            "https://catalogue.hakai.org/erddap": str(directory / "*.xml"),
+            "https://erddap.example.com/erddap": str(directory / "*.xml"),
+        },
+        records,
+        output_dir,
+    )
+
+    assert len(calls) == len(records)
+    hakai = reports["https://catalogue.hakai.org/erddap"]
+    example = reports["https://erddap.example.com/erddap"]
+    assert sorted(hakai["changed"]) == sorted(
+        f"TestDataset{i}" for i in range(0, 12, 2)
+    )
+    assert sorted(example["changed"]) == sorted(
+        f"TestDataset{i}" for i in range(1, 12, 2)
+    )
+    assert hakai["missing"] == ["Missing"]
+    assert example["missing"] == []
+    assert len(list((output_dir / "catalogue.hakai.org_erddap").iterdir())) == 12
+    assert len(list((output_dir / "erddap.example.com_erddap").iterdir())) == 12
+
+
+def test_erddap_update_cli_servers(tmp_path):
+    datasets_xml = tmp_path / "datasets.xml"
+    datasets_xml.write_bytes(Path("tests/erddap_xmls/test_datasets.xml").read_bytes())
+    result = CliRunner().invoke(
+        erddap.update,
+        [
+            "--records",
+            "tests/records/*.yaml",
+            "--server",
+            f"https://catalogue.hakai.org/erddap={datasets_xml}",
+            "--server",
+            f"https://erddap.example.com/erddap={datasets_xml}",
+            "--dry-run",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert "TestDataset1: " in result.output
+
+    result = CliRunner().invoke(
+        erddap.update, ["--records", "tests/records/*.yaml", "--server", "invalid"]
+    )
+    assert result.exit_code == 2
+    assert "URL=DATASETS_XML" in result.output
+
+
+@pytest.mark.parametrize("mode", ["tree", "stream", "splice"])
+def test_erddap_concurrent_update(tmp_path, monkeypatch, mode):
+    datasets_xml = tmp_path / "datasets.xml"
+    datasets_xml.write_bytes(Path("tests/erddap_xmls/test_datasets.xml").read_bytes())
+    plan_attributes = erddap.plan_attributes
+    concurrent = []
+
+    def plan_and_modify(current, global_attributes):
+        # Another region updates the file once this update has read it
+        if not concurrent:
+            concurrent.append(True)
+            erddap.splice_update(
+                datasets_xml, {"TestDataset1": {"other_region": "updated"}}
+            )
+        return plan_attributes(current, global_attributes)
+
+    apply_file = erddap._apply_file
+    attempts = []
+    monkeypatch.setattr(erddap, "plan_attributes", plan_and_modify)
+    monkeypatch.setattr(
+        erddap,
+        "_apply_file",
+        lambda *args: attempts.append(args) or apply_file(*args),
+    )
+    changes = erddap._update_file(
+        str(datasets_xml), {"TestDataset1": {"title": "New title"}}, mode
+    )
+
+    assert changes["TestDataset1"]["modified"]["title"][1] == "New title"
+    _, attributes = erddap.ERDDAP(datasets_xml)._get_attributes("TestDataset1")
+    assert attributes["title"].text == "New title"
+    assert attributes["other_region"].text == "updated"
+    # The first attempt is discarded and the changes re-applied
+    assert len(attempts) == 2
+
+
+def _concurrent_writer(datasets_xml, mode, index, barrier, results):
+    barrier.wait()
+    try:
+        erddap._update_file(
+            datasets_xml, {"TestDataset1": {f"writer_{index}": "updated"}}, mode
+        )
+    except erddap.ConcurrentUpdateError:
+        results.put((index, False))
+    else:
+        results.put((index, True))
+
+
+@pytest.mark.parametrize("mode", ["tree", "stream", "splice"])
+def test_erddap_concurrent_writers(tmp_path, mode):
+    datasets_xml = tmp_path / "datasets.xml"
+    datasets_xml.write_bytes(Path("tests/erddap_xmls/test_datasets.xml").read_bytes())
+    n_writers = 32
+    barrier = multiprocessing.Barrier(n_writers)
+    results = multiprocessing.Queue()
+    writers = [
+        multiprocessing.Process(
+            target=_concurrent_writer,
+            args=(str(datasets_xml), mode, index, barrier, results),
+        )
+        for index in range(n_writers)
+    ]
+    for writer in writers:
+        writer.start()
+    succeeded = [index for index, ok in (results.get() for _ in writers) if ok]
+    for writer in writers:
+        writer.join()
+
+    # An update is either kept or reported as failed, never silently lost
+    _, attributes = erddap.ERDDAP(datasets_xml)._get_attributes("TestDataset1")
+    written = [index for index in range(n_writers) if f"writer_{index}" in attributes]
+    assert sorted(succeeded) == written
+    assert succeeded
+
+
+def test_erddap_generate_dataset_xml_escaped():
+    result = erddap.generate_dataset_xml({"title": "Fish & <Chips>", "o'name": 1})
+    add_attributes = etree.fromstring(result)
+    assert add_attributes.find("att[@name='title']").text == "Fish & <Chips>"
+    assert add_attributes.find('att[@name="o\'name"]').text == "1"
+
+
+@pytest.mark.parametrize("combined", [False, True])
+def test_erddap_write_attributes_fragments(datasets_d, tmp_path, combined):
+    _, records = datasets_d
+    identification = records[0]["identification"]
+    records[0] = {
+        **records[0],
+        "identification": {
+            **identification,
+            "title": {**identification["title"], "en": 'Fish & <Chips> "Co"'},
+            "abstract": {**identification["abstract"], "en": "a < b && c > d"},
+        },
+    }
+    output = tmp_path / ("fragments.xml" if combined else "fragments")
+
+    dataset_ids = erddap.write_attributes_fragments(
+        records + records[:1], "https://catalogue.hakai.org/erddap", output, combined
+    )
+
+    assert dataset_ids == [f"TestDataset{i}" for i in range(12)] + ["Missing"]
+    if combined:
+        datasets = etree.parse(str(output)).getroot()
+        assert [dataset.get("datasetID") for dataset in datasets] == dataset_ids
+        add_attributes = datasets[0].find("addAttributes")
+    else:
+        assert sorted(file.stem for file in output.iterdir()) == sorted(dataset_ids)
+        add_attributes = etree.parse(str(output / "TestDataset0.xml")).getroot()
+    expected = erddap.global_attributes(records[0], output=None)
+    attributes = {att.get("name"): att.text for att in add_attributes.iterfind("att")}
+    assert attributes == {name: str(value) for name, value in expected.items()}
+    assert attributes["title"] == 'Fish & <Chips> "Co"'
+    assert attributes["summary"] == "a < b && c > d"
+
+    text = (output if combined else output / "TestDataset0.xml").read_text()
+    assert '<att name="title">Fish &amp; &lt;Chips&gt; "Co"</att>' in text
+    assert '<att name="summary">a &lt; b &amp;&amp; c &gt; d</att>' in text
+
+
+def test_erddap_fragments_cli(tmp_path):
+    result = CliRunner().invoke(
+        erddap.fragments,
+        [
+            "--records",
+            "tests/records/*.yaml",
+            "--erddap-url",
+            "https://catalogue.hakai.org/erddap",
+            "--output",
+            str(tmp_path / "datasets.d"),
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert (tmp_path / "datasets.d" / "TestDataset1.xml").exists()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_erddap_iter_records(tmp_path, record, workers):
+    files = []
+    for index in range(3):
+        files.append(tmp_path / f"record_{index}.yaml")
+        files[-1].write_text(yaml.dump({**record, "index": index}))
+    records = erddap.iter_records(str(tmp_path / "*.yaml"), workers)
+    assert not isinstance(records, list)
+    assert sorted(item["index"] for item in records) == [0, 1, 2]
+
+
+def test_erddap_fragments_cli_streams_records(tmp_path, record, monkeypatch):
+    records_dir = tmp_path / "records"
+    records_dir.mkdir()
+    for index in range(3):
+        url = f"https://catalogue.hakai.org/erddap/tabledap/Dataset{index}.html"
+        (records_dir / f"record_{index}.yaml").write_text(
+            yaml.dump({**record, "distribution": [{"url": url}]})
+        )
+    output = tmp_path / "datasets.d"
+    load_record_file = erddap._load_record_file
+    written = []
+
+    def _load(record_file):
+        # Fragments written before the record file is read
+        written.append(len(list(output.glob("*.xml"))) if output.exists() else 0)
+        return load_record_file(record_file)
+
+    monkeypatch.setattr(erddap, "_load_record_file", _load)
+    result = CliRunner().invoke(
+        erddap.fragments,
+        [
+            "--records",
+            str(records_dir / "*.yaml"),
+            "--erddap-url",
+            "https://catalogue.hakai.org/erddap",
+            "--output",
+            str(output),
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert written == [0, 1, 2]
+
+
+def test_erddap_update_cli_shards(tmp_path):
+    datasets_xml = tmp_path / "datasets.xml"
+    synthetic.write_datasets_xml(datasets_xml, 12)
+    records_dir = tmp_path / "records"
+    records_dir.mkdir()
+    for index, record in enumerate(synthetic.generate_records(12)):
+        (records_dir / f"record_{index}.yaml").write_text(yaml.dump(record))
+
+    manifests = []
+    for index in range(1, 4):
+        manifests.append(tmp_path / f"manifest.{index}.json")
+        result = CliRunner().invoke(
+            erddap.update,
+            [
+                "--records",
+                str(records_dir / "*.yaml"),
+                "--datasets-xml",
+                str(datasets_xml),
+                "--erddap-url",
+                synthetic.ERDDAP_URL,
+                "--shard",
+                f"{index}/3",
+                "--manifest",
+                str(manifests[-1]),
+            ],
+        )
+        assert result.exit_code == 0, result.output
+
+    erddap_xml = erddap.ERDDAP(str(datasets_xml))
+    for index in range(12):
+        dataset_id = synthetic.dataset_id(index)
+        title = erddap_xml._get_attributes(dataset_id)[1]["title"]
+        assert title.text.endswith(f" {index}")
+
+    merged = sharding.merge_manifests(
+        [json.loads(manifest.read_text()) for manifest in manifests]
+    )
+    assert merged["total"] == 12
+    assert len(merged["outputs"]) == 12
+
+
+def test_erddap_shard_records(record):
+    records = [
+        {**record, "metadata": {**record["metadata"], "identifier": f"record-{index}"}}
+        for index in range(12)
+    ]
+    shards = [erddap.shard_records(records, (index, 3)) for index in range(1, 4)]
+    identifiers = [f"record-{index}" for index in range(12)]
+    assert all(keys == identifiers for keys, _, _ in shards)
+    sharded = sorted(key for _, inputs, _ in shards for key in inputs)
+    assert sharded == sorted(identifiers)
+    for _, inputs, shard_records in shards:
+        assert [item["metadata"]["identifier"] for item in shard_records] == inputs
+
+
+@pytest.mark.parametrize("mode", ["tree", "stream", "splice"])
+@pytest.mark.parametrize("permissions", [0o644, 0o640])
+def test_erddap_update_keeps_permissions(tmp_path, mode, permissions):
+    file = tmp_path / "datasets.xml"
+    file.write_bytes(Path("tests/erddap_xmls/test_datasets.xml").read_bytes())
+    file.chmod(permissions)
+    attributes = {"TestDataset1": {"title": "new title"}}
+    if mode == "tree":
+        datasets = erddap.ERDDAP(file)
+        datasets.update("TestDataset1", attributes["TestDataset1"])
+        datasets.save()
+    elif mode == "stream":
+        erddap.stream_update(file, attributes)
+    else:
+        erddap.splice_update(file, attributes)
+
+    assert b"new title" in file.read_bytes()
+    assert stat.S_IMODE(file.stat().st_mode) == permissions
+    # No temporary file is left behind
+    files = [path.name for path in tmp_path.iterdir() if path.suffix != ".lock"]
+    assert files == ["datasets.xml"]
@@ -0,0 +1,57 @@
+"""
+Scaling test of the ERDDAP datasets.xml update.
+
+Only a small smoke size runs by default. Set the sizes to run with, ex:
+
+    ERDDAP_SCALING_SIZES=1000,10000,50000 pytest tests/test_erddap_scaling.py -p no:xdist
+
+The wall time, peak memory and output size of each run are then written to
+tests/results/erddap_scaling_<mode>.json.
+"""
+
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from tests.synthetic import run_update
+
+SCALING_SIZES = os.environ.get("ERDDAP_SCALING_SIZES")
+SIZES = [int(size) for size in SCALING_SIZES.split(",")] if SCALING_SIZES else [200]
+# Maximum growth of the time per dataset between the smallest and largest size
+MAX_TIME_RATIO = 3
+# Sizes under which the timings are too noisy to compare
+MIN_COMPARED_SIZE = 1000
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+@pytest.mark.parametrize("mode", ["tree", "stream", "splice"])
+def test_erddap_update_scaling(tmp_path, mode):
+    results = []
+    for size in sorted(SIZES):
+        # Run each size in a fresh process to measure its own peak memory
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            result = executor.submit(run_update, tmp_path, size, mode).result()
+        results.append(result)
+
+        assert result["changed"] == size
+        assert result["output_bytes"] > result["input_bytes"]
+
+    if SCALING_SIZES:
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        (RESULTS_DIR / f"erddap_scaling_{mode}.json").write_text(
+            json.dumps(results, indent=2)
+        )
+
+    compared = [result for result in results if result["datasets"] >= MIN_COMPARED_SIZE]
+    if len(compared) > 1:
+        smallest, largest = compared[0], compared[-1]
+        ratio = (largest["wall_time_s"] / largest["datasets"]) / (
+            smallest["wall_time_s"] / smallest["datasets"]
+        )
+        assert ratio < MAX_TIME_RATIO, f"Superlinear update time: {results}"
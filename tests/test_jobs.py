@@ -0,0 +1,191 @@
+import time
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner
+
+from cioos_metadata_conversion import jobs
+from cioos_metadata_conversion.__main__ import cli
+
+TEST_RECORD = Path("tests/records/test_record1.yaml")
+
+
+@pytest.fixture
+def queue(tmp_path):
+    with jobs.JobQueue(tmp_path / "jobs.sqlite") as queue:
+        yield queue
+
+
+@pytest.fixture
+def sources(tmp_path):
+    directory = tmp_path / "records"
+    directory.mkdir()
+    files = []
+    for index in range(6):
+        file = directory / f"record_{index}.yaml"
+        file.write_text(TEST_RECORD.read_text())
+        files.append(str(file))
+    return files
+
+
+def test_enqueue_coalesces_pending_jobs(queue, tmp_path):
+    job_id = queue.enqueue("record.yaml", ["cff"], tmp_path)
+    assert queue.enqueue("record.yaml", ["erddap", "cff"], tmp_path) == job_id
+    assert queue.get(job_id)["formats"] == ["cff", "erddap"]
+    assert queue.enqueue("record.yaml", ["cff"], tmp_path / "other") != job_id
+    assert queue.stats() == {"pending": 2}
+
+    # A running job may have read the record before its last edit
+    assert queue.claim("worker")["id"] == job_id
+    assert queue.enqueue("record.yaml", ["cff"], tmp_path) != job_id
+
+
+def test_enqueue_invalid(queue, tmp_path):
+    with pytest.raises(ValueError, match="Unsupported output formats"):
+        queue.enqueue("record.yaml", ["pdf"], tmp_path)
+    with pytest.raises(ValueError, match="Unsupported schema"):
+        queue.enqueue("record.yaml", ["cff"], tmp_path, schema="ISO")
+    assert queue.stats() == {}
+
+
+def test_claim(queue, tmp_path):
+    assert queue.claim("worker") is None
+    first = queue.enqueue("first.yaml", ["cff"], tmp_path)
+    second = queue.enqueue("second.yaml", ["cff"], tmp_path)
+
+    job = queue.claim("worker")
+    assert (job["id"], job["status"], job["attempts"]) == (first, "running", 1)
+    assert queue.get(first)["worker"] == "worker"
+    assert queue.claim("worker")["id"] == second
+    assert queue.claim("worker") is None
+
+
+def test_claim_expired_lease(queue, tmp_path):
+    job_id = queue.enqueue("record.yaml", ["cff"], tmp_path)
+    assert queue.claim("worker", lease=0)["id"] == job_id
+    job = queue.claim("other", lease=60)
+    assert (job["id"], job["attempts"], job["worker"]) == (job_id, 2, "other")
+    assert queue.claim("worker") is None
+
+
+def test_claim_expired_lease_max_attempts(queue, tmp_path):
+    job_id = queue.enqueue("record.yaml", ["cff"], tmp_path)
+    assert queue.claim("worker", lease=0, max_attempts=2)["attempts"] == 1
+    assert queue.claim("worker", lease=0, max_attempts=2)["attempts"] == 2
+    assert queue.claim("worker", lease=0, max_attempts=2) is None
+    job = queue.get(job_id)
+    assert job["status"] == "failed"
+    assert job["error"] == "Lease expired after 2 attempts"
+
+
+def test_claim_skips_running_source(queue, tmp_path):
+    first = queue.enqueue("record.yaml", ["cff"], tmp_path)
+    job = queue.claim("worker")
+    second = queue.enqueue("record.yaml", ["cff"], tmp_path)
+    other = queue.enqueue("other.yaml", ["cff"], tmp_path)
+    assert queue.enqueue("record.yaml", ["cff"], tmp_path / "other") > other
+
+    # The newer job of the record waits for the running one
+    assert queue.claim("worker")["id"] == other
+    assert queue.claim("worker")["source"] == "record.yaml"
+    assert queue.claim("worker") is None
+    assert queue.complete(job, {})
+    assert queue.get(first)["status"] == "done"
+    assert queue.claim("worker")["id"] == second
+
+
+def test_expired_lease_owner(queue, tmp_path):
+    job_id = queue.enqueue("record.yaml", ["cff"], tmp_path)
+    expired = queue.claim("worker", lease=0)
+    job = queue.claim("other")
+    assert queue.complete(expired, {}) is False
+    assert queue.fail(expired, "error") is None
+    assert queue.get(job_id)["status"] == "running"
+    assert queue.get(job_id)["worker"] == "other"
+
+    assert queue.complete(job, {"load": 1})
+    assert queue.get(job_id)["status"] == "done"
+
+
+def test_fail_retries_with_backoff(queue, tmp_path):
+    job_id = queue.enqueue("record.yaml", ["cff"], tmp_path)
+    job = queue.claim("worker")
+    assert queue.fail(job, "error", max_attempts=2, backoff=60) == "pending"
+    assert queue.get(job_id)["available_at"] > time.time() + 50
+    assert queue.claim("worker") is None
+
+    queue.connection.execute("UPDATE jobs SET available_at = 0")
+    job = queue.claim("worker")
+    assert job["attempts"] == 2
+    assert queue.fail(job, "last error", max_attempts=2) == "failed"
+    assert queue.get(job_id)["error"] == "last error"
+    assert queue.stats() == {"failed": 1}
+
+
+def test_fail_merges_into_newer_job(queue, tmp_path):
+    job_id = queue.enqueue("record.yaml", ["cff"], tmp_path)
+    job = queue.claim("worker")
+    newer_id = queue.enqueue("record.yaml", ["erddap"], tmp_path)
+    assert queue.fail(job, "error") == "merged"
+    assert queue.get(job_id)["status"] == "merged"
+    assert queue.get(newer_id)["formats"] == ["erddap", "cff"]
+
+
+def test_run_job(queue, tmp_path):
+    queue.enqueue(str(TEST_RECORD), ["cff", "erddap"], tmp_path / "output")
+    job = queue.claim("worker")
+    timings = jobs.run_job(job)
+    queue.complete(job, timings)
+    assert set(timings) == {"load", "cff", "erddap"}
+    assert (tmp_path / "output" / "test_record1.cff").exists()
+    assert (tmp_path / "output" / "test_record1.erddap").exists()
+
+    # Existing outputs are replaced without leaving temporary files
+    queue.enqueue(str(TEST_RECORD), ["cff"], tmp_path / "output")
+    jobs.run_job(queue.claim("worker"))
+    assert sorted(path.name for path in (tmp_path / "output").iterdir()) == [
+        "test_record1.cff",
+        "test_record1.erddap",
+    ]
+
+
+def test_run_workers(tmp_path, sources):
+    path = tmp_path / "jobs.sqlite"
+    output_dir = tmp_path / "output"
+    with jobs.JobQueue(path) as queue:
+        for source in sources + [str(tmp_path / "missing.yaml")]:
+            queue.enqueue(source, ["cff"], output_dir)
+        # Duplicate edits of the same record
+        queue.enqueue(sources[0], ["erddap"], output_dir)
+
+    stats = jobs.run_workers(
+        path, 2, poll_interval=0.05, max_attempts=2, backoff=0, burst=True
+    )
+    assert stats == {"done": 6, "failed": 1}
+    assert len(list(output_dir.glob("*.cff"))) == 6
+    assert (output_dir / "record_0.erddap").exists()
+
+    with jobs.JobQueue(path) as queue:
+        job = queue.get(1)
+        assert set(job["timings"]) == {"load", "cff", "erddap", "wait"}
+        failed = queue.get(7)
+        assert failed["attempts"] == 2
+        assert "FileNotFoundError" in failed["error"]
+
+
+def test_cli_enqueue_worker(tmp_path, sources):
+    path = str(tmp_path / "jobs.sqlite")
+    output_dir = tmp_path / "output"
+    runner = CliRunner()
+    result = runner.invoke(
+        cli,
+        ["enqueue", *sources, "-q", path, "-f", "cff", "-f", "yaml"]
+        + ["-p", str(output_dir)],
+    )
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(
+        cli, ["worker", "-q", path, "--burst", "--poll-interval", "0.01"]
+    )
+    assert result.exit_code == 0, result.output
+    assert len(list(output_dir.glob("*.cff"))) == 6
+    assert len(list(output_dir.glob("*.yaml"))) == 6
@@ -0,0 +1,103 @@
+import json
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner
+
+from cioos_metadata_conversion.__main__ import cli
+from cioos_metadata_conversion.mirror import FirebaseMirror
+
+FIREBASE_RECORDS = sorted(
+    (Path(__file__).parent / "records" / "firebase").glob("*.json")
+)
+
+
+@pytest.fixture
+def firebase_record():
+    return json.loads(FIREBASE_RECORDS[0].read_text())
+
+
+@pytest.fixture
+def mirror_file(tmp_path, firebase_record):
+    path = tmp_path / "mirror.sqlite"
+    with FirebaseMirror(path) as mirror:
+        mirror.upsert([firebase_record])
+    return path
+
+
+def test_mirror_upsert(mirror_file, firebase_record):
+    with FirebaseMirror(mirror_file) as mirror:
+        # Storing the same record again replaces it
+        mirror.upsert([{**firebase_record, "status": "published"}])
+        rows = list(mirror.iter_records())
+
+    assert len(rows) == 1
+    assert rows[0]["region"] == firebase_record["region"]
+    assert rows[0]["record_id"] == firebase_record["recordID"]
+    assert rows[0]["status"] == "published"
+    assert rows[0]["raw"]["contacts"] == firebase_record["contacts"]
+    assert rows[0]["cioos"]["metadata"]["identifier"] == firebase_record["identifier"]
+
+
+def test_mirror_sync_deletes_missing_records(tmp_path, firebase_record):
+    region = firebase_record["region"]
+    records = [
+        {**firebase_record, "recordID": f"record{index}", "status": status}
+        for index, status in enumerate(["published", "published", "submitted"])
+    ]
+    other_region = {**firebase_record, "region": "other", "recordID": "record0"}
+
+    with FirebaseMirror(tmp_path / "mirror.sqlite") as mirror:
+        assert mirror.sync(records, region) == (3, 0)
+        mirror.upsert([other_region])
+
+        # record1 was deleted from Firebase
+        assert mirror.sync([records[0], records[2]], region) == (2, 1)
+        rows = mirror.iter_records("region = ?", (region,))
+        assert [row["record_id"] for row in rows] == ["record0", "record2"]
+
+        # Only the rows of the statuses fetched are deleted
+        assert mirror.sync([], region, ["published"]) == (0, 1)
+        assert [(row["region"], row["record_id"]) for row in mirror.iter_records()] == [
+            ("other", "record0"),
+            (region, "record2"),
+        ]
+
+
+def test_mirror_sync_failed_fetch(tmp_path, firebase_record):
+    def fetch():
+        yield firebase_record
+        raise ConnectionError("Firebase unavailable")
+
+    with FirebaseMirror(tmp_path / "mirror.sqlite") as mirror:
+        mirror.upsert([{**firebase_record, "recordID": "other"}])
+        with pytest.raises(ConnectionError):
+            mirror.sync(fetch(), firebase_record["region"])
+        assert [row["record_id"] for row in mirror.iter_records()] == ["other"]
+
+
+def test_mirror_where(mirror_file, firebase_record):
+    with FirebaseMirror(mirror_file) as mirror:
+        assert mirror.get_cioos_records("region = ?", (firebase_record["region"],))
+        assert not mirror.get_cioos_records("status = 'published'")
+
+
+def test_cli_convert_from_mirror(mirror_file, firebase_record, tmp_path):
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+    result = CliRunner().invoke(
+        cli,
+        [
+            "convert",
+            "--mirror",
+            str(mirror_file),
+            "--where",
+            f"region = '{firebase_record['region']}'",
+            "--output-format",
+            "cff",
+            "--output-dir",
+            str(output_dir),
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert (output_dir / f"{firebase_record['recordID']}.cff").exists()
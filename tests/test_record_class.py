@@ -1,10 +1,16 @@
-from cioos_metadata_conversion.record import Record, OUTPUT_FORMATS
-import pytest
-from pathlib import Path
+import asyncio
+import json
 import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 
+import pytest
 from dotenv import load_dotenv
 
+from cioos_metadata_conversion.record import OUTPUT_FORMATS, Record, convert_many_async
+
 load_dotenv()
 LOCAL_RECORDS_PATH = os.getenv("LOCAL_RECORDS_PATH", "tests/records")
 
@@ -73,3 +79,147 @@ def test_real_world_records(record, output_format):
     )
     assert result
     assert isinstance(result, str)
+
+
+def _copy_records(tmp_path, record_file_yaml, n_records=6):
+    files = []
+    for index in range(n_records):
+        file = tmp_path / f"record_{index}.yaml"
+        file.write_text(Path(record_file_yaml).read_text())
+        files.append(str(file))
+    return files
+
+
+def test_record_aload(record_file_yaml):
+    record = asyncio.run(Record(source=record_file_yaml, schema="CIOOS").aload())
+    assert record.metadata == Record(source=record_file_yaml).load().metadata
+
+
+def test_record_aload_does_not_block(record_file_yaml, monkeypatch):
+    load = Record.load
+
+    def slow_load(self, encoding="utf-8"):
+        time.sleep(0.2)
+        return load(self, encoding)
+
+    monkeypatch.setattr(Record, "load", slow_load)
+
+    async def main():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        await Record(source=record_file_yaml).aload()
+        ticker.cancel()
+        return ticks
+
+    assert asyncio.run(main()) >= 5
+
+
+def test_record_aconvert_to(record_file_yaml):
+    record = Record(source=record_file_yaml).load()
+
+    async def main():
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            return await record.aconvert_to("cff", executor=executor)
+
+    assert asyncio.run(main()) == record.convert_to("cff")
+
+
+def test_convert_many_async(record_file_yaml, tmp_path, monkeypatch):
+    files = _copy_records(tmp_path, record_file_yaml)
+    expected = Record(source=record_file_yaml).load().convert_to("erddap")
+
+    active = max_active = 0
+    lock = threading.Lock()
+    load = Record.load
+
+    def counting_load(self, encoding="utf-8"):
+        nonlocal active, max_active
+        with lock:
+            active += 1
+            max_active = max(max_active, active)
+        time.sleep(0.05)
+        try:
+            return load(self, encoding)
+        finally:
+            with lock:
+                active -= 1
+
+    monkeypatch.setattr(Record, "load", counting_load)
+
+    async def main():
+        return [
+            item async for item in convert_many_async(files, "erddap", concurrency=2)
+        ]
+
+    results = asyncio.run(main())
+    assert sorted(source for source, _ in results) == sorted(files)
+    assert all(output == expected for _, output in results)
+    assert max_active == 2
+
+
+def test_convert_many_async_errors(record_file_yaml, tmp_path):
+    files = _copy_records(tmp_path, record_file_yaml, 2)
+    files.append(str(tmp_path / "missing.yaml"))
+
+    async def main(**kwargs):
+        return dict([item async for item in convert_many_async(files, "cff", **kwargs)])
+
+    results = asyncio.run(main(return_exceptions=True))
+    assert isinstance(results[files[-1]], FileNotFoundError)
+    assert "cff-version: 1.2.0" in results[files[0]]
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(main())
+
+
+def test_convert_many_async_cancel(record_file_yaml, tmp_path):
+    files = _copy_records(tmp_path, record_file_yaml, 10)
+    consumed = []
+
+    async def sources():
+        for file in files:
+            consumed.append(file)
+            yield file
+
+    async def main():
+        results = convert_many_async(sources(), "json", concurrency=2)
+        async for source, output in results:
+            break
+        await results.aclose()
+        return source, output
+
+    source, output = asyncio.run(main())
+    assert source in consumed
+    assert json.loads(output)["metadata"]
+    # Only the records of the concurrency window were started
+    assert len(consumed) <= 3
+
+
+def test_convert_many_async_cancelled_record(record_file_yaml, tmp_path):
+    files = _copy_records(tmp_path, record_file_yaml, 3)
+
+    class CancelledRecord(Record):
+        async def aload(self, encoding="utf-8"):
+            # Cancelled from within, ex: by the executor shutting down
+            asyncio.current_task().cancel()
+            await asyncio.sleep(0)
+
+    cancelled = CancelledRecord(source=files[0])
+
+    async def main(**kwargs):
+        sources = [cancelled, *files[1:]]
+        return dict(
+            [item async for item in convert_many_async(sources, "cff", **kwargs)]
+        )
+
+    results = asyncio.run(main(return_exceptions=True))
+    assert isinstance(results[cancelled], asyncio.CancelledError)
+    assert all("cff-version: 1.2.0" in results[file] for file in files[1:])
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(main())
@@ -0,0 +1,107 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from cioos_metadata_conversion import sharding
+
+KEYS = [f"records/record_{index}.yaml" for index in range(100)]
+
+
+@pytest.mark.parametrize("value,expected", [("1/1", (1, 1)), ("3/4", (3, 4))])
+def test_parse_shard(value, expected):
+    assert sharding.parse_shard(value) == expected
+
+
+@pytest.mark.parametrize("value", ["0/2", "3/2", "1/0", "1", "a/b", "1/2/3"])
+def test_parse_shard_invalid(value):
+    with pytest.raises(ValueError):
+        sharding.parse_shard(value)
+
+
+def test_shard_of_is_stable():
+    # The partition must not change between processes, nodes or versions
+    assert sharding.shard_of("records/record_0.yaml", 4) == 3
+    assert sharding.shard_of("records/record_1.yaml", 4) == 4
+
+
+def test_shards_partition_inputs():
+    shards = [
+        [key for key in KEYS if sharding.in_shard(key, (index, 3))]
+        for index in range(1, 4)
+    ]
+    assert sorted(key for shard in shards for key in shard) == sorted(KEYS)
+    assert all(20 < len(shard) < 50 for shard in shards)
+    assert all(sharding.in_shard(key, None) for key in KEYS)
+
+
+def test_record_key(record):
+    assert sharding.record_key(record) == record["metadata"]["identifier"]
+    record = {**record, "metadata": {}}
+    assert sharding.record_key(record) == sharding.record_key(dict(record))
+
+
+def _write_manifests(tmp_path, count=3, keys=KEYS):
+    files = []
+    for index in range(1, count + 1):
+        inputs = [key for key in keys if sharding.in_shard(key, (index, count))]
+        file = tmp_path / f"manifest.{index}-of-{count}.json"
+        sharding.write_manifest(
+            file,
+            "convert",
+            (index, count),
+            keys,
+            inputs,
+            [key.replace(".yaml", ".cff") for key in inputs],
+        )
+        files.append(file)
+    return files
+
+
+def test_merge_manifests(tmp_path):
+    files = _write_manifests(tmp_path)
+    merged = sharding.merge_manifests([json.loads(file.read_text()) for file in files])
+    assert merged["inputs"] == sorted(KEYS)
+    assert len(merged["outputs"]) == len(KEYS)
+    assert merged["shards"] == 3
+    assert merged["failed"] == []
+
+
+def test_merge_manifests_missing_shard(tmp_path):
+    manifests = [json.loads(file.read_text()) for file in _write_manifests(tmp_path)]
+    with pytest.raises(ValueError, match=r"Missing shards \[2\] of 3"):
+        sharding.merge_manifests([manifests[0], manifests[2]])
+    with pytest.raises(ValueError, match=r"Shards \[1\] found more than once"):
+        sharding.merge_manifests(manifests + [manifests[0]])
+
+
+def test_merge_manifests_different_inputs(tmp_path):
+    manifests = [json.loads(file.read_text()) for file in _write_manifests(tmp_path)]
+    other = json.loads(_write_manifests(tmp_path, keys=KEYS[:-1])[1].read_text())
+    with pytest.raises(ValueError, match="different inputs_digest"):
+        sharding.merge_manifests([manifests[0], other, manifests[2]])
+
+
+def test_merge_manifests_duplicates(tmp_path):
+    manifests = [json.loads(file.read_text()) for file in _write_manifests(tmp_path)]
+    manifests[0]["inputs"].append(manifests[1]["inputs"][0])
+    manifests[2]["outputs"].append(manifests[1]["outputs"][0])
+    with pytest.raises(ValueError) as error:
+        sharding.merge_manifests(manifests)
+    assert "1 inputs in several shards" in str(error.value)
+    assert "1 outputs in several shards" in str(error.value)
+    assert "1 inputs don't belong to shard 1" in str(error.value)
+
+
+def test_merge_manifests_cli(tmp_path):
+    files = _write_manifests(tmp_path)
+    output = tmp_path / "merged.json"
+    result = CliRunner().invoke(
+        sharding.merge, [str(file) for file in files] + ["--output", str(output)]
+    )
+    assert result.exit_code == 0, result.output
+    assert json.loads(output.read_text())["inputs"] == sorted(KEYS)
+
+    result = CliRunner().invoke(sharding.merge, [str(files[0])])
+    assert result.exit_code == 1
+    assert "Missing shards [2, 3] of 3" in result.output
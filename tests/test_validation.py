@@ -0,0 +1,298 @@
+import datetime
+import json
+from pathlib import Path
+
+import pytest
+import yaml
+from click.testing import CliRunner
+
+from cioos_metadata_conversion import citation_cff, datacite, validation
+from cioos_metadata_conversion.__main__ import cli
+from cioos_metadata_conversion.record import Record
+
+# Minimal DataCite like schema accepting any resource content
+TEST_XSD = """<?xml version="1.0"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+    targetNamespace="http://datacite.org/schema/kernel-4"
+    xmlns="http://datacite.org/schema/kernel-4" elementFormDefault="qualified">
+  <xs:element name="resource">
+    <xs:complexType>
+      <xs:sequence>
+        <xs:any processContents="skip" minOccurs="0" maxOccurs="unbounded"/>
+      </xs:sequence>
+      <xs:anyAttribute processContents="skip"/>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>
+"""
+
+
+@pytest.fixture
+def datacite_xsd(tmp_path, monkeypatch):
+    xsd = tmp_path / "metadata.xsd"
+    xsd.write_text(TEST_XSD)
+    monkeypatch.setenv("DATACITE_XSD", str(xsd))
+    return xsd
+
+
+def test_validate_cff(record):
+    document = citation_cff.citation_cff(record)
+    assert validation.validate("cff", document) == []
+
+    errors = validation.validate("cff", document.replace("cff-version", "version"))
+    assert errors
+    assert errors[0]["path"] == "/"
+    assert "cff-version" in errors[0]["message"]
+
+
+def test_validate_datacite_json(record):
+    document = json.loads(datacite.to_json(record))
+    assert validation.validate("datacite_json", json.dumps(document)) == []
+
+    document["titles"][0]["title"] = 1
+    errors = validation.validate("datacite_json", json.dumps(document))
+    assert [error["path"] for error in errors] == ["/titles/0/title"]
+
+
+def test_validate_datacite_xml(record, datacite_xsd):
+    document = datacite.to_xml(record)
+    assert validation.validate("datacite_xml", document) == []
+    # The compiled schema is reused
+    assert validation.get_xml_schema(str(datacite_xsd)) is validation.get_xml_schema(
+        str(datacite_xsd)
+    )
+
+    document = document.replace("<resource", "<record").replace(
+        "</resource", "</record"
+    )
+    errors = validation.validate("datacite_xml", document)
+    assert errors
+    assert errors[0]["line"] == 2
+    assert "record" in errors[0]["message"]
+
+
+def test_validate_without_schema(record, monkeypatch):
+    monkeypatch.delenv("ISO19115_3_XSD", raising=False)
+    assert validation.validate("iso19115-3_xml", "<xml/>") is None
+    assert validation.validate("erddap", "") is None
+
+
+def test_cli_convert_validate(tmp_path):
+    report = tmp_path / "report.json"
+    result = CliRunner().invoke(
+        cli,
+        [
+            "convert",
+            "--input",
+            "tests/records/*.yaml",
+            "--output-format",
+            "cff",
+            "--output-dir",
+            str(tmp_path),
+            "--validate",
+            "--validation-report",
+            str(report),
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert json.loads(report.read_text()) == {
+        "invalid_records": [],
+        "validated": 1,
+        "failures": [],
+    }
+
+
+def test_cli_convert_validate_failure(tmp_path, datacite_xsd):
+    datacite_xsd.write_text(TEST_XSD.replace('name="resource"', 'name="record"'))
+    validation.get_xml_schema.cache_clear()
+    report = tmp_path / "report.json"
+    result = CliRunner().invoke(
+        cli,
+        [
+            "convert",
+            "--input",
+            "tests/records/*.yaml",
+            "--output-format",
+            "datacite_xml",
+            "--output-dir",
+            str(tmp_path),
+            "--validate",
+            "--validation-report",
+            str(report),
+        ],
+    )
+    assert result.exit_code == 1
+    failures = json.loads(report.read_text())["failures"]
+    assert failures[0]["format"] == "datacite_xml"
+    assert failures[0]["errors"][0]["message"]
+
+
+@pytest.mark.parametrize("output_format", [None, "erddap", "cff", "datacite_json"])
+def test_validate_record(record, output_format):
+    assert validation.validate_record(record, output_format) == []
+    assert validation.get_record_validator(
+        output_format
+    ) is validation.get_record_validator(output_format)
+
+
+def test_validate_record_yaml_dates(tmp_path):
+    text = Path("tests/records/test_record1.yaml").read_text(encoding="utf-8")
+    text = text.replace("publication: '2024-03-19'", "publication: 2024-03-19")
+    text = text.replace(
+        "revision: '2024-03-18T19:28:21.285Z'", "revision: 2024-03-18T19:28:21.285Z"
+    )
+    record = yaml.safe_load(text)
+    assert isinstance(record["metadata"]["dates"]["publication"], datetime.date)
+    assert isinstance(record["metadata"]["dates"]["revision"], datetime.datetime)
+    for output_format in (None, "erddap", "cff", "datacite_json"):
+        assert validation.validate_record(record, output_format) == []
+
+    # Other types are still rejected
+    record["metadata"]["dates"]["publication"] = 20240319
+    errors = validation.validate_record(record)
+    assert errors[0]["path"] == "/metadata/dates/publication"
+
+    (tmp_path / "record.yaml").write_text(text, encoding="utf-8")
+    result = CliRunner().invoke(
+        cli,
+        [
+            "convert",
+            "--input",
+            str(tmp_path / "record.yaml"),
+            "--output-format",
+            "cff",
+            "--output-dir",
+            str(tmp_path),
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert (tmp_path / "record.cff").exists()
+
+
+def test_validate_record_errors(record):
+    record = {
+        **record,
+        "identification": {**record["identification"], "title": {"en": ["Title"]}},
+        "contact": [{"organization": {"name": "Hakai"}}],
+    }
+    record.pop("spatial")
+
+    errors = validation.validate_record(record)
+    assert [error["path"] for error in errors] == [
+        "/contact/0",
+        "/identification/title/en",
+    ]
+    assert "'roles' is a required property" in errors[0]["message"]
+
+    # The spatial coverage is only required by DataCite
+    errors = validation.validate_record(record, "datacite_json")
+    assert errors[0] == {"path": "/", "message": "'spatial' is a required property"}
+
+    with pytest.raises(validation.InvalidRecordError, match="/contact/0: 'roles'"):
+        Record(record).load().validate("erddap")
+
+
+def test_cli_convert_invalid_record(record, tmp_path):
+    invalid = {**record, "metadata": {**record["metadata"], "dates": {}}}
+    (tmp_path / "valid.yaml").write_text(yaml.dump(record))
+    (tmp_path / "invalid.yaml").write_text(yaml.dump(invalid))
+    report = tmp_path / "report.json"
+
+    result = CliRunner().invoke(
+        cli,
+        [
+            "convert",
+            "--input",
+            str(tmp_path / "*.yaml"),
+            "--output-format",
+            "cff",
+            "--output-dir",
+            str(tmp_path),
+            "--validation-report",
+            str(report),
+        ],
+    )
+    assert result.exit_code == 1
+    assert (tmp_path / "valid.cff").exists()
+    assert not (tmp_path / "invalid.cff").exists()
+    invalid_records = json.loads(report.read_text())["invalid_records"]
+    assert invalid_records == [
+        {
+            "file": str(tmp_path / "invalid.yaml"),
+            "errors": [
+                {
+                    "path": "/metadata/dates",
+                    "message": "'revision' is a required property",
+                }
+            ],
+        }
+    ]
+
+
+def test_cli_convert_missing_translation(record, tmp_path):
+    identification = record["identification"]
+    english = {
+        **record,
+        "identification": {
+            **identification,
+            "title": {"en": identification["title"]["en"]},
+            "abstract": {"en": identification["abstract"]["en"]},
+        },
+    }
+    (tmp_path / "english.yaml").write_text(yaml.dump(english))
+    report = tmp_path / "report.json"
+
+    def convert(language):
+        return CliRunner().invoke(
+            cli,
+            [
+                "convert",
+                "--input",
+                str(tmp_path / "english.yaml"),
+                "--output-format",
+                "erddap",
+                "--output-dir",
+                str(tmp_path),
+                "--language",
+                language,
+                "--validation-report",
+                str(report),
+            ],
+        )
+
+    result = convert("en,fr")
+    assert result.exit_code == 1
+    assert not isinstance(result.exception, KeyError)
+    assert not list(tmp_path.glob("*.erddap"))
+    errors = json.loads(report.read_text())["invalid_records"][0]["errors"]
+    assert errors == [
+        {"path": "/identification/abstract", "message": "'fr' is a required property"},
+        {"path": "/identification/title", "message": "'fr' is a required property"},
+    ]
+
+    result = convert("en")
+    assert result.exit_code == 0, result.output
+    assert (tmp_path / "english.en.erddap").exists()
+
+
+@pytest.mark.parametrize("output_format", ["json", "yaml"])
+def test_cli_convert_dump_partial_record(tmp_path, output_format):
+    record = {"metadata": {"identifier": "abc"}}
+    (tmp_path / "records").mkdir()
+    (tmp_path / "records" / "partial.yaml").write_text(yaml.dump(record))
+    assert validation.validate_record(record, "erddap")
+
+    result = CliRunner().invoke(
+        cli,
+        [
+            "convert",
+            "--input",
+            str(tmp_path / "records" / "partial.yaml"),
+            "--output-format",
+            output_format,
+            "--output-dir",
+            str(tmp_path),
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert (tmp_path / f"partial.{output_format}").exists()
@@ -3,7 +3,7 @@ from glob import glob
 import pytest
 
 from cioos_metadata_conversion.__main__ import load
-from cioos_metadata_conversion.xml import xml
+from cioos_metadata_conversion.xml import iter_xml, metadata_to_xml, write_xml, xml
 
 
 def test_xml(record):
@@ -22,3 +22,25 @@ def test_cioos_records_xml(file):
 
     assert result
     assert isinstance(result, str)
+
+
+def test_xml_warm_environment(record):
+    expected = metadata_to_xml(record)
+    assert xml(record) == expected
+    assert xml(record) == expected
+
+
+def test_iter_xml(record):
+    records = [record] * 3
+    expected = [metadata_to_xml(item) for item in records]
+    assert list(iter_xml(records)) == expected
+    assert list(iter_xml(records, workers=2)) == expected
+
+
+def test_write_xml(record, tmp_path):
+    output = tmp_path / "records.xml"
+    with open(output, "w", encoding="utf-8") as file:
+        assert write_xml([record, record], file) == 2
+
+    document = metadata_to_xml(record).rstrip("\n") + "\n"
+    assert output.read_text(encoding="utf-8") == document * 2
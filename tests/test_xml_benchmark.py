@@ -0,0 +1,38 @@
+"""
+Benchmark of the ISO 19115-3 rendering with a cold and a warm template environment.
+
+Only a few records are rendered by default. Set the number of records, ex:
+
+    XML_BENCHMARK_RECORDS=1000 pytest tests/test_xml_benchmark.py -p no:xdist
+
+The time per record of each run is then written to tests/results/xml_benchmark.json.
+"""
+
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from tests.synthetic import run_xml_render
+
+BENCHMARK_RECORDS = os.environ.get("XML_BENCHMARK_RECORDS")
+N_RECORDS = int(BENCHMARK_RECORDS) if BENCHMARK_RECORDS else 20
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def test_xml_render_benchmark():
+    results = []
+    for warm in (False, True):
+        # Run each rendering in a fresh process, the cold one isn't warmed up
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            results.append(executor.submit(run_xml_render, N_RECORDS, warm).result())
+
+    cold, warm = results
+    assert warm["digest"] == cold["digest"]
+
+    if BENCHMARK_RECORDS:
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        (RESULTS_DIR / "xml_benchmark.json").write_text(json.dumps(results, indent=2))